@@ -23,6 +23,14 @@ load_dotenv(env_path)
 
 # Import các cấu hình - by Chương
 from config import init_db
+from services.warm_pool import warm_pool
+from services.container_state import container_state
+from services import idle_reaper
+from services.mission_provisioner import mission_provisioner
+from services.port_allocator import port_allocator
+from services.compile_workers import compile_workers
+from services.compile_daemon import compile_daemons
+from services.compile_queue import compile_queue
 
 # Gọi các module điều hướng - by Chương
 from routes.auth import auth_bp
@@ -133,6 +141,22 @@ def main():
     try:
         # Initialize database
         init_db()
+        # Tạo lease cho dải cổng SSH, thu hồi cổng của user/container warm đã xóa
+        port_allocator.sync()
+        # Theo dõi Docker events để biết trạng thái container mà không cần inspect mỗi request
+        container_state.start()
+        # Cho container không hoạt động đi ngủ để giải phóng RAM
+        idle_reaper.start()
+        # Dựng sẵn container cho user mới (WARM_POOL_SIZE > 0)
+        warm_pool.start()
+        # Chuẩn bị container cho sinh viên trước giờ thi (MISSION_PREPROVISION_LEAD > 0)
+        mission_provisioner.start()
+        # Container biên dịch dùng chung (COMPILE_WORKERS > 0)
+        compile_workers.start()
+        # Tạo sẵn instance arduino-cli daemon trong các worker (COMPILE_DAEMON)
+        compile_daemons.start()
+        # Hàng đợi biên dịch (giới hạn số compile đồng thời, ưu tiên bài thi)
+        compile_queue.start(socketio)
         # Removed USB watcher for Virtual Assessment architecture
         logger.info("🔧 Background services tracking USB disabled for Virtual AI assessment.")
         background_services = None
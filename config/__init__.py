@@ -10,6 +10,8 @@ __all__ = [
     'DEFAULT_ARDUINO_LIBRARIES',
     'SYSTEM_CONFIG',
     'HIDDEN_SYSTEM_FILES',
+    'EXCLUDED_DIRS',
+    'SOURCE_FILE_EXTENSIONS',
     'get_db_connection',
     'init_db'
 ]
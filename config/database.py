@@ -33,6 +33,14 @@ def get_db_connection():
         logger.error(f"DATABASE POOL CONNECTION ERROR: {e}")
         return None
 
+def _add_column_if_missing(cur, table, column, definition):
+    """ALTER TABLE ADD COLUMN for databases created by an older version"""
+    try:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    except mysql.connector.Error as e:
+        if e.errno != 1060:  # ER_DUP_FIELDNAME: cột đã có
+            raise
+
 def init_db():
     """Khởi tạo cấu trúc bảng CSDL và tạo user Admin mặc định - by Chương"""
     db = get_db_connection()
@@ -139,6 +147,7 @@ def init_db():
             score DECIMAL(4, 2) NULL,
             ai_feedback TEXT NULL,
             ai_criteria JSON NULL,
+            snapshot_ms INT NULL,
             submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (mission_id) REFERENCES missions(id) ON DELETE CASCADE,
             FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
@@ -146,6 +155,29 @@ def init_db():
         )
     """)
     
+    # Thời gian chụp snapshot workspace khi nộp bài (ms)
+    _add_column_if_missing(cur, "submissions", "snapshot_ms", "INT NULL")
+    
+    # Nội dung file bài nộp, lưu một lần theo SHA-256 (submissions.files chỉ giữ manifest)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS submission_blobs (
+            sha256 CHAR(64) PRIMARY KEY,
+            size INT NOT NULL,
+            compression VARCHAR(8) NOT NULL DEFAULT 'gzip',
+            data LONGBLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Lease cổng SSH trên host (một dòng mỗi cổng, holder = username hoặc tên container warm)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ssh_port_leases (
+            port INT PRIMARY KEY,
+            holder VARCHAR(64) NULL UNIQUE,
+            leased_at TIMESTAMP NULL
+        )
+    """)
+    
     # Tạo user Admin mặc định nếu chưa tồn tại - by Chương
     cur.execute("SELECT id FROM users WHERE username='admin'")
     if not cur.fetchone():
@@ -41,8 +41,84 @@ DEFAULT_ARDUINO_LIBRARIES = [
 # Các hằng số hệ thống cho môi trường Docker ảo hóa máy ảo - by Chương
 SYSTEM_CONFIG = {
     'BASE_SSH_PORT': int(os.getenv('BASE_SSH_PORT', 2000)),
-    'MAX_WORKSPACE_FILE_SIZE': 5242880,  # 5MB
+    # Dải cổng host cho sshd của container user/warm (lease trong bảng ssh_port_leases)
+    'SSH_PORT_RANGE_START': int(os.getenv('SSH_PORT_RANGE_START', 2200)),
+    'SSH_PORT_RANGE_END': int(os.getenv('SSH_PORT_RANGE_END', 2299)),
+    'MAX_WORKSPACE_FILE_SIZE': 5242880,  # 5MB, lớn nhất mở được trong editor
+    'MAX_UPLOAD_FILE_SIZE': int(os.getenv('MAX_UPLOAD_FILE_SIZE', 52428800)),  # 50MB mỗi file upload
     'AI_GRADER_TIMEOUT': 45,             # seconds
+    # Nơi lưu workspace: 'sftp' (qua SSH vào container) hoặc 'local' (đọc thẳng thư mục bind-mount trên host)
+    'WORKSPACE_BACKEND': os.getenv('WORKSPACE_BACKEND', 'sftp'),
+    'WORKSPACE_HOST_ROOT': os.getenv('WORKSPACE_HOST_ROOT', '/home/toan/QUAN_LY_USER'),
+    'FS_BATCH_MAX_OPS': 50,              # số thao tác tối đa trong một request /fs/batch
+    # Cache danh sách thư mục (LRU, xóa khi ghi qua API / inotify / mtime đổi)
+    'LISTING_CACHE_MAX_ENTRIES': int(os.getenv('LISTING_CACHE_MAX_ENTRIES', 2000)),
+    'LISTING_CACHE_TTL': 15,             # seconds, khi chỉ kiểm tra được mtime (SFTP)
+    'LISTING_CACHE_WATCHED_TTL': 300,    # seconds, khi thư mục có inotify watch
+    'WORKSPACE_TREE_MAX_DEPTH': 5,       # số cấp thư mục tối đa khi duyệt cây workspace
+    'SUBMISSION_FILE_CONTENT_LIMIT': 50000,      # bytes nội dung giữ lại cho mỗi file khi nộp bài
+    'SUBMISSION_SNAPSHOT_MAX_BYTES': 1048576,    # 1MB nội dung tối đa cho một bài nộp
+    # Container runtime: 'docker' (Engine API qua unix socket) hoặc 'memory' (giả lập cho test)
+    'CONTAINER_RUNTIME': os.getenv('CONTAINER_RUNTIME', 'docker'),
+    'DOCKER_HOST': os.getenv('DOCKER_HOST', 'unix:///var/run/docker.sock'),
+    'CONTAINER_EVENTS_WINDOW': 300,      # seconds: sau mỗi cửa sổ Docker events thì đối chiếu lại toàn bộ danh sách
+    # Core + thư viện Arduino dùng chung (read-only) cho mọi container: <ROOT>/<VERSION>
+    'ARDUINO_SHARED_ROOT': os.getenv('ARDUINO_SHARED_ROOT', '/srv/epu/arduino-shared'),
+    'ARDUINO_SHARED_VERSION': os.getenv('ARDUINO_SHARED_VERSION', 'v1'),
+    # Pool phiên SSH/SFTP theo từng user (giữ Transport đã xác thực giữa các request)
+    'SSH_POOL_MAX_SESSIONS': int(os.getenv('SSH_POOL_MAX_SESSIONS', 200)),
+    'SSH_POOL_IDLE_TTL': int(os.getenv('SSH_POOL_IDLE_TTL', 600)),              # seconds
+    'SSH_POOL_HEALTHCHECK_INTERVAL': int(os.getenv('SSH_POOL_HEALTHCHECK_INTERVAL', 30)),  # seconds
+    # Chờ sshd trong container sẵn sàng (backoff + circuit breaker)
+    'CONTAINER_READY_TIMEOUT': int(os.getenv('CONTAINER_READY_TIMEOUT', 30)),   # seconds
+    'READINESS_BACKOFF_BASE': 0.2,       # seconds
+    'READINESS_BACKOFF_MAX': 3.0,        # seconds
+    'READINESS_BREAKER_THRESHOLD': 2,    # lần chờ thất bại liên tiếp trước khi ngắt mạch
+    'READINESS_BREAKER_COOLDOWN': 30,    # seconds
+    # Giới hạn cgroup cho mỗi container user; compile được tạm nâng CPU (burst) theo credit
+    'CONTAINER_CPU_LIMIT': float(os.getenv('CONTAINER_CPU_LIMIT', 1.0)),     # CPU, 0 = không giới hạn
+    'CONTAINER_MEMORY_LIMIT': os.getenv('CONTAINER_MEMORY_LIMIT', '1g'),      # rỗng = không giới hạn
+    'CONTAINER_PIDS_LIMIT': int(os.getenv('CONTAINER_PIDS_LIMIT', 512)),
+    'COMPILE_CPU_BURST': float(os.getenv('COMPILE_CPU_BURST', 2.0)),         # CPU trong lúc compile
+    'COMPILE_BURST_SLOTS': int(os.getenv('COMPILE_BURST_SLOTS', 0)),         # burst đồng thời trên host, 0 = số CPU / COMPILE_CPU_BURST
+    'COMPILE_BURST_CREDIT': 180,         # seconds burst tối đa tích lũy cho một container
+    'COMPILE_BURST_REFILL_SECONDS': 900, # seconds để credit hồi đầy từ 0
+    # Pool container biên dịch dùng chung (0 = compile bằng exec trong container của từng user)
+    'COMPILE_WORKERS': int(os.getenv('COMPILE_WORKERS', 0)),
+    'COMPILE_WORKER_CPUS': float(os.getenv('COMPILE_WORKER_CPUS', 2.0)),
+    'COMPILE_WORKER_MEMORY': os.getenv('COMPILE_WORKER_MEMORY', '2g'),
+    'COMPILE_ARTIFACTS_ROOT': os.getenv('COMPILE_ARTIFACTS_ROOT', '/srv/epu/compile-artifacts'),
+    # Mạng bridge internal chỉ worker tham gia: container user không chạm được tới daemon không xác thực
+    'COMPILE_WORKER_NETWORK': os.getenv('COMPILE_WORKER_NETWORK', 'epu-compile-net'),
+    # arduino-cli daemon (gRPC) trong mỗi worker: giữ sẵn instance cho các platform này, lỗi thì quay về CLI
+    'COMPILE_DAEMON': os.getenv('COMPILE_DAEMON', '1') == '1',
+    'COMPILE_DAEMON_PLATFORMS': [p for p in os.getenv('COMPILE_DAEMON_PLATFORMS', 'esp32:esp32,arduino:avr').split(',') if p],
+    # Cache kết quả biên dịch theo hash mã nguồn + FQBN + phiên bản core/thư viện (LRU trên đĩa, rỗng = tắt)
+    'COMPILE_CACHE_DIR': os.getenv('COMPILE_CACHE_DIR', '/srv/epu/compile-cache'),
+    'COMPILE_CACHE_MAX_BYTES': int(os.getenv('COMPILE_CACHE_MAX_BYTES', 2147483648)),  # 2GB
+    'COMPILE_CACHE_MAX_ENTRIES': int(os.getenv('COMPILE_CACHE_MAX_ENTRIES', 5000)),
+    # Hàng đợi biên dịch: số job chạy đồng thời (0 = số CPU), mỗi user chạy/chờ tối đa bao nhiêu
+    'COMPILE_QUEUE_CONCURRENCY': int(os.getenv('COMPILE_QUEUE_CONCURRENCY', 0)),
+    'COMPILE_QUEUE_PER_USER': int(os.getenv('COMPILE_QUEUE_PER_USER', 1)),
+    'COMPILE_QUEUE_USER_PENDING': int(os.getenv('COMPILE_QUEUE_USER_PENDING', 3)),
+    'COMPILE_QUEUE_RESULT_TTL': 600,     # seconds giữ kết quả job đã xong để client hỏi lại
+    'COMPILE_QUEUE_WAIT_TIMEOUT': 330,   # seconds tối đa /compile chờ kết quả khi gọi với wait=true
+    # Build cache core arduino-cli dùng chung giữa các user (theo FQBN + toolchain + flags, rỗng = tắt)
+    'ARDUINO_BUILD_CACHE_ROOT': os.getenv('ARDUINO_BUILD_CACHE_ROOT', '/srv/epu/arduino-build-cache'),
+    # Idle reaper: dừng ('stop') hoặc tạm dừng ('pause') container không hoạt động, đánh thức khi truy cập lại
+    'IDLE_TIMEOUT': int(os.getenv('IDLE_TIMEOUT', 1800)),                 # seconds, 0 = tắt
+    'IDLE_HIBERNATE_MODE': os.getenv('IDLE_HIBERNATE_MODE', 'stop'),
+    'IDLE_CHECK_INTERVAL': 60,           # seconds giữa hai lần quét
+    'IDLE_ACTIVE_WINDOW': 300,           # seconds: có hoạt động trong khoảng này thì tính là "active" (metric mật độ)
+    # Warm pool: số container dựng sẵn chờ user mới/tạo lại claim (0 = tắt)
+    'WARM_POOL_SIZE': int(os.getenv('WARM_POOL_SIZE', 0)),
+    'WARM_POOL_REFILL_INTERVAL': 5,      # seconds giữa hai lần bổ sung pool
+    'WARM_POOL_START_TIMEOUT': 900,      # seconds tối đa để container warm cài xong môi trường
+    'WARM_POOL_CLAIM_TIMEOUT': 60,       # seconds cho bước gắn user vào container warm
+    # Chuẩn bị trước container + thư mục bài cho toàn bộ sinh viên được giao mission
+    'MISSION_PROVISION_CONCURRENCY': int(os.getenv('MISSION_PROVISION_CONCURRENCY', 8)),
+    'MISSION_PREPROVISION_LEAD': int(os.getenv('MISSION_PREPROVISION_LEAD', 0)),  # phút trước start_time, 0 = chỉ chạy tay
+    'MISSION_PREPROVISION_CHECK_INTERVAL': 60,   # seconds
 }
 
 # Các file hệ thống bị ẩn không cho người dùng thấy - by Chương
@@ -62,3 +138,10 @@ HIDDEN_SYSTEM_FILES = {
     "sketchbook"
 }
 
+# Thư mục không thu thập khi duyệt cây workspace (preview, nộp bài, cây file IDE)
+EXCLUDED_DIRS = {'libraries', 'node_modules', 'venv', '__pycache__', '.git', '.arduino15', 'Arduino'}
+
+# Đuôi file được coi là mã nguồn bài làm
+SOURCE_FILE_EXTENSIONS = ('.ino', '.cpp', '.c', '.h', '.py')
+
+
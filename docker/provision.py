@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Provisioning of the user environment image (installed as /usr/local/bin/epu-provision)
+Cores, libraries and Python packages are pinned in provision-manifest.json and
+installed at image build time. At container start `epu-provision check` only
+compares the manifest with what is on disk (no network, no arduino-cli calls);
+`install` fetches just the missing items, e.g. into an empty shared core volume.
+
+`export <dir>` copies the provisioned cores and libraries into a host directory
+that is then mounted read-only into every user container.
+
+Usage: epu-provision check [--json] | install | report | export <dir>
+"""
+import os
+import sys
+import json
+import shutil
+import subprocess
+from importlib import metadata
+
+MANIFEST_PATH = os.environ.get('EPU_PROVISION_MANIFEST', '/etc/epu/provision-manifest.json')
+ARDUINO_DATA_DIR = os.environ.get('ARDUINO_DATA_DIR', '/root/.arduino15')
+ARDUINO_USER_DIR = os.environ.get('ARDUINO_USER_DIR', '/root/Arduino')
+
+
+def load_manifest(path=MANIFEST_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def core_path(core_id, version, data_dir=ARDUINO_DATA_DIR):
+    packager, arch = core_id.split(':', 1)
+    return os.path.join(data_dir, 'packages', packager, 'hardware', arch, version)
+
+
+def library_version(name, user_dir=ARDUINO_USER_DIR):
+    """Version from library.properties of an installed library, or None"""
+    props = os.path.join(user_dir, 'libraries', name.replace(' ', '_'), 'library.properties')
+    try:
+        with open(props, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                key, _, value = line.partition('=')
+                if key.strip() == 'version':
+                    return value.strip()
+    except OSError:
+        pass
+    return None
+
+
+def python_package_version(dist):
+    try:
+        return metadata.version(dist)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def missing_items(manifest, data_dir=ARDUINO_DATA_DIR, user_dir=ARDUINO_USER_DIR):
+    """[(kind, name, wanted_version, installed_version)] not matching the manifest"""
+    missing = []
+    for core_id, version in manifest.get('cores', {}).items():
+        if not os.path.isdir(core_path(core_id, version, data_dir)):
+            missing.append(('core', core_id, version, None))
+    for name, version in manifest.get('libraries', {}).items():
+        installed = library_version(name, user_dir)
+        if installed != version:
+            missing.append(('library', name, version, installed))
+    for dist, spec in manifest.get('python_packages', {}).items():
+        installed = python_package_version(dist)
+        if installed != spec['version']:
+            missing.append(('python', dist, spec['version'], installed))
+    return missing
+
+
+def _run(cmd):
+    print('+ ' + ' '.join(cmd), flush=True)
+    subprocess.run(cmd, check=True)
+
+
+def install(manifest):
+    missing = missing_items(manifest)
+    if any(kind == 'core' for kind, *_ in missing):
+        urls = ','.join(manifest.get('board_manager_urls', []))
+        if urls:
+            _run(['arduino-cli', 'config', 'set', 'board_manager.additional_urls', urls])
+        _run(['arduino-cli', 'core', 'update-index'])
+    for kind, name, version, installed in missing:
+        if kind == 'core':
+            _run(['arduino-cli', 'core', 'install', f'{name}@{version}'])
+        elif kind == 'library':
+            _run(['arduino-cli', 'lib', 'install', f'{name}@{version}'])
+        elif kind == 'python':
+            _run([sys.executable, '-m', 'pip', 'install', '--no-cache-dir', f'{name}=={version}'])
+    return missing
+
+
+def export(target, manifest_path=MANIFEST_PATH):
+    """Copy data dir + libraries to target; manifest.json is written last as the completion marker"""
+    os.makedirs(target, exist_ok=True)
+    marker = os.path.join(target, 'manifest.json')
+    if os.path.exists(marker):
+        os.remove(marker)
+    for src, name in ((ARDUINO_DATA_DIR, 'arduino15'), (os.path.join(ARDUINO_USER_DIR, 'libraries'), 'libraries')):
+        dst = os.path.join(target, name)
+        if os.path.isdir(dst):
+            shutil.rmtree(dst)
+        shutil.copytree(src, dst, symlinks=True, ignore=shutil.ignore_patterns('staging', '*.lock'))
+    shutil.copyfile(manifest_path, marker)
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'check'
+    manifest = load_manifest()
+    if command == 'check':
+        missing = missing_items(manifest)
+        if '--json' in argv:
+            print(json.dumps([dict(zip(('kind', 'name', 'version', 'installed'), m)) for m in missing]))
+        else:
+            for kind, name, version, installed in missing:
+                print(f"missing {kind} {name}@{version} (installed: {installed or '-'})")
+        return 1 if missing else 0
+    if command == 'install':
+        install(manifest)
+        still_missing = missing_items(manifest)
+        for kind, name, version, _ in still_missing:
+            print(f"failed to provision {kind} {name}@{version}", file=sys.stderr)
+        return 1 if still_missing else 0
+    if command == 'report':
+        print(json.dumps({
+            'manifest_version': manifest.get('version'),
+            'cores': {c: os.path.isdir(core_path(c, v)) and v for c, v in manifest.get('cores', {}).items()},
+            'libraries': {n: library_version(n) for n in manifest.get('libraries', {})},
+            'python_packages': {d: python_package_version(d) for d in manifest.get('python_packages', {})},
+        }, indent=2))
+        return 0
+    if command == 'export' and len(argv) > 2:
+        export(argv[2])
+        return 0
+    print(__doc__, file=sys.stderr)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -2,8 +2,8 @@
 Admin routes: dashboard, user management, device management
 """
 import os
+import json
 import shutil
-import subprocess
 import io
 import pandas as pd
 from math import ceil
@@ -12,7 +12,12 @@ from werkzeug.security import generate_password_hash
 import mysql.connector
 from utils import require_auth, make_safe_name
 from config import get_db_connection
-from services import log_action
+from services import log_action, invalidate_ssh_session, get_host_user_dir
+from services.submission_store import load_submission_files
+from services.container_runtime import get_runtime
+from services.docker_manager import get_startup_report
+from services.mission_provisioner import mission_provisioner
+from services.port_allocator import port_allocator
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -153,14 +158,16 @@ def delete_user(user_id):
         username_raw = user['username']
         safe_username = make_safe_name(username_raw)
         cname = f"{safe_username}-dev"
-        host_user_dir = f"/home/toan/QUAN_LY_USER/{safe_username}"
+        host_user_dir = get_host_user_dir(safe_username)
 
         from flask import current_app
         current_app.logger.info(f"Admin action: Deleting user {username_raw} (Safe name: {safe_username})")
 
+        invalidate_ssh_session(username_raw)
+
         # Remove Docker container
         try:
-            subprocess.run(["docker", "rm", "-f", cname], check=False, timeout=15)
+            get_runtime().remove(cname, force=True)
             current_app.logger.info(f"Removed container: {cname}")
         except Exception as e:
             current_app.logger.error(f"Failed to remove container {cname}: {e}")
@@ -178,6 +185,7 @@ def delete_user(user_id):
         # Remove from database
         cur.execute("DELETE FROM users WHERE id=%s", (user_id,))
         db.commit()
+        port_allocator.release(username_raw)
         
         log_action(session["username"], f"Deleted user '{username_raw}' and folder '{safe_username}'")
         flash(f"Đã xóa hoàn toàn user '{username_raw}' và thư mục dữ liệu.", "success")
@@ -317,10 +325,29 @@ def admin_api_get_missions():
         m['created_at'] = m['created_at'].isoformat() if m['created_at'] else None
         m['start_time'] = m['start_time'].isoformat() if m['start_time'] else None
         m['end_time'] = m['end_time'].isoformat() if m['end_time'] else None
+        m['provisioning'] = mission_provisioner.progress(m['id'])
 
     return jsonify(missions)
 
 
+@admin_bp.route("/api/missions/<int:mission_id>/provision", methods=['POST'])
+@require_auth('admin')
+def admin_api_provision_mission(mission_id):
+    """API to start containers and mission folders for all assignees ahead of the exam"""
+    job = mission_provisioner.submit(mission_id)
+    if not job:
+        return jsonify(success=False, error="Không tìm thấy bài thi"), 404
+    log_action(session['username'], f"Chuẩn bị môi trường cho mission ID: {mission_id} ({job.total} user)")
+    return jsonify(success=True, progress=job.to_dict())
+
+
+@admin_bp.route("/api/missions/<int:mission_id>/provision", methods=['GET'])
+@require_auth('admin')
+def admin_api_provision_progress(mission_id):
+    """API to get bulk provisioning progress of a mission"""
+    return jsonify(success=True, progress=mission_provisioner.progress(mission_id))
+
+
 @admin_bp.route("/api/missions/<int:mission_id>", methods=['DELETE'])
 @require_auth('admin')
 def admin_api_delete_mission(mission_id):
@@ -360,6 +387,48 @@ def admin_api_update_mission(mission_id):
         db.close()
     return jsonify(success=success, message=message)
 
+@admin_bp.route("/api/submissions/<int:submission_id>/files", methods=['GET'])
+@require_auth('admin')
+def admin_api_submission_files(submission_id):
+    """API to get a submission's file list; ?path=<path> also loads that file's content"""
+    path = request.args.get('path')
+    db = get_db_connection()
+    cur = db.cursor(dictionary=True)
+    try:
+        cur.execute("SELECT files FROM submissions WHERE id = %s", (submission_id,))
+        row = cur.fetchone()
+        if not row:
+            return jsonify(success=False, error="Không tìm thấy bài nộp"), 404
+        manifest = json.loads(row['files'] or '[]')
+        if not path:
+            files = [{k: v for k, v in f.items() if k != 'content'} for f in manifest]
+            return jsonify(success=True, files=files)
+        files = load_submission_files(cur, manifest, paths={path})
+        if not files:
+            return jsonify(success=False, error="Không tìm thấy file"), 404
+        return jsonify(success=True, file=files[0])
+    finally:
+        cur.close()
+        db.close()
+
+@admin_bp.route("/api/containers/startup-report", methods=['GET'])
+@require_auth('admin')
+def admin_api_startup_report():
+    """API to get per-phase startup timings of running user containers"""
+    reports = []
+    for cname in get_runtime().list_names(name_filter="-dev"):
+        report = get_startup_report(cname)
+        if report:
+            reports.append(report)
+    summary = {}
+    for report in reports:
+        for phase, seconds in report['phases'].items():
+            stat = summary.setdefault(phase, {'count': 0, 'avg': 0.0, 'max': 0.0})
+            stat['count'] += 1
+            stat['avg'] += (seconds - stat['avg']) / stat['count']
+            stat['max'] = max(stat['max'], seconds)
+    return jsonify(success=True, containers=reports, summary=summary)
+
 @admin_bp.route("/api/missions/<int:mission_id>/export", methods=['GET'])
 @require_auth('admin')
 def admin_api_export_mission(mission_id):
@@ -6,18 +6,27 @@ import re
 import unicodedata
 import json
 import stat
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
+from contextlib import ExitStack
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, Response
 from werkzeug.utils import secure_filename
-from utils import require_auth, make_safe_name, is_safe_path
-from config import HIDDEN_SYSTEM_FILES
+from utils import require_auth, make_safe_name, is_safe_path, is_sketch_filename
+from config import HIDDEN_SYSTEM_FILES, SYSTEM_CONFIG
 from services import (
-    ensure_user_container_and_setup, get_ssh_client,
-    compile_sketch, log_action
+    ensure_user_container_and_setup, open_workspace,
+    log_action
 )
 from config.database import get_db_connection
 from services.ai_grader import grade_submission_with_ai
+from services.submission_store import store_submission_files
+from services.mission_provisioner import create_mission_files
+from services.compile_queue import compile_queue, QueueFull, compile_lane
+from services.container_runtime import get_runtime
 from utils.helpers import slugify_vn
-from services.workspace_manager import list_workspace_files, load_workspace_file, save_workspace_file
+from services.workspace_manager import (
+    list_workspace_files, load_workspace_file, save_workspace_file, run_workspace_batch,
+    build_workspace_manifest, list_source_files, snapshot_source_files,
+    stream_workspace_file, write_upload_chunk
+)
 
 user_bp = Blueprint('user', __name__, url_prefix='/user')
 
@@ -60,14 +69,8 @@ def list_files_api(username):
         return jsonify(error="Invalid path"), 400
     
     try:
-        from services.ssh_manager import get_ssh_client
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        
-        result = list_workspace_files(username, safe_username, sftp, path)
-        
-        sftp.close()
-        client.close()
+        with open_workspace(username) as fs:
+            result = list_workspace_files(username, safe_username, fs, path)
         
         if result["success"]:
             return jsonify(files=result["files"], path=result["path"])
@@ -101,14 +104,10 @@ def create_folder_api(username):
         return jsonify(success=False, error="Invalid path"), 400
 
     try:
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        
         full_path = os.path.join(home_dir, path, folder_name)
-        sftp.mkdir(full_path)
+        with open_workspace(username) as fs:
+            fs.mkdir(os.path.join(path, folder_name))
         
-        sftp.close()
-        client.close()
         log_action(username, f"Create folder: {full_path}")
         return jsonify(success=True)
     except Exception as e: 
@@ -132,22 +131,19 @@ def upload_files_api(username):
         return jsonify(success=False, error="No files provided"), 400
     if not is_safe_path(home_dir, path): 
         return jsonify(success=False, error="Invalid path"), 400
+    if request.content_length and request.content_length > SYSTEM_CONFIG['MAX_UPLOAD_FILE_SIZE']:
+        return jsonify(success=False, error="Upload quá lớn, hãy dùng upload-chunk"), 413
 
     try:
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        
         count = 0
-        for file in files:
-            if file.filename:
-                safe_filename = secure_filename(file.filename)
-                target_path = os.path.join(home_dir, path, safe_filename)
-                
-                sftp.putfo(file, target_path)
-                count += 1
+        with open_workspace(username) as fs:
+            for file in files:
+                if file.filename:
+                    safe_filename = secure_filename(file.filename)
+                    
+                    fs.upload(file, os.path.join(path, safe_filename))
+                    count += 1
                 
-        sftp.close()
-        client.close()
         log_action(username, f"Uploaded {count} files to {path}")
         return jsonify(success=True, message=f"Uploaded {count} files.")
     except Exception as e: 
@@ -155,6 +151,91 @@ def upload_files_api(username):
         current_app.logger.error(f"Upload Error: {e}")
         return jsonify(success=False, error=str(e)), 500
 
+@user_bp.route('/<username>/upload-chunk', methods=['POST'])
+@require_auth('user')
+def upload_chunk_api(username):
+    """API to upload one chunk of a large file (raw body, resumable by offset)"""
+    safe_username = make_safe_name(username)
+    if session.get('username') != username:
+        return jsonify(success=False, error="Unauthorized"), 403
+
+    path = request.args.get('path', '.')
+    filename = secure_filename(request.args.get('filename', ''))
+    try:
+        offset = int(request.args.get('offset', 0))
+        total_size = int(request.args.get('total_size', -1))
+    except ValueError:
+        return jsonify(success=False, error="Invalid offset/total_size"), 400
+
+    home_dir = f"/home/{safe_username}"
+    if not filename or not is_safe_path(home_dir, path):
+        return jsonify(success=False, error="Invalid path"), 400
+    if offset < 0 or total_size < 0:
+        return jsonify(success=False, error="Invalid offset/total_size"), 400
+
+    try:
+        with open_workspace(username) as fs:
+            result = write_upload_chunk(fs, path, filename, offset, total_size, request.stream)
+        if not result["success"]:
+            return jsonify(success=False, error=result["error"], received=result.get("received")), result["status_code"]
+        if result["complete"]:
+            log_action(username, f"Uploaded {filename} ({total_size} bytes) to {path}")
+        return jsonify(success=True, received=result["received"], complete=result["complete"])
+    except Exception as e:
+        from flask import current_app
+        current_app.logger.error(f"Upload Chunk Error: {e}")
+        return jsonify(success=False, error=str(e)), 500
+
+@user_bp.route('/<username>/files/download', methods=['GET'])
+@require_auth('user')
+def download_file_api(username):
+    """API to stream a workspace file (supports HTTP Range)"""
+    safe_username = make_safe_name(username)
+    if session.get('username') != username:
+        return jsonify(success=False, error="Unauthorized"), 403
+
+    path = request.args.get('path', '')
+    home_dir = f"/home/{safe_username}"
+    if not path or not is_safe_path(home_dir, path):
+        return jsonify(success=False, error="Invalid file path"), 400
+
+    stack = ExitStack()
+    try:
+        fs = stack.enter_context(open_workspace(username))
+        entry = fs.stat(path)
+        if entry.is_dir:
+            stack.close()
+            return jsonify(success=False, error="Not a file"), 400
+        f = stack.enter_context(fs.open_read(path))
+    except FileNotFoundError:
+        stack.close()
+        return jsonify(success=False, error="File not found"), 404
+    except Exception as e:
+        stack.close()
+        return jsonify(success=False, error=str(e)), 500
+
+    size = entry.size
+    byte_range = request.range.range_for_length(size) if request.range else None
+    if request.range and byte_range is None:
+        stack.close()
+        return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+    start, stop = byte_range or (0, size)
+
+    def generate():
+        # Phiên SSH/SFTP được giữ tới khi gửi xong (hoặc client ngắt)
+        with stack:
+            if stop > start:
+                yield from stream_workspace_file(f, start, stop - 1)
+
+    response = Response(generate(), status=206 if byte_range else 200, mimetype='application/octet-stream',
+                        direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(stop - start)
+    response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(os.path.basename(path)) or "download"}"'
+    if byte_range:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    return response
+
 @user_bp.route('/<username>/rename-item', methods=['POST'])
 @require_auth('user')
 def rename_item_api(username):
@@ -173,17 +254,11 @@ def rename_item_api(username):
         return jsonify(success=False, error="Invalid parameters"), 400
 
     try:
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        
         base_dir_rel = os.path.dirname(old_path)
-        old_full_path = os.path.join("/home", safe_username, old_path)
-        new_full_path = os.path.join("/home", safe_username, base_dir_rel, new_name)
         
-        sftp.rename(old_full_path, new_full_path)
+        with open_workspace(username) as fs:
+            fs.rename(old_path, os.path.join(base_dir_rel, new_name))
         
-        sftp.close()
-        client.close()
         log_action(username, f"Rename: {old_path} -> {new_name}")
         return jsonify(success=True)
     except Exception as e: 
@@ -193,8 +268,6 @@ def rename_item_api(username):
 @require_auth('user')
 def delete_item_api(username):
     """API to delete file/folder"""
-    import shlex
-    
     safe_username = make_safe_name(username)
     if session.get('username') != username: 
         return jsonify(success=False, error="Unauthorized"), 403
@@ -206,31 +279,80 @@ def delete_item_api(username):
         return jsonify(success=False, error="Invalid path"), 400
 
     try:
-        client = get_ssh_client(username)
-
         full_path = os.path.normpath(os.path.join(home_dir, path))
         
         # Prevent deleting home directory
         if full_path == home_dir:
             return jsonify(success=False, error="Cannot delete root home"), 403
-             
-        safe_command = f'rm -rf {shlex.quote(full_path)}'
 
-        stdin, stdout, stderr = client.exec_command(safe_command)
-        exit_status = stdout.channel.recv_exit_status()
+        with open_workspace(username) as fs:
+            fs.remove(path)
         
-        if exit_status == 0:
-            log_action(username, f"Delete: {path}")
-            return jsonify(success=True)
-        else:
-            err_msg = stderr.read().decode().strip()
-            raise Exception(err_msg)
+        log_action(username, f"Delete: {path}")
+        return jsonify(success=True)
             
     except Exception as e: 
         from flask import current_app
         current_app.logger.error(f"Delete Error: {e}")
         return jsonify(success=False, error=str(e)), 500
 
+@user_bp.route('/<username>/fs/batch', methods=['POST'])
+@require_auth('user')
+def fs_batch_api(username):
+    """API to run several file operations in one request / one workspace session"""
+    safe_username = make_safe_name(username)
+    if session.get('username') != username:
+        return jsonify(success=False, error="Unauthorized"), 403
+
+    data = request.get_json(silent=True) or {}
+    operations = data.get("operations")
+    atomic = bool(data.get("atomic", False))
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify(success=False, error="No operations provided"), 400
+    if len(operations) > SYSTEM_CONFIG['FS_BATCH_MAX_OPS']:
+        return jsonify(success=False, error=f"Too many operations (max {SYSTEM_CONFIG['FS_BATCH_MAX_OPS']})"), 400
+
+    try:
+        with open_workspace(username) as fs:
+            result = run_workspace_batch(username, safe_username, fs, operations, atomic=atomic)
+
+        done = sum(1 for r in result["results"] if r["success"])
+        log_action(username, f"FS batch: {done}/{len(operations)} ops{' (rolled back)' if result['rolled_back'] else ''}",
+                   success=result["success"])
+        return jsonify(success=result["success"], results=result["results"], rolled_back=result["rolled_back"])
+    except Exception as e:
+        from flask import current_app
+        current_app.logger.error(f"FS Batch Error for {username}: {e}")
+        return jsonify(success=False, error=str(e)), 500
+
+@user_bp.route('/<username>/files/tree', methods=['GET'])
+@require_auth('user')
+def files_tree_api(username):
+    """API to get the whole filtered file tree in one request (IDE file browser)"""
+    if session.get('username') != username:
+        return jsonify(error="Unauthorized"), 403
+
+    path = request.args.get("path", ".")
+    if '..' in path or path.startswith('/'):
+        return jsonify(error="Invalid path"), 400
+    try:
+        depth = min(int(request.args.get("depth", SYSTEM_CONFIG['WORKSPACE_TREE_MAX_DEPTH'])),
+                    SYSTEM_CONFIG['WORKSPACE_TREE_MAX_DEPTH'])
+    except ValueError:
+        return jsonify(error="Invalid depth"), 400
+
+    try:
+        with open_workspace(username) as fs:
+            tree = build_workspace_manifest(fs, path, max_depth=max(depth, 1))
+        return jsonify(files=tree, path=path)
+    except FileNotFoundError:
+        return jsonify(error="Directory not found"), 404
+    except Exception as e:
+        from flask import current_app
+        current_app.logger.error(f"ERROR File Tree user '{username}': {str(e)}")
+        return jsonify(error=str(e)), 500
+
 # ==================== CODE EDITOR ====================
 
 @user_bp.route('/<username>/editor/new', methods=['POST'])
@@ -253,26 +375,15 @@ def new_file_api(username):
         filename += '.ino'
 
     try:
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        
         filepath = os.path.join("/home", safe_username, path, filename)
 
-        # Check if file exists
-        try:
-            sftp.stat(filepath)
-            sftp.close()
-            client.close()
-            return jsonify(success=False, error="File đã tồn tại"), 400
-        except FileNotFoundError:
-            pass
-
-        # Create empty file
-        with sftp.open(filepath, 'w') as f:
-            f.write("")  
-
-        sftp.close()
-        client.close()
+        with open_workspace(username) as fs:
+            # Check if file exists
+            if fs.exists(os.path.join(path, filename)):
+                return jsonify(success=False, error="File đã tồn tại"), 400
+
+            # Create empty file
+            fs.write_bytes(os.path.join(path, filename), b"")
         
         log_action(username, f"Create new file: {filepath}")
         return jsonify(success=True)
@@ -298,19 +409,21 @@ def load_file_api(username):
         return jsonify(success=False, error="Invalid file path"), 400
 
     try:
-        from services.ssh_manager import get_ssh_client
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        
-        result = load_workspace_file(username, safe_username, sftp, path, filename)
-        
-        sftp.close()
-        client.close()
+        with open_workspace(username) as fs:
+            result = load_workspace_file(username, safe_username, fs, path, filename)
         
+        download_url = url_for('user.download_file_api', username=username, path=os.path.join(path, filename))
+        if result["success"] and result.get("binary"):
+            # File nhị phân (.bin, .hex...) không decode, trả đường dẫn tải thô
+            return jsonify(success=True, binary=True, size=result["size"], version=result["version"], download_url=download_url)
         if result["success"]:
-            return jsonify(success=True, content=result["content"])
+            response = jsonify(success=True, content=result["content"], version=result["version"])
+            response.set_etag(result["version"])
+            return response
         else:
             status_code = result.get("status_code", 500)
+            if status_code == 413:
+                return jsonify(success=False, error=result["error"], size=result["size"], download_url=download_url), 413
             return jsonify(success=False, error=result["error"]), status_code
     except Exception as e: 
         return jsonify(success=False, error=str(e)), 500
@@ -328,27 +441,31 @@ def save_file_api(username):
     filename = data.get("filename")
     content = data.get("content", "")
     path = data.get("path", ".")
+    # Tiền điều kiện phiên bản: body base_version hoặc header If-Match
+    base_version = data.get("base_version") or next(iter(request.if_match.as_set()), None)
+    patch = data.get("patch")
 
     home_dir = f"/home/{safe_username}"
     if not filename or not is_safe_path(home_dir, os.path.join(path, filename)):
         return jsonify(success=False, error="Invalid file path"), 400
+    if patch is not None and not isinstance(patch, list):
+        return jsonify(success=False, error="Invalid patch"), 400
 
     try:
-        from services.ssh_manager import get_ssh_client
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        
-        result = save_workspace_file(username, safe_username, sftp, path, filename, content)
-        
-        sftp.close()
-        client.close()
+        with open_workspace(username) as fs:
+            result = save_workspace_file(username, safe_username, fs, path, filename, content,
+                                         base_version=base_version, patch=patch)
         
         if result["success"]:
             from services import log_action
             log_action(username, f"Save file via service: {filename}")
-            return jsonify(success=True)
+            response = jsonify(success=True, version=result["version"])
+            response.set_etag(result["version"])
+            return response
         else:
             status_code = result.get("status_code", 500)
+            if status_code == 409:
+                return jsonify(success=False, error=result["error"], current_version=result["current_version"]), 409
             return jsonify(success=False, error=result["error"]), status_code
             
     except Exception as e: 
@@ -363,16 +480,34 @@ def save_file_api(username):
 @user_bp.route('/<username>/compile', methods=['POST'])
 @require_auth('user')
 def compile_sketch_api(username):
-    """API to compile Arduino sketch"""
+    """API to compile Arduino sketch: queues a job (202 + job_id), or returns the result when wait=true"""
     data = request.get_json()
     sketch_path = data.get("sketch_path")
     board_fqbn = data.get("board_fqbn")
     
     if not sketch_path or not board_fqbn:
         return jsonify(success=False, output="Thiếu thông tương tin sketch_path hoặc board", error_analysis=None), 400
+    if not is_sketch_filename(os.path.basename(sketch_path)):
+        return jsonify(success=False, output="Tên sketch không hợp lệ (chỉ chấp nhận <tên>.ino hoặc <tên>.cpp)", error_analysis=None), 400
 
-    result = compile_sketch(username, board_fqbn, sketch_path)
-    return jsonify(result)
+    try:
+        job = compile_queue.submit(username, board_fqbn, sketch_path, lane=compile_lane(username))
+    except QueueFull as e:
+        return jsonify(success=False, error=str(e)), 429
+    # Client cũ / script: chờ kết quả ngay trong request như trước
+    if data.get("wait") and job.wait(SYSTEM_CONFIG['COMPILE_QUEUE_WAIT_TIMEOUT']):
+        return jsonify(job.result)
+    return jsonify(success=True, **compile_queue.status(job)), 202
+
+
+@user_bp.route('/<username>/compile/<job_id>')
+@require_auth('user')
+def compile_job_api(username, job_id):
+    """API: state of a queued compile (result included once done)"""
+    job = compile_queue.get(job_id)
+    if not job or job.username != session['username']:
+        return jsonify(success=False, error="Không tìm thấy lượt biên dịch"), 404
+    return jsonify(success=True, **compile_queue.status(job))
 
 # API nạp code vòng ngoài (Upload) đã bị xóa bỏ thay bằng AI Grader.
 
@@ -461,56 +596,41 @@ def initialize_assigned_missions(username):
         return
         
     try:
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        home_dir = f"/home/{safe_username}"
-        
-        for m in missions:
-            mission_slug = slugify_vn(m['name'])
-            if not mission_slug: mission_slug = f"mission_{m['id']}"
+        with open_workspace(username) as fs:
+            for m in missions:
+                mission_slug = slugify_vn(m['name'])
+                if not mission_slug: mission_slug = f"mission_{m['id']}"
             
-            # Đề phòng tên cũ bị lỗi (ví dụ đề 18 thành e_18)
-            # Ta sẽ kiểm tra và đổi tên nếu cần
-            def broken_slugify(text):
-                import unicodedata
-                text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
-                text = re.sub(r'[^\w\s-]', '', text).strip().lower()
-                text = re.sub(r'[-\s]+', '_', text)
-                return text
-            old_slug = broken_slugify(m['name'])
+                # Đề phòng tên cũ bị lỗi (ví dụ đề 18 thành e_18)
+                # Ta sẽ kiểm tra và đổi tên nếu cần
+                def broken_slugify(text):
+                    import unicodedata
+                    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+                    text = re.sub(r'[^\w\s-]', '', text).strip().lower()
+                    text = re.sub(r'[-\s]+', '_', text)
+                    return text
+                old_slug = broken_slugify(m['name'])
             
-            mission_dir = os.path.join(home_dir, mission_slug)
-            old_dir = os.path.join(home_dir, old_slug) if old_slug and old_slug != mission_slug else None
+                mission_dir = mission_slug
+                old_dir = old_slug if old_slug and old_slug != mission_slug else None
             
-            # Kiểm tra di cư thư mục cũ sang mới
-            if old_dir:
-                try:
-                    sftp.stat(old_dir)
-                    # Nếu tồn tại thư mục cũ, hãy đổi tên nó sang tên mới chuẩn nếu tên mới chưa có
+                # Kiểm tra di cư thư mục cũ sang mới
+                if old_dir:
                     try:
-                        sftp.stat(mission_dir)
+                        fs.stat(old_dir)
+                        # Nếu tồn tại thư mục cũ, hãy đổi tên nó sang tên mới chuẩn nếu tên mới chưa có
+                        try:
+                            fs.stat(mission_dir)
+                        except FileNotFoundError:
+                            fs.rename(old_dir, mission_dir)
+                            from flask import current_app
+                            current_app.logger.info(f"Migrated folder {old_slug} -> {mission_slug} for {username}")
                     except FileNotFoundError:
-                        sftp.rename(old_dir, mission_dir)
-                        from flask import current_app
-                        current_app.logger.info(f"Migrated folder {old_slug} -> {mission_slug} for {username}")
-                except FileNotFoundError:
-                    pass
+                        pass
 
-            # 1. Tạo thư mục mới (nếu chưa có sau khi migrate)
-            try:
-                sftp.mkdir(mission_dir)
-            except IOError: pass
-                
-            # 2. Tạo file .ino (nếu chưa có)
-            ino_path = os.path.join(mission_dir, f"{mission_slug}.ino")
-            try:
-                sftp.stat(ino_path)
-            except FileNotFoundError:
-                template = m.get('template_code') or "// Bắt đầu code bài làm của bạn tại đây\nvoid setup() {\n  Serial.begin(115200);\n}\n\nvoid loop() {\n  \n}\n"
-                with sftp.open(ino_path, 'w') as f:
-                    f.write(template)
+                # Tạo thư mục + file .ino (nếu chưa có sau khi migrate)
+                create_mission_files(fs, m)
         
-        sftp.close(); client.close()
     except Exception as e:
         from flask import current_app
         current_app.logger.error(f"Auto-init missions error for {username}: {e}")
@@ -519,35 +639,12 @@ def initialize_assigned_missions(username):
 @require_auth('user')
 def user_api_preview_files():
     """API: List files that would be snapshotted on submission (preview only)."""
-    import stat as stat_mod
     username = session['username']
     safe_username = make_safe_name(username)
     files_list = []
     try:
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        home_dir = f"/home/{safe_username}"
-        def collect(path, depth=0):
-            if depth > 4: return
-            try:
-                EXCLUDED_DIRS = {'libraries', 'node_modules', 'venv', '__pycache__', '.git', '.arduino15', 'Arduino'}
-                for item in sftp.listdir_attr(path):
-                    if item.filename.startswith('.'): continue
-                    if item.filename in EXCLUDED_DIRS: continue
-                    
-                    fp = f"{path}/{item.filename}"
-                    if stat_mod.S_ISDIR(item.st_mode):
-                        collect(fp, depth + 1)
-                    elif item.filename.endswith(('.ino', '.cpp', '.c', '.h', '.py')):
-                        if 'libraries/' in fp or 'node_modules/' in fp: continue
-                        files_list.append({
-                            'name': item.filename,
-                            'path': fp.replace(home_dir, ''),
-                            'size': item.st_size
-                        })
-            except: pass
-        collect(home_dir)
-        sftp.close(); client.close()
+        with open_workspace(username) as fs:
+            files_list = [{'name': f['name'], 'path': f['path'], 'size': f['size']} for f in list_source_files(fs)]
     except Exception as e:
         return jsonify(success=False, error=str(e)), 500
     return jsonify(success=True, files=files_list)
@@ -569,28 +666,10 @@ def user_api_missions_start(mission_id):
     if not mission:
         return jsonify(success=False, error="Không tìm thấy bài thi"), 404
         
-    mission_slug = slugify_vn(mission['name'])
-    if not mission_slug: mission_slug = f"mission_{mission_id}"
-    
     try:
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        home_dir = f"/home/{safe_username}"
-        mission_dir = os.path.join(home_dir, mission_slug)
-        
-        try:
-            sftp.mkdir(mission_dir)
-        except IOError: pass
-            
-        ino_path = os.path.join(mission_dir, f"{mission_slug}.ino")
-        try:
-            sftp.stat(ino_path)
-        except FileNotFoundError:
-            template = mission.get('template_code') or "// Bắt đầu code bài làm của bạn tại đây\nvoid setup() {\n  Serial.begin(115200);\n}\n\nvoid loop() {\n  \n}\n"
-            with sftp.open(ino_path, 'w') as f:
-                f.write(template)
+        with open_workspace(username) as fs:
+            mission_slug = create_mission_files(fs, mission)
         
-        sftp.close(); client.close()
         return jsonify(success=True, mission_slug=mission_slug)
     except Exception as e:
         return jsonify(success=False, error=str(e)), 500
@@ -624,51 +703,19 @@ def user_api_submit_mission(mission_id):
     if cur.fetchone():
         cur.close(); db.close()
         return jsonify(success=False, error="Bạn đã nộp bài thi này rồi"), 409
-    # Snapshot files from container
-    files_snapshot = []
+    # Snapshot files from container (một luồng tar, hash từng file)
+    snapshot_ms = None
     try:
-        import stat as stat_mod
-        client = get_ssh_client(username)
-        sftp = client.open_sftp()
-        home_dir = f"/home/{safe_username}"
-        def collect(path, depth=0):
-            if depth > 4: return
-            try:
-                # Các thư mục cần loại bỏ không thu thập file bài làm
-                EXCLUDED_DIRS = {'libraries', 'node_modules', 'venv', '__pycache__', '.git', '.arduino15', 'Arduino'}
-                
-                for item in sftp.listdir_attr(path):
-                    if item.filename.startswith('.'): continue
-                    if item.filename in EXCLUDED_DIRS: continue
-                    
-                    fp = f"{path}/{item.filename}"
-                    if stat_mod.S_ISDIR(item.st_mode):
-                        collect(fp, depth + 1)
-                    elif item.filename.endswith(('.ino', '.cpp', '.c', '.h', '.py')):
-                        # Không lấy file trong thư mục libraries (lớp bảo vệ 2)
-                        if 'libraries/' in fp or 'node_modules/' in fp: continue
-                        
-                        try:
-                            with sftp.open(fp, 'r') as f:
-                                # Đọc tối đa 50k ký tự mỗi file
-                                content = f.read(50000).decode('utf-8', errors='replace')
-                            files_snapshot.append({
-                                'name': item.filename, 
-                                'path': fp.replace(home_dir, ''), 
-                                'content': content, 
-                                'size': item.st_size
-                            })
-                        except: pass
-            except: pass
-        collect(home_dir)
-        sftp.close(); client.close()
+        with open_workspace(username) as fs:
+            files_snapshot, snapshot_ms = snapshot_source_files(fs)
     except Exception as e:
         files_snapshot = [{'name': 'error.txt', 'path': '/', 'content': f'Lỗi thu thập file: {e}', 'size': 0}]
     is_auto = (request.get_json(silent=True) or {}).get('auto', False)
     try:
+        manifest = store_submission_files(cur, files_snapshot)
         cur.execute(
-            "INSERT INTO submissions (mission_id, user_id, files, is_auto_submit) VALUES (%s,%s,%s,%s)",
-            (mission_id, user_id, json.dumps(files_snapshot), is_auto)
+            "INSERT INTO submissions (mission_id, user_id, files, is_auto_submit, snapshot_ms) VALUES (%s,%s,%s,%s,%s)",
+            (mission_id, user_id, json.dumps(manifest), is_auto, snapshot_ms)
         )
         db.commit()
         sub_id = cur.lastrowid
@@ -744,35 +791,32 @@ def user_api_submit_mission(mission_id):
 def debug_devices_api(username):
     """API to debug device detection"""
     import glob
-    import subprocess
     
     if session['username'] != username:
         return jsonify(error="Unauthorized"), 403
     
     safe_username = make_safe_name(username)
     cname = f"{safe_username}-dev"
+    runtime = get_runtime()
     
     try:
         # Check on host
         host_devices = glob.glob('/dev/ttyUSB*') + glob.glob('/dev/ttyACM*')
         
         # Check in container
-        device_cmd = ["docker", "exec", cname, "ls", "/dev/tty*"]
-        device_result = subprocess.run(device_cmd, capture_output=True, text=True, timeout=10)
+        device_result = runtime.exec(cname, ["ls", "/dev/tty*"], timeout=10)
         
         container_devices = []
-        if device_result.returncode == 0:
+        if device_result.exit_code == 0:
             for line in device_result.stdout.split('\n'):
                 if 'ttyUSB' in line or 'ttyACM' in line:
                     container_devices.append(line.strip())
         
         # Check arduino-cli
-        arduino_cmd = ["docker", "exec", cname, "arduino-cli", "board", "list"]
-        arduino_result = subprocess.run(arduino_cmd, capture_output=True, text=True, timeout=10)
+        arduino_result = runtime.exec(cname, ["arduino-cli", "board", "list"], timeout=10)
         
         # Check user permissions
-        perm_cmd = ["docker", "exec", cname, "groups", safe_username]
-        perm_result = subprocess.run(perm_cmd, capture_output=True, text=True, timeout=5)
+        perm_result = runtime.exec(cname, ["groups", safe_username], timeout=5)
         
         return jsonify({
             'success': True,
@@ -780,7 +824,7 @@ def debug_devices_api(username):
             'container_devices': container_devices,
             'arduino_cli_output': arduino_result.stdout,
             'arduino_cli_error': arduino_result.stderr,
-            'user_groups': perm_result.stdout.strip() if perm_result.returncode == 0 else "Error"
+            'user_groups': perm_result.stdout.strip() if perm_result.exit_code == 0 else "Error"
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -789,22 +833,19 @@ def debug_devices_api(username):
 @require_auth('user')
 def fix_permissions_api(username):
     """API to fix device permissions"""
-    import subprocess
-    
     if session['username'] != username:
         return jsonify(error="Unauthorized"), 403
     
     safe_username = make_safe_name(username)
     cname = f"{safe_username}-dev"
+    runtime = get_runtime()
     
     try:
         # Add user to dialout group
-        cmd1 = ["docker", "exec", cname, "usermod", "-a", "-G", "dialout", safe_username]
-        result1 = subprocess.run(cmd1, capture_output=True, text=True, timeout=10)
+        result1 = runtime.exec(cname, ["usermod", "-a", "-G", "dialout", safe_username], timeout=10)
         
         # Set device permissions
-        cmd2 = ["docker", "exec", cname, "sh", "-c", "chmod 666 /dev/ttyUSB* /dev/ttyACM* 2>/dev/null || true"]
-        result2 = subprocess.run(cmd2, capture_output=True, text=True, timeout=10)
+        result2 = runtime.exec(cname, ["sh", "-c", "chmod 666 /dev/ttyUSB* /dev/ttyACM* 2>/dev/null || true"], timeout=10)
         
         log_action(username, "Fix device permissions")
         return jsonify({
@@ -0,0 +1,31 @@
+# File: arduino_shared_report.py
+# Báo cáo dung lượng tiết kiệm được nhờ volume core/thư viện Arduino dùng chung (read-only)
+# so với việc mỗi user giữ một bản sao thư viện trong ~/Arduino/libraries.
+# Cách chạy (từ thư mục gốc dự án): python scripts/arduino_shared_report.py [--prune]
+#   --prune: xóa các bản sao cũ trùng tên + phiên bản với thư viện dùng chung
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.arduino_shared import disk_usage_report, shared_volume_ready
+
+
+def human(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024.0
+    return f"{n:.1f} TB"
+
+
+report = disk_usage_report(prune='--prune' in sys.argv)
+if not shared_volume_ready(report['shared_dir']):
+    print(f"⚠️  Volume dùng chung {report['shared_dir']} chưa được xuất (thiếu manifest.json)")
+print(f"📦 Volume dùng chung:          {report['shared_dir']} ({human(report['shared_bytes'])}, thư viện {human(report['shared_library_bytes'])})")
+print(f"👥 Số user:                     {report['users']}")
+print(f"📚 Thư viện user tự cài:        {human(report['user_library_bytes'])}")
+print(f"♻️  Bản sao cũ còn trùng:        {human(report['duplicate_bytes'])}")
+if '--prune' in sys.argv:
+    print(f"🧹 Đã xóa:                      {human(report['pruned_bytes'])}")
+print(f"\n✅ Dung lượng tiết kiệm:        {human(report['saved_bytes'])}")
@@ -0,0 +1,66 @@
+# File: compile_benchmark.py
+# So sánh thời gian biên dịch qua CLI (mỗi lần một tiến trình arduino-cli mới) và qua arduino-cli daemon (gRPC)
+# trên cùng một compile worker, cùng sketch. Chênh lệch trung vị ~ chi phí khởi động mỗi lần của CLI
+# (nạp index, platform, metadata thư viện).
+# Cách chạy (từ thư mục gốc dự án, COMPILE_WORKERS > 0):
+#   python scripts/compile_benchmark.py <username> <sketch.ino> [fqbn] [số lần, mặc định 5]
+import os
+import sys
+import time
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import make_safe_name
+from services.container_runtime import get_runtime
+from services.compile_workers import compile_workers
+from services.compile_daemon import compile_daemons
+from services.build_cache import BuildCacheSession
+
+if len(sys.argv) < 3:
+    print("Usage: python scripts/compile_benchmark.py <username> <sketch.ino> [fqbn] [runs]")
+    sys.exit(1)
+if not compile_daemons.enabled:
+    print("⚠️  Cần COMPILE_WORKERS > 0 và COMPILE_DAEMON=1")
+    sys.exit(1)
+
+username, sketch = sys.argv[1], os.path.basename(sys.argv[2])
+fqbn = sys.argv[3] if len(sys.argv) > 3 else "esp32:esp32:esp32"
+runs = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+safe_username = make_safe_name(username)
+
+
+def cli(worker):
+    build = BuildCacheSession(fqbn)
+    result = get_runtime().exec(worker, build.wrap(compile_workers.command(safe_username, sketch, fqbn)), timeout=300)
+    return result.exit_code
+
+
+def daemon(worker):
+    result = compile_daemons.compile(worker, safe_username, sketch, fqbn, BuildCacheSession(fqbn))
+    if result is None:
+        raise SystemExit("❌ Không kết nối được arduino-cli daemon (xem log worker /tmp/arduino-daemon.log)")
+    return result.exit_code
+
+
+timings = {'cli': [], 'daemon': []}
+with compile_workers.job(safe_username, sketch) as worker:
+    print(f"🔧 Worker {worker}, sketch {sketch}, board {fqbn}, {runs} lần mỗi chế độ")
+    # Lần đầu: làm ấm build path + instance daemon, không tính
+    for mode, run in (('cli', cli), ('daemon', daemon)):
+        started = time.monotonic()
+        code = run(worker)
+        print(f"   khởi động {mode:6s} {time.monotonic() - started:6.2f}s (exit {code})")
+    # Xen kẽ hai chế độ để cùng chịu trạng thái build path / tải máy
+    for i in range(runs):
+        for mode, run in (('cli', cli), ('daemon', daemon)):
+            started = time.monotonic()
+            run(worker)
+            timings[mode].append(time.monotonic() - started)
+
+print(f"\n{'chế độ':8s} {'min':>7s} {'median':>7s} {'mean':>7s} {'max':>7s}")
+for mode, values in timings.items():
+    print(f"{mode:8s} {min(values):7.2f} {statistics.median(values):7.2f} {statistics.mean(values):7.2f} {max(values):7.2f}")
+saved = statistics.median(timings['cli']) - statistics.median(timings['daemon'])
+print(f"\n✅ Chi phí mỗi lần compile tiết kiệm nhờ daemon: {saved:.2f}s "
+      f"({saved / statistics.median(timings['cli']) * 100:.0f}% của CLI)")
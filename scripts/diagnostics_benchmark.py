@@ -0,0 +1,90 @@
+# File: diagnostics_benchmark.py
+# Đo thông lượng DiagnosticsParser (một lượt, từng dòng) so với cách phân tích cũ
+# (split toàn bộ log sau khi build xong, re.search với pattern chưa compile trên mỗi dòng)
+# trên log build ESP32 lớn.
+# Cách chạy (từ thư mục gốc dự án):
+#   python scripts/diagnostics_benchmark.py [build.log] [số lần lặp log giả lập, mặc định 2000]
+#   Không có build.log: tự sinh log giống `arduino-cli compile -v` cho esp32 (lệnh g++ dài, cảnh báo thư viện, lỗi).
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.diagnostics import DiagnosticsParser
+
+TOOLCHAIN = "/opt/arduino-shared/v1/data/packages/esp32/tools/xtensa-esp32-elf-gcc/esp-2021r2-patch5-8.4.0/bin"
+CORE = "/opt/arduino-shared/v1/data/packages/esp32/hardware/esp32/2.0.14"
+FLAGS = " ".join(f"-I{CORE}/tools/sdk/esp32/include/{c}/include" for c in
+                 ("newlib", "freertos", "esp_hw_support", "heap", "log", "lwip", "soc", "hal", "esp_wifi", "driver"))
+
+
+def synthetic_log(repeat):
+    block = []
+    for i in range(10):
+        src = f"{CORE}/cores/esp32/file{i}.cpp"
+        block.append(f"{TOOLCHAIN}/xtensa-esp32-elf-g++ -DHAVE_CONFIG_H -DESP32 {FLAGS} -c {src} -o /build/core/file{i}.cpp.o")
+    block += [
+        f"In file included from /workspaces/alice/Arduino/libraries/DHT/DHT.cpp:7:",
+        f"/workspaces/alice/Arduino/libraries/DHT/DHT.h: In member function 'float DHT::readTemperature(bool, bool)':",
+        f"/workspaces/alice/Arduino/libraries/DHT/DHT.h:42:9: warning: unused variable 'f' [-Wunused-variable]",
+        "   42 |   float f = NAN;",
+        "      |         ^",
+        "/build/sketch/blink.ino.cpp: In function 'void loop()':",
+        "/home/alice/blink/blink.ino:12:3: error: 'x' was not declared in this scope",
+        "   12 |   x = digitalRead(4);",
+        "      |   ^",
+        "/home/alice/blink/blink.ino:3:6: note: 'y' declared here",
+        "    3 | int y;",
+        "      |      ^",
+        "Using library DHT_sensor_library at version 1.4.4 in folder: /workspaces/alice/Arduino/libraries/DHT",
+    ]
+    return "\n".join(block * repeat) + "\n"
+
+
+# Cách cũ (trước DiagnosticsParser), giữ ở đây để so sánh
+def legacy_analyze(output):
+    errors, warnings = [], []
+    for line in output.split('\n'):
+        line = line.strip()
+        if 'error:' in line.lower():
+            m = re.search(r'(.+?):(\d+):(\d+):\s*error:\s*(.+)', line)
+            if m:
+                errors.append({'file': os.path.basename(m.group(1)), 'line': int(m.group(2)), 'message': m.group(4)})
+        elif 'warning:' in line.lower():
+            m = re.search(r'(.+?):(\d+):(\d+):\s*warning:\s*(.+)', line)
+            if m:
+                warnings.append({'file': os.path.basename(m.group(1)), 'line': int(m.group(2)), 'message': m.group(4)})
+    return {'error_count': len(errors), 'warning_count': len(warnings)}
+
+
+def streamed(output):
+    # Giả lập luồng exec: parser nhận từng dòng, không giữ bản sao log
+    parser = DiagnosticsParser(on_diagnostic=lambda d: None)
+    for line in output.splitlines():
+        parser.feed(line)
+    return parser.finish()
+
+
+args = [a for a in sys.argv[1:]]
+if args and os.path.isfile(args[0]):
+    with open(args[0], encoding='utf-8', errors='replace') as f:
+        log = f.read()
+    source = args[0]
+else:
+    log = synthetic_log(int(args[0]) if args else 2000)
+    source = "log esp32 giả lập"
+lines = log.count('\n')
+size_mb = len(log.encode('utf-8')) / 1024 / 1024
+print(f"📄 {source}: {lines:,} dòng, {size_mb:.1f} MB")
+
+for name, fn in (('cũ (split + re.search)', legacy_analyze), ('DiagnosticsParser', streamed)):
+    best = None
+    for _ in range(3):
+        started = time.perf_counter()
+        result = fn(log)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"   {name:24s} {best * 1000:8.1f} ms  {lines / best:12,.0f} dòng/s  {size_mb / best:7.1f} MB/s  "
+          f"({result['error_count']} lỗi, {result['warning_count']} cảnh báo)")
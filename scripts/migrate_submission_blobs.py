@@ -0,0 +1,26 @@
+# File: migrate_submission_blobs.py
+# Chuyển nội dung file trong submissions.files (JSON inline) sang bảng submission_blobs.
+# Chạy lại nhiều lần vẫn an toàn: bài nộp đã là manifest sẽ được bỏ qua.
+# Cách chạy (từ thư mục gốc dự án): python scripts/migrate_submission_blobs.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import get_db_connection, init_db
+from services.submission_store import migrate_inline_submissions
+
+try:
+    print("🔄 Đang kết nối đến database...")
+    init_db()  # đảm bảo bảng submission_blobs đã tồn tại
+    db = get_db_connection()
+    if not db:
+        raise RuntimeError("Không lấy được kết nối database")
+
+    print("📦 Đang chuyển nội dung bài nộp sang blob store...")
+    migrated = migrate_inline_submissions(db)
+    db.close()
+    print(f"\n✅ Đã chuyển {migrated} bài nộp.")
+
+except Exception as e:
+    print(f"\n💥 Gặp lỗi: {e}")
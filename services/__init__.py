@@ -14,7 +14,10 @@ from .docker_manager import (
     setup_arduino_cli_for_user, setup_container_permissions,
     get_all_running_users, docker_status
 )
-from .ssh_manager import get_ssh_client
+from .container_runtime import get_runtime, set_runtime, ContainerRuntimeError
+from .warm_pool import warm_pool
+from .ssh_manager import get_ssh_client, ssh_session, sftp_session, invalidate_ssh_session
+from .workspace_storage import open_workspace, get_host_user_dir
 from .arduino import (
     compile_sketch,
     analyze_compile_errors,      # Hàm mới
@@ -36,9 +39,13 @@ __all__ = [
     'ensure_user_container', 'ensure_user_container_and_setup',
     'setup_arduino_cli_for_user', 'setup_container_permissions',
     'get_all_running_users', 'docker_status',
+    'get_runtime', 'set_runtime', 'ContainerRuntimeError', 'warm_pool',
     
     # SSH
-    'get_ssh_client',
+    'get_ssh_client', 'ssh_session', 'sftp_session', 'invalidate_ssh_session',
+    
+    # Workspace storage
+    'open_workspace', 'get_host_user_dir',
     
     # Arduino
     'compile_sketch',
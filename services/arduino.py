@@ -4,72 +4,65 @@ REAL-TIME MODE: Streaming logs & Strict Error Handling & Auto-Compile
 FULL VERSION FIXED: Fix 'User cant see ports' bug
 """
 import os
-import re
 import json
-import subprocess
+import time
 import logging
 import threading
 import glob
-from collections import defaultdict
-from utils import make_safe_name
+import shutil
+from contextlib import contextmanager
+from collections import defaultdict, deque
+from utils import make_safe_name, is_sketch_filename
 from config import get_db_connection
 from services.logger import log_action
+from services.container_runtime import get_runtime, ExecResult
+from services import idle_reaper
+from services.cpu_scheduler import cpu_scheduler
+from services.compile_workers import compile_workers
+from services.compile_cache import compile_cache
+from services.build_cache import BuildCacheSession
+from services.compile_daemon import compile_daemons, COMPILE_SECONDS
+from services.diagnostics import DiagnosticsParser
 
 logger = logging.getLogger(__name__)
 # [ARCHITECT PIVOT]: device_locks bị vô hiệu hóa vì dễ gây lỗi Distributed Data Race trên Kubernetes
 
 # ==============================================================================
-# 1. HÀM HỖ TRỢ PHÂN TÍCH LỖI (GIỮ NGUYÊN)
+# 1. HÀM HỖ TRỢ PHÂN TÍCH LỖI
 # ==============================================================================
 def analyze_compile_errors(output):
-    errors = []
-    warnings = []
-    lines = output.split('\n')
-    for i, line in enumerate(lines):
-        line = line.strip()
-        if 'error:' in line.lower():
-            error_info = extract_error_info(line, lines, i)
-            if error_info: errors.append(error_info)
-        elif 'warning:' in line.lower():
-            warning_info = extract_warning_info(line, lines, i)
-            if warning_info: warnings.append(warning_info)
-    return {'errors': errors, 'warnings': warnings, 'error_count': len(errors), 'warning_count': len(warnings)}
-
-def extract_error_info(error_line, all_lines, line_index):
-    pattern = r'(.+?):(\d+):(\d+):\s*error:\s*(.+)'
-    match = re.search(pattern, error_line)
-    if match:
-        return {'file': os.path.basename(match.group(1)), 'line': int(match.group(2)), 'column': int(match.group(3)), 'message': match.group(4), 'raw': error_line}
-    return None
-
-def extract_warning_info(warning_line, all_lines, line_index):
-    pattern = r'(.+?):(\d+):(\d+):\s*warning:\s*(.+)'
-    match = re.search(pattern, warning_line)
-    if match:
-        return {'file': os.path.basename(match.group(1)), 'line': int(match.group(2)), 'message': match.group(4), 'raw': warning_line}
-    return None
+    return DiagnosticsParser().feed_text(output).finish()
 
 # ==============================================================================
 # 2. HÀM STREAMING LOG (REAL-TIME)
 # ==============================================================================
-def run_and_stream(cmd, socketio, sid):
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1
-    )
-    full_log = []
-    for line in iter(process.stdout.readline, ''):
+STREAM_LOG_TAIL_LINES = 400   # số dòng log cuối giữ lại cho 'details' khi lỗi
+
+def run_and_stream(cname, cmd, socketio, sid):
+    def push_diagnostic(diagnostic):
+        socketio.emit('upload_status', {'status': 'diagnostic', 'message': diagnostic['raw'], 'diagnostic': diagnostic},
+                      namespace='/upload_status', room=sid)
+
+    parser = DiagnosticsParser(push_diagnostic)
+    stream = get_runtime().exec_stream(cname, cmd)
+    log_tail = deque(maxlen=STREAM_LOG_TAIL_LINES)
+    for line in stream:
+        parser.feed(line)
         line = line.strip()
         if line:
-            full_log.append(line)
+            log_tail.append(line)
             socketio.emit('upload_status', {'status': 'log', 'message': line}, namespace='/upload_status', room=sid)
-            
-    process.stdout.close()
-    return_code = process.wait()
-    return return_code, "\n".join(full_log)
+    parser.finish()
+    return stream.exit_code, "\n".join(log_tail)
+
+def stream_compile(cname, cmd, parser, timeout=300):
+    """Run the compile with output fed line by line to parser; ExecResult with the merged output as stdout"""
+    stream = get_runtime().exec_stream(cname, cmd, timeout=timeout)
+    output = []
+    for line in stream:
+        parser.feed(line)
+        output.append(line)
+    return ExecResult(stream.exit_code, "\n".join(output), "")
 
 # ==============================================================================
 # 3. HÀM CHUẨN BỊ FILE (COPY AN TOÀN)
@@ -83,12 +76,39 @@ def prepare_sketch_folder(container_name, safe_username, sketch_filename):
     target_file_path = f"{target_folder}/{sketch_filename}"
     
     setup_cmd = [
-        "docker", "exec", container_name, "sh", "-c",
+        "sh", "-c",
         f"mkdir -p {target_folder} && [ -f {current_file_path} ] && cp {current_file_path} {target_file_path} || true"
     ]
-    subprocess.run(setup_cmd, capture_output=True)
+    get_runtime().exec(container_name, setup_cmd)
     return target_file_path
 
+def user_libraries_dir(safe_username):
+    """Thư viện user tự cài (ưu tiên hơn thư viện dùng chung read-only)"""
+    return f"/home/{safe_username}/Arduino/libraries"
+
+@contextmanager
+def compile_target(username, board_fqbn, sketch_filename):
+    """(container, cmd, build) to compile a sketch in a shared compile worker or the user's own container.
+
+    cmd uses the shared core build cache; call build.done(success) once the compile has finished.
+    """
+    safe_username = make_safe_name(username)
+    if not is_sketch_filename(sketch_filename):
+        raise ValueError(f"Invalid sketch name: {sketch_filename!r}")
+    if compile_workers.enabled:
+        build = BuildCacheSession(board_fqbn)
+        with compile_workers.job(safe_username, sketch_filename) as worker:
+            yield worker, build.wrap(compile_workers.command(safe_username, sketch_filename, board_fqbn)), build
+        return
+    # Container của user chỉ đọc được cache chung: dùng cache riêng trong home
+    build = BuildCacheSession(board_fqbn, owner=safe_username)
+    cname = f"{safe_username}-dev"
+    idle_reaper.ensure_awake(cname)
+    container_sketch_path = prepare_sketch_folder(cname, safe_username, sketch_filename)
+    cmd = ["arduino-cli", "compile", "--fqbn", board_fqbn, "--libraries", user_libraries_dir(safe_username), container_sketch_path]
+    with cpu_scheduler.compile_burst(cname):
+        yield cname, build.wrap(cmd), build
+
 # ==============================================================================
 # 4. QUY TRÌNH NẠP MỚI (AUTO-COMPILE + STREAMING)
 # ==============================================================================
@@ -98,18 +118,15 @@ def perform_upload_worker(username, port, sketch_path, sid, board_fqbn, socketio
         try: from __main__ import socketio
         except ImportError: return
 
-    safe_username = make_safe_name(username)
-    cname = f"{safe_username}-dev"
     sketch_filename = os.path.basename(sketch_path)
+    idle_reaper.touch(username)
 
     socketio.emit('upload_status', {'status': 'start', 'message': f'Bắt đầu Testbench Ảo hóa cho {board_fqbn}...'}, namespace='/upload_status', room=sid)
 
-    container_sketch_path = prepare_sketch_folder(cname, safe_username, sketch_filename)
-
-    socketio.emit('upload_status', {'status': 'compiling', 'message': '--- ĐANG BIÊN DỊCH CODE MÔ PHỎNG ---'}, namespace='/upload_status', room=sid)
-    compile_cmd = ["docker", "exec", cname, "arduino-cli", "compile", "--fqbn", board_fqbn, container_sketch_path]
-    
-    code, log = run_and_stream(compile_cmd, socketio, sid)
+    with compile_target(username, board_fqbn, sketch_filename) as (cname, compile_cmd, build):
+        socketio.emit('upload_status', {'status': 'compiling', 'message': '--- ĐANG BIÊN DỊCH CODE MÔ PHỎNG ---'}, namespace='/upload_status', room=sid)
+        code, log = run_and_stream(cname, compile_cmd, socketio, sid)
+    build.done(code == 0)
     
     if code != 0:
         socketio.emit('upload_status', {'status': 'error', 'message': '❌ Lỗi biên dịch Biên mẫu!', 'details': log, 'suggestions': ["Vui lòng kiểm tra cú pháp mã nguồn C/C++."]}, namespace='/upload_status', room=sid)
@@ -164,11 +181,11 @@ def get_serial_ports(username):
         except: pass
 
         # 2. Quét Docker
-        cmd = ["docker", "exec", cname, "arduino-cli", "board", "list", "--format", "json"]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
+        cmd = ["arduino-cli", "board", "list", "--format", "json"]
+        result = get_runtime().exec(cname, cmd, timeout=5)
         
         final_list = []
-        if result.returncode == 0:
+        if result.exit_code == 0:
             data = json.loads(result.stdout)
             for item in data.get("detected_ports", []):
                 address = item.get("port", {}).get("address")
@@ -198,21 +215,64 @@ def get_serial_ports(username):
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
-def compile_sketch(username, board_fqbn, sketch_path):
+def _cached_compile(safe_username, sketch_filename, cached):
+    """Response for a cache hit; artifacts are copied back where a worker compile would put them"""
+    artifacts = cached.pop('artifacts')
+    if compile_workers.enabled and artifacts:
+        out_dir = compile_workers.artifacts_dir(safe_username, sketch_filename)
+        os.makedirs(out_dir, exist_ok=True)
+        for path in artifacts:
+            shutil.copy2(path, os.path.join(out_dir, os.path.basename(path)))
+    if artifacts:
+        cached['artifacts'] = [os.path.basename(p) for p in artifacts]
+    cached['cached'] = True
+    return cached
+
+def compile_sketch(username, board_fqbn, sketch_path, on_diagnostic=None):
+    """Compile a sketch; on_diagnostic(diagnostic) is called for each error/warning/note as soon as it is parsed"""
     safe_username = make_safe_name(username)
-    cname = f"{safe_username}-dev"
     sketch_filename = os.path.basename(sketch_path)
-    container_sketch_path = prepare_sketch_folder(cname, safe_username, sketch_filename)
-    
-    cmd = ["docker", "exec", cname, "arduino-cli", "compile", "--fqbn", board_fqbn, container_sketch_path]
+    idle_reaper.touch(username)
     
     try:
+        # Mã nguồn + toolchain không đổi: trả kết quả lần biên dịch trước
+        cache_key = compile_cache.key(safe_username, sketch_filename, board_fqbn)
+        cached = compile_cache.get(cache_key)
+        if cached:
+            logger.info(f"Compile cache hit for {username} on {board_fqbn}")
+            return _cached_compile(safe_username, sketch_filename, cached)
+
         logger.info(f"Compiling for {username} on {board_fqbn}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-        analysis = analyze_compile_errors(result.stderr + result.stdout)
-        return {'success': result.returncode == 0, 'output': result.stdout + result.stderr, 'analysis': analysis}
-    except subprocess.TimeoutExpired:
-        return {'success': False, 'output': "Compilation timed out", 'analysis': {'error_count': 1}}
+        parser = DiagnosticsParser(on_diagnostic)
+        with compile_target(username, board_fqbn, sketch_filename) as (cname, cmd, build):
+            started = time.monotonic()
+            # Daemon: lỗi được đẩy theo từng message gRPC trong lúc biên dịch
+            result = compile_daemons.compile(cname, safe_username, sketch_filename, board_fqbn, build, parser)
+            mode = 'daemon'
+            if result is None:
+                if parser.lines:
+                    parser = DiagnosticsParser(on_diagnostic)   # daemon đứt giữa chừng: CLI chạy lại từ đầu
+                # Có người theo dõi: đọc log theo dòng để đẩy lỗi ngay trong lúc biên dịch
+                result = stream_compile(cname, cmd, parser) if on_diagnostic else get_runtime().exec(cname, cmd, timeout=300)
+                mode = 'cli'
+            COMPILE_SECONDS.labels(mode=mode).observe(time.monotonic() - started)
+        saved = build.done(result.exit_code == 0)
+        if result.exit_code == 124:  # mã thoát của coreutils timeout
+            return {'success': False, 'output': "Compilation timed out", 'analysis': {'error_count': 1}}
+        if not parser.lines:
+            parser.feed_text(result.stderr + result.stdout)
+        analysis = parser.finish()
+        response = {'success': result.exit_code == 0, 'output': result.stdout + result.stderr, 'analysis': analysis}
+        if saved:
+            response['build_cache_saved_seconds'] = round(saved, 1)
+        artifacts = compile_workers.artifacts(safe_username, sketch_filename) if compile_workers.enabled and response['success'] else []
+        # Chỉ cache lỗi của trình biên dịch (không cache lỗi hạ tầng); file đổi trong lúc biên dịch thì bỏ qua
+        if (response['success'] or analysis['error_count']) and \
+                cache_key == compile_cache.key(safe_username, sketch_filename, board_fqbn):
+            compile_cache.put(cache_key, response, artifacts)
+        if artifacts:
+            response['artifacts'] = [os.path.basename(p) for p in artifacts]
+        return response
     except Exception as e:
         logger.error(f"Compile error: {e}")
         return {'success': False, 'output': str(e), 'analysis': {'error_count': 1}}
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+Shared Arduino cores and libraries
+One versioned directory on the host (<ARDUINO_SHARED_ROOT>/<ARDUINO_SHARED_VERSION>,
+exported from the user environment image with `epu-provision export`) is mounted
+read-only into every user container. Students' own libraries stay in their
+writable ~/Arduino/libraries, which arduino-cli searches before the shared ones.
+"""
+import os
+import glob
+import shutil
+import logging
+from config import SYSTEM_CONFIG
+
+logger = logging.getLogger(__name__)
+
+SHARED_MOUNT = "/opt/arduino-shared"
+SHARED_DATA_DIR = f"{SHARED_MOUNT}/arduino15"
+SHARED_LIBRARIES_DIR = f"{SHARED_MOUNT}/libraries"
+SHARED_MANIFEST = "manifest.json"
+
+# Volume lõi cũ (ghi được) khi chưa xuất volume dùng chung
+LEGACY_CORE_HOST_DIR = "/home/toan/flask-kerberos-demo/esp32_core"
+
+
+def shared_host_dir(version=None):
+    return os.path.join(SYSTEM_CONFIG['ARDUINO_SHARED_ROOT'], version or SYSTEM_CONFIG['ARDUINO_SHARED_VERSION'])
+
+
+def shared_volume_ready(host_dir=None):
+    """The export writes manifest.json last: present means the volume is complete"""
+    return os.path.isfile(os.path.join(host_dir or shared_host_dir(), SHARED_MANIFEST))
+
+
+def container_options():
+    """(volumes, environment) giving a user container its Arduino cores and libraries"""
+    host_dir = shared_host_dir()
+    if shared_volume_ready(host_dir):
+        return (
+            {host_dir: {"bind": SHARED_MOUNT, "mode": "ro"}},
+            {"ARDUINO_DIRECTORIES_DATA": SHARED_DATA_DIR,
+             "ARDUINO_DIRECTORIES_BUILTIN_LIBRARIES": SHARED_LIBRARIES_DIR},
+        )
+    logger.warning(f"Shared Arduino volume {host_dir} not exported yet, using legacy core volume")
+    return {LEGACY_CORE_HOST_DIR: {"bind": "/root/.arduino15", "mode": "rw"}}, {}
+
+
+# ================== BÁO CÁO DUNG LƯỢNG ==================
+def dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def library_version(lib_dir):
+    try:
+        with open(os.path.join(lib_dir, 'library.properties'), encoding='utf-8', errors='replace') as f:
+            for line in f:
+                key, _, value = line.partition('=')
+                if key.strip() == 'version':
+                    return value.strip()
+    except OSError:
+        pass
+    return None
+
+
+def toolchain_fingerprint(host_dir=None):
+    """Text identifying the installed cores and shared libraries (changes when they are upgraded)"""
+    host_dir = host_dir or shared_host_dir()
+    if shared_volume_ready(host_dir):
+        with open(os.path.join(host_dir, SHARED_MANIFEST), encoding='utf-8') as f:
+            return f.read()
+    # Volume lõi cũ: phiên bản core là tên thư mục packages/<packager>/hardware/<arch>/<version>
+    pattern = os.path.join(LEGACY_CORE_HOST_DIR, 'packages', '*', 'hardware', '*', '*')
+    cores = sorted(os.path.relpath(p, LEGACY_CORE_HOST_DIR) for p in glob.glob(pattern))
+    return '\n'.join(cores) if cores else None
+
+
+def disk_usage_report(workspace_root=None, host_dir=None, prune=False):
+    """Disk used by the shared volume vs. per-user copies of the same libraries.
+
+    A user library is a duplicate when the shared volume has a library with the
+    same directory name and version (a leftover of the old per-user copy).
+    prune=True deletes those duplicates. Returns a dict of byte counts.
+    """
+    workspace_root = workspace_root or SYSTEM_CONFIG['WORKSPACE_HOST_ROOT']
+    host_dir = host_dir or shared_host_dir()
+    shared_libs = os.path.join(host_dir, 'libraries')
+    shared_versions = {}
+    if os.path.isdir(shared_libs):
+        for entry in os.scandir(shared_libs):
+            if entry.is_dir(follow_symlinks=False):
+                shared_versions[entry.name] = library_version(entry.path)
+    shared_libs_bytes = dir_size(shared_libs)
+
+    report = {
+        'shared_dir': host_dir,
+        'shared_bytes': dir_size(host_dir),
+        'shared_library_bytes': shared_libs_bytes,
+        'users': 0,
+        'user_library_bytes': 0,
+        'duplicate_bytes': 0,
+        'pruned_bytes': 0,
+    }
+    try:
+        homes = [e for e in os.scandir(workspace_root) if e.is_dir(follow_symlinks=False) and not e.name.startswith('.')]
+    except OSError:
+        homes = []
+    for home in homes:
+        report['users'] += 1
+        libs = os.path.join(home.path, 'Arduino', 'libraries')
+        if not os.path.isdir(libs):
+            continue
+        for entry in os.scandir(libs):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            size = dir_size(entry.path)
+            if entry.name in shared_versions and library_version(entry.path) == shared_versions[entry.name]:
+                report['duplicate_bytes'] += size
+                if prune:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    report['pruned_bytes'] += size
+            else:
+                report['user_library_bytes'] += size
+    # Mỗi user trước đây giữ một bản sao thư viện dùng chung; nay chỉ còn một bản read-only
+    remaining_duplicates = report['duplicate_bytes'] - report['pruned_bytes']
+    report['saved_bytes'] = max(0, (report['users'] - 1) * shared_libs_bytes - remaining_duplicates)
+    return report
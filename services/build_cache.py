@@ -0,0 +1,158 @@
+"""
+Shared arduino-cli build cache
+Precompiled core archives (core.a) are the bulk of a cold ESP32 compile and are
+identical for every user on the same board, core version and build flags. One
+host directory (ARDUINO_BUILD_CACHE_ROOT) is mounted read-write only into the
+trusted compile workers and read-only into user containers, where students have
+sudo and could otherwise poison another user's core.a. Compiles that run in a
+user's own container use a private cache under their home instead. Each compile
+points arduino-cli's build_cache.path at <cache>/<key>, key = hash(FQBN,
+toolchain fingerprint, build flags). The first
+compile of a key fills it under an exclusive flock, later ones read it under a
+shared lock. The duration of that cold compile is kept next to the cache so
+warm compiles can report the time they saved.
+"""
+import os
+import time
+import fcntl
+import hashlib
+import logging
+from contextlib import contextmanager
+from prometheus_client import Counter
+from config import SYSTEM_CONFIG
+from services import arduino_shared
+from services.workspace_storage import get_host_user_dir
+
+logger = logging.getLogger(__name__)
+
+BUILD_CACHE_COMPILES = Counter('compile_build_cache_total', 'Compiles by shared build cache state', ['state'])
+BUILD_CACHE_SAVED_SECONDS = Counter('compile_build_cache_saved_seconds_total',
+                                    'Compile time saved by warm shared build caches (vs. the cold compile)')
+
+BUILD_CACHE_MOUNT = "/opt/arduino-build-cache"
+USER_CACHE_DIR = ".arduino-build-cache"      # cache riêng trong home của user
+WARM_MARKER = ".warm"
+COLD_SECONDS_FILE = "cold_seconds"
+
+# Khóa ghi khi cache còn lạnh (lần đầu điền core.a), khóa đọc khi đã ấm
+WRAPPER_SCRIPT = r"""
+cache="$1"; shift
+mkdir -p "$cache"
+if [ -e "$cache/.warm" ]; then mode=-s; else mode=-x; fi
+export ARDUINO_BUILD_CACHE_PATH="$cache"
+flock $mode "$cache/.lock" "$@" && touch "$cache/.warm"
+"""
+
+
+def host_root():
+    return SYSTEM_CONFIG['ARDUINO_BUILD_CACHE_ROOT']
+
+
+def enabled():
+    return bool(host_root())
+
+
+def container_volumes(writable=False):
+    """Volume mapping giving a container access to the shared build cache (writable: compile workers only)"""
+    if not enabled():
+        return {}
+    try:
+        os.makedirs(host_root(), exist_ok=True)
+        os.chmod(host_root(), 0o755)
+    except OSError as e:
+        logger.warning(f"Shared build cache {host_root()} unavailable: {e}")
+        return {}
+    return {host_root(): {"bind": BUILD_CACHE_MOUNT, "mode": "rw" if writable else "ro"}}
+
+
+def cache_key(board_fqbn, build_flags=()):
+    toolchain = arduino_shared.toolchain_fingerprint() or ''
+    h = hashlib.sha256(f"fqbn={board_fqbn}\n".encode('utf-8'))
+    h.update(toolchain.encode('utf-8'))
+    for flag in build_flags:
+        h.update(f"\0{flag}".encode('utf-8'))
+    return h.hexdigest()[:24]
+
+
+class BuildCacheSession:
+    """One compile using the build cache: wraps the command and accounts saved time.
+
+    owner: compile runs in that user's own container, so it gets a cache of its own
+    in their home rather than the shared one it can only read.
+    """
+
+    def __init__(self, board_fqbn, build_flags=(), owner=None):
+        self.key = cache_key(board_fqbn, build_flags) if enabled() else None
+        self.owner = owner
+        if not self.key:
+            self.host_dir = None
+        elif owner:
+            self.host_dir = os.path.join(get_host_user_dir(owner), USER_CACHE_DIR, self.key)
+        else:
+            self.host_dir = os.path.join(host_root(), self.key)
+        self.warm = bool(self.host_dir) and os.path.exists(os.path.join(self.host_dir, WARM_MARKER))
+        self.started = time.monotonic()
+
+    @property
+    def container_dir(self):
+        if not self.key:
+            return None
+        if self.owner:
+            return f"/home/{self.owner}/{USER_CACHE_DIR}/{self.key}"
+        return f"{BUILD_CACHE_MOUNT}/{self.key}"
+
+    def wrap(self, cmd):
+        if not self.key:
+            return cmd
+        return ["bash", "-c", WRAPPER_SCRIPT, "build-cache", self.container_dir, *cmd]
+
+    @contextmanager
+    def hold(self):
+        """Take the same flock as WRAPPER_SCRIPT from the host, for compiles not run through wrap()"""
+        if not self.key:
+            yield
+            return
+        os.makedirs(self.host_dir, exist_ok=True)
+        with open(os.path.join(self.host_dir, '.lock'), 'a') as f:
+            mode = fcntl.LOCK_SH if self.warm else fcntl.LOCK_EX
+            # Không chặn cứng (eventlet): thử lại cho tới khi lấy được khóa
+            while True:
+                try:
+                    fcntl.flock(f, mode | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    time.sleep(0.5)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _cold_seconds(self):
+        try:
+            with open(os.path.join(self.host_dir, COLD_SECONDS_FILE)) as f:
+                return float(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def done(self, success):
+        """Record the outcome; returns the seconds saved by a warm cache (0 if unknown)"""
+        if not self.key or not success:
+            return 0
+        elapsed = time.monotonic() - self.started
+        if not self.warm:
+            BUILD_CACHE_COMPILES.labels(state='cold').inc()
+            try:
+                open(os.path.join(self.host_dir, WARM_MARKER), 'a').close()   # compile qua hold() không có wrapper
+                # 'x': compile lạnh đầu tiên giữ số đo (compile đồng thời chờ khóa thì đo cả thời gian chờ)
+                with open(os.path.join(self.host_dir, COLD_SECONDS_FILE), 'x') as f:
+                    f.write(f"{elapsed:.3f}\n")
+            except FileExistsError:
+                pass
+            except OSError as e:
+                logger.warning(f"Build cache {self.key}: cannot record cold compile time: {e}")
+            return 0
+        BUILD_CACHE_COMPILES.labels(state='warm').inc()
+        cold = self._cold_seconds()
+        saved = max(0.0, cold - elapsed) if cold else 0.0
+        BUILD_CACHE_SAVED_SECONDS.inc(saved)
+        return saved
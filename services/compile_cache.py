@@ -0,0 +1,229 @@
+"""
+Compile result cache
+Pressing Compile again on unchanged code returns the stored result instead of
+running arduino-cli. The key is a SHA-256 over the sketch sources (read from the
+host bind-mount, with the same root-file override as the compile), the FQBN,
+the installed cores/shared libraries, the user (results carry per-user paths)
+and the size + mtime of every file in the user's own libraries.
+Entries live on disk under COMPILE_CACHE_DIR/<key>/ (result.json + artifacts)
+and are evicted least-recently-used past COMPILE_CACHE_MAX_BYTES or
+COMPILE_CACHE_MAX_ENTRIES.
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from prometheus_client import Counter, Gauge
+from config import SYSTEM_CONFIG
+from utils import is_sketch_filename
+from services import arduino_shared
+from services.workspace_storage import get_host_user_dir
+
+logger = logging.getLogger(__name__)
+
+COMPILE_CACHE_REQUESTS = Counter('compile_cache_requests_total', 'Compile cache lookups', ['result'])
+COMPILE_CACHE_BYTES = Gauge('compile_cache_bytes', 'Disk used by the compile result cache')
+COMPILE_CACHE_ENTRIES = Gauge('compile_cache_entries', 'Entries in the compile result cache')
+
+RESULT_FILE = "result.json"
+ARTIFACTS_DIR = "artifacts"
+MAX_SKETCH_BYTES = 4 * 1024 * 1024   # sketch lớn hơn: không cache (đọc để hash quá tốn)
+
+
+def _dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _sketch_files(safe_username, sketch_filename):
+    """{relative path: host path} of what the compile sees, or None if not readable from the host"""
+    home = get_host_user_dir(safe_username)
+    name = os.path.splitext(sketch_filename)[0]
+    folder = os.path.join(home, name)
+    if not is_sketch_filename(sketch_filename) or \
+            os.path.dirname(os.path.realpath(folder)) != os.path.realpath(home):
+        return None
+    files = {}
+    if os.path.isdir(folder):
+        for root, dirs, names in os.walk(folder):
+            dirs[:] = [d for d in dirs if d != 'build']
+            for n in names:
+                path = os.path.join(root, n)
+                files[os.path.relpath(path, folder)] = path
+    root_file = os.path.join(home, sketch_filename)
+    if os.path.isfile(root_file):
+        files[sketch_filename] = root_file
+    return files or None
+
+
+def _library_stats(libraries_dir):
+    """Sorted (relative path, stat) of every library file, without reading the sources"""
+    stats = []
+    for root, dirs, names in os.walk(libraries_dir):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d != 'examples']
+        for n in names:
+            path = os.path.join(root, n)
+            try:
+                stats.append((os.path.relpath(path, libraries_dir), os.stat(path)))
+            except OSError:
+                pass
+    return sorted(stats, key=lambda item: item[0])
+
+
+class CompileCache:
+    """On-disk LRU of compile results keyed by sources + toolchain"""
+
+    def __init__(self, root, max_bytes, max_entries):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._index = None     # key -> bytes, thứ tự = LRU (cũ nhất trước)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.root) and self.max_entries > 0
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        entries = []
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            for entry in os.scandir(self.root):
+                if entry.is_dir() and os.path.isfile(os.path.join(entry.path, RESULT_FILE)):
+                    entries.append((entry.stat().st_mtime, entry.name, _dir_size(entry.path)))
+        except OSError as e:
+            logger.warning(f"Compile cache {self.root} unavailable: {e}")
+        self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._bytes = sum(self._index.values())
+        self._update_gauges()
+
+    def _update_gauges(self):
+        COMPILE_CACHE_BYTES.set(self._bytes)
+        COMPILE_CACHE_ENTRIES.set(len(self._index))
+
+    def key(self, safe_username, sketch_filename, board_fqbn, libraries_dir=None):
+        """Cache key, or None when the sources or toolchain cannot be fingerprinted"""
+        if not self.enabled:
+            return None
+        try:
+            return self._key(safe_username, sketch_filename, board_fqbn, libraries_dir)
+        except (OSError, UnicodeError) as e:
+            logger.warning(f"Compile cache key for {safe_username}/{sketch_filename} failed: {e}")
+            return None
+
+    def _key(self, safe_username, sketch_filename, board_fqbn, libraries_dir):
+        files = _sketch_files(safe_username, sketch_filename)
+        toolchain = arduino_shared.toolchain_fingerprint()
+        if not files or toolchain is None:
+            return None
+        h = hashlib.sha256()
+        h.update(f"user={safe_username}\nfqbn={board_fqbn}\nsketch={sketch_filename}\n".encode('utf-8'))
+        h.update(toolchain.encode('utf-8'))
+        total = 0
+        for rel in sorted(files):
+            with open(files[rel], 'rb') as f:
+                data = f.read(MAX_SKETCH_BYTES + 1)
+            total += len(data)
+            if total > MAX_SKETCH_BYTES:
+                return None
+            h.update(f"\0file={rel}\0{len(data)}\0".encode('utf-8', 'surrogateescape'))
+            h.update(data)
+        # Thư viện user tự cài: sửa file mà không tăng version vẫn phải đổi key
+        libraries_dir = libraries_dir or os.path.join(get_host_user_dir(safe_username), 'Arduino', 'libraries')
+        for rel, st in _library_stats(libraries_dir):
+            h.update(f"\0lib={rel}\0{st.st_size}\0{st.st_mtime_ns}".encode('utf-8', 'surrogateescape'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """Stored result dict (with 'artifacts' host paths) or None"""
+        if not key or not self.enabled:
+            COMPILE_CACHE_REQUESTS.labels(result='bypass').inc()
+            return None
+        with self._lock:
+            self._load_index()
+            hit = key in self._index
+            if hit:
+                self._index.move_to_end(key)
+        if not hit:
+            COMPILE_CACHE_REQUESTS.labels(result='miss').inc()
+            return None
+        entry = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(entry, RESULT_FILE), encoding='utf-8') as f:
+                result = json.load(f)
+            os.utime(entry)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Compile cache entry {key} unreadable: {e}")
+            self._drop(key)
+            COMPILE_CACHE_REQUESTS.labels(result='miss').inc()
+            return None
+        artifacts_dir = os.path.join(entry, ARTIFACTS_DIR)
+        result['artifacts'] = sorted(os.path.join(artifacts_dir, f) for f in os.listdir(artifacts_dir)) \
+            if os.path.isdir(artifacts_dir) else []
+        COMPILE_CACHE_REQUESTS.labels(result='hit').inc()
+        return result
+
+    def put(self, key, result, artifacts=()):
+        """Store result (JSON-serialisable dict) and copies of the artifact files"""
+        if not key or not self.enabled:
+            return
+        entry = os.path.join(self.root, key)
+        tmp = f"{entry}.tmp-{threading.get_ident()}"
+        try:
+            os.makedirs(os.path.join(tmp, ARTIFACTS_DIR), exist_ok=True)
+            for path in artifacts:
+                shutil.copy2(path, os.path.join(tmp, ARTIFACTS_DIR, os.path.basename(path)))
+            with open(os.path.join(tmp, RESULT_FILE), 'w', encoding='utf-8') as f:
+                json.dump({k: v for k, v in result.items() if k != 'artifacts'}, f)
+            size = _dir_size(tmp)
+            with self._lock:
+                self._load_index()
+                if key in self._index:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                    return
+                os.rename(tmp, entry)
+                self._index[key] = size
+                self._bytes += size
+                evicted = self._evict_locked()
+                self._update_gauges()
+        except OSError as e:
+            logger.warning(f"Compile cache store failed: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        for old in evicted:
+            shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+
+    def _evict_locked(self):
+        evicted = []
+        while self._index and (len(self._index) > self.max_entries or self._bytes > self.max_bytes):
+            old, size = self._index.popitem(last=False)
+            self._bytes -= size
+            evicted.append(old)
+        return evicted
+
+    def _drop(self, key):
+        with self._lock:
+            size = self._index.pop(key, None)
+            if size is not None:
+                self._bytes -= size
+                self._update_gauges()
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+
+compile_cache = CompileCache(
+    root=SYSTEM_CONFIG['COMPILE_CACHE_DIR'],
+    max_bytes=SYSTEM_CONFIG['COMPILE_CACHE_MAX_BYTES'],
+    max_entries=SYSTEM_CONFIG['COMPILE_CACHE_MAX_ENTRIES'],
+)
@@ -0,0 +1,350 @@
+"""
+arduino-cli daemon on the compile workers
+A fresh `arduino-cli compile` reloads package indexes, platform definitions and
+library metadata before it compiles anything. With COMPILE_DAEMON each compile
+worker also runs `arduino-cli daemon`; the app keeps one gRPC channel per
+worker and one initialised instance per board platform (vendor:arch of the
+FQBN), created ahead of time for COMPILE_DAEMON_PLATFORMS and re-initialised
+when the shared toolchain changes. The daemon has no authentication, so it is
+only reached over the internal COMPILE_WORKER_NETWORK that user containers
+never join. If the daemon is unreachable (or grpcio is
+not installed) the compile falls back to the CLI command. The few protobuf
+messages involved are encoded by hand, so the generated arduino-cli stubs are
+not needed.
+"""
+import time
+import logging
+import threading
+from prometheus_client import Counter, Histogram
+from config import SYSTEM_CONFIG
+from services import arduino_shared
+from services.container_runtime import get_runtime, ExecResult
+from services.compile_workers import compile_workers, DAEMON_PORT
+
+logger = logging.getLogger(__name__)
+
+COMPILE_DAEMON_REQUESTS = Counter('compile_daemon_requests_total', 'Compiles sent to arduino-cli daemons', ['result'])
+COMPILE_SECONDS = Histogram('compile_seconds', 'Duration of one compile by execution mode', ['mode'],
+                            buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300))
+
+SERVICE = "/cc.arduino.cli.commands.v1.ArduinoCoreService/"
+COMPILE_TIMEOUT = 300                                     # seconds, như compile qua exec
+FALLBACK_CODES = ('UNAVAILABLE', 'UNIMPLEMENTED', 'CANCELLED')
+
+
+# ================== PROTOBUF TỐI THIỂU ==================
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _int_field(number, value):
+    return _varint(number << 3) + _varint(value)
+
+
+def _bytes_field(number, value):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return _varint((number << 3) | 2) + _varint(len(value)) + value
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(data):
+    """(field number, value) of a message: ints for varints, bytes for length-delimited"""
+    pos = 0
+    while pos < len(data):
+        tag, pos = _read_varint(data, pos)
+        number, wire = tag >> 3, tag & 7
+        if wire == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire == 5:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire}")
+        yield number, value
+
+
+def _instance(instance_id):
+    return _bytes_field(1, _int_field(1, instance_id))
+
+
+def compile_request(instance_id, fqbn, sketch_path, build_path, export_dir, libraries, build_cache_path=None):
+    """cc.arduino.cli.commands.v1.CompileRequest"""
+    msg = _instance(instance_id) + _bytes_field(2, fqbn) + _bytes_field(3, sketch_path)
+    if build_cache_path:
+        msg += _bytes_field(6, build_cache_path)
+    msg += _bytes_field(7, build_path)
+    for path in libraries:
+        msg += _bytes_field(15, path)
+    return msg + _bytes_field(18, export_dir)
+
+
+# ================== KẾT NỐI DAEMON ==================
+class DaemonError(Exception):
+    def __init__(self, code, details, responses=()):
+        super().__init__(f"{code}: {details}")
+        self.code = code
+        self.details = details or ''
+        self.responses = list(responses)
+
+
+def _blocking(fn, *args):
+    """Run a blocking grpc call in a real OS thread so it does not stall the eventlet hub"""
+    try:
+        from eventlet import patcher, tpool
+        if patcher.is_monkey_patched('thread'):
+            return tpool.execute(fn, *args)
+    except ImportError:
+        pass
+    return fn(*args)
+
+
+def platform_of(board_fqbn):
+    return ':'.join(board_fqbn.split(':')[:2])
+
+
+class _LineSplitter:
+    """Turns Compile response chunks (out_stream=1 / err_stream=2) into whole lines for on_line"""
+
+    def __init__(self, on_line):
+        self.on_line = on_line
+        self._partial = {1: b'', 2: b''}
+
+    def feed(self, message):
+        for number, value in _fields(message):
+            if number in self._partial:
+                *lines, self._partial[number] = (self._partial[number] + value).split(b'\n')
+                for line in lines:
+                    self.on_line(line.decode('utf-8', errors='replace'))
+
+    def finish(self):
+        for number, rest in self._partial.items():
+            if rest:
+                self.on_line(rest.decode('utf-8', errors='replace'))
+        self._partial = {1: b'', 2: b''}
+
+
+class ArduinoDaemon:
+    """gRPC channel to the daemon of one compile host, with one instance per platform"""
+
+    def __init__(self, host, address):
+        self.host = host
+        self.address = address
+        self._channel = None
+        self._instances = {}       # platform -> (instance id, toolchain fingerprint lúc Init)
+        self._lock = threading.Lock()
+
+    def _call(self, method, request, timeout, stream=False, on_message=None):
+        """Raw request bytes -> list of raw response messages; raises DaemonError.
+
+        on_message(message) is called for each streamed message as soon as it arrives.
+        """
+        try:
+            import grpc
+        except ImportError:
+            raise DaemonError('UNAVAILABLE', 'grpcio is not installed')
+        if self._channel is None:
+            self._channel = grpc.insecure_channel(self.address)
+        identity = lambda b: b
+        if stream:
+            call = self._channel.unary_stream(SERVICE + method, request_serializer=identity, response_deserializer=identity)
+        else:
+            call = self._channel.unary_unary(SERVICE + method, request_serializer=identity, response_deserializer=identity)
+
+        responses = []
+        try:
+            if not stream:
+                return [_blocking(lambda: call(request, timeout=timeout))]
+            messages = call(request, timeout=timeout)
+            while True:
+                # Chờ từng message trong thread thật; xử lý nó trên hub để on_message được emit socket
+                message = _blocking(next, messages, None)
+                if message is None:
+                    return responses
+                responses.append(message)
+                if on_message:
+                    on_message(message)
+        except grpc.RpcError as e:
+            raise DaemonError(e.code().name, e.details(), responses)
+
+    def instance(self, platform):
+        """Id of the warm instance for platform, creating / re-initialising it when needed"""
+        toolchain = arduino_shared.toolchain_fingerprint()
+        with self._lock:
+            instance_id, loaded = self._instances.get(platform, (None, None))
+            if instance_id is not None and loaded == toolchain:
+                return instance_id
+            if instance_id is None:
+                response = self._call('Create', b'', timeout=30)[0]
+                instance = dict(_fields(response)).get(1, b'')
+                instance_id = dict(_fields(instance)).get(1)
+                if instance_id is None:
+                    raise DaemonError('UNKNOWN', 'Create returned no instance')
+            started = time.monotonic()
+            for message in self._call('Init', _instance(instance_id), timeout=120, stream=True):
+                error = dict(_fields(message)).get(2)
+                if error:
+                    # Lỗi nạp một platform/index không làm hỏng cả instance
+                    logger.warning(f"arduino-cli daemon on {self.host}: {dict(_fields(error)).get(2, b'').decode('utf-8', 'replace')}")
+            self._instances[platform] = (instance_id, toolchain)
+            logger.info(f"arduino-cli daemon on {self.host}: instance {instance_id} for {platform} "
+                        f"ready in {time.monotonic() - started:.1f}s")
+            return instance_id
+
+    def forget_instance(self, platform):
+        with self._lock:
+            self._instances.pop(platform, None)
+
+    def compile(self, board_fqbn, paths, build_cache_path=None, timeout=COMPILE_TIMEOUT, on_line=None):
+        """Compile through the daemon: ExecResult like the CLI run.
+
+        on_line(line) gets each stdout/stderr line while the build is still running.
+        """
+        platform = platform_of(board_fqbn)
+        for attempt in (1, 2):
+            request = compile_request(self.instance(platform), board_fqbn, paths['sketch'], paths['build'],
+                                      paths['output'], [paths['libraries']], build_cache_path)
+            lines = _LineSplitter(on_line) if on_line else None
+            try:
+                responses = self._call('Compile', request, timeout=timeout, stream=True,
+                                       on_message=lines.feed if lines else None)
+                error = None
+            except DaemonError as e:
+                # Daemon khởi động lại thì instance cũ không còn: tạo lại một lần
+                if attempt == 1 and e.code in ('INVALID_ARGUMENT', 'NOT_FOUND') and 'instance' in e.details.lower():
+                    self.forget_instance(platform)
+                    continue
+                if e.code in FALLBACK_CODES:
+                    raise
+                responses, error = e.responses, e
+            break
+        if lines:
+            lines.finish()
+        stdout, stderr = [], []
+        for message in responses:
+            for number, value in _fields(message):
+                if number == 1:
+                    stdout.append(value)
+                elif number == 2:
+                    stderr.append(value)
+        out = b''.join(stdout).decode('utf-8', errors='replace')
+        err = b''.join(stderr).decode('utf-8', errors='replace')
+        if error is None:
+            return ExecResult(0, out, err)
+        if error.code == 'DEADLINE_EXCEEDED':
+            return ExecResult(124, out, err)
+        return ExecResult(1, out, f"{err}\nError during build: {error.details}\n")
+
+    def close(self):
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
+        self._instances.clear()
+
+
+class CompileDaemons:
+    """Daemon clients of the compile workers; compile() returns None to fall back to the CLI"""
+
+    def __init__(self, platforms):
+        self.platforms = platforms
+        self._daemons = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return compile_workers.enabled and compile_workers.daemon
+
+    def _address(self, host):
+        """Daemon address on the internal worker network; never the shared bridge user containers are on"""
+        info = get_runtime().inspect(host) or {}
+        networks = (info.get('NetworkSettings') or {}).get('Networks') or {}
+        ip = (networks.get(compile_workers.network) or {}).get('IPAddress')
+        return f"{ip}:{DAEMON_PORT}" if ip else None
+
+    def daemon(self, host):
+        with self._lock:
+            daemon = self._daemons.get(host)
+            if daemon is None:
+                address = self._address(host)
+                if not address:
+                    return None
+                daemon = self._daemons[host] = ArduinoDaemon(host, address)
+            return daemon
+
+    def forget(self, host):
+        with self._lock:
+            daemon = self._daemons.pop(host, None)
+        if daemon:
+            daemon.close()
+
+    def compile(self, host, safe_username, sketch_filename, board_fqbn, build, parser=None):
+        """ExecResult of a daemon compile, or None to fall back to the CLI; parser is fed while it runs"""
+        if not self.enabled or host not in compile_workers.names:
+            return None
+        daemon = self.daemon(host)
+        if daemon is None:
+            COMPILE_DAEMON_REQUESTS.labels(result='fallback').inc()
+            return None
+        try:
+            with build.hold():
+                result = daemon.compile(board_fqbn, compile_workers.paths(safe_username, sketch_filename),
+                                        build_cache_path=build.container_dir,
+                                        on_line=parser.feed if parser else None)
+        except (DaemonError, ValueError, IndexError) as e:
+            logger.warning(f"arduino-cli daemon on {host} unusable, falling back to the CLI: {e}")
+            COMPILE_DAEMON_REQUESTS.labels(result='fallback').inc()
+            self.forget(host)   # kết nối lại (địa chỉ mới nếu worker được tạo lại) ở lần sau
+            return None
+        COMPILE_DAEMON_REQUESTS.labels(result='ok' if result.exit_code == 0 else 'failed').inc()
+        return result
+
+    # ---------- Giữ instance ấm ----------
+    def start(self):
+        """Create the platform instances on every worker in the background"""
+        if not self.enabled or not self.platforms:
+            return
+        threading.Thread(target=self._warm_all, name="compile-daemon-warm", daemon=True).start()
+
+    def _warm_all(self, attempts=15, delay=2):
+        pending = list(compile_workers.names)
+        for _ in range(attempts):
+            for host in list(pending):
+                try:
+                    daemon = self.daemon(host)
+                    if daemon is None:
+                        continue
+                    for platform in self.platforms:
+                        daemon.instance(platform)
+                    pending.remove(host)
+                except DaemonError as e:
+                    logger.debug(f"arduino-cli daemon on {host} not ready: {e}")
+                    self.forget(host)
+            if not pending:
+                return
+            time.sleep(delay)     # daemon vừa khởi động cùng worker
+        logger.warning(f"arduino-cli daemon not reachable on {', '.join(pending)}; compiles there use the CLI")
+
+
+compile_daemons = CompileDaemons(platforms=SYSTEM_CONFIG['COMPILE_DAEMON_PLATFORMS'])
@@ -0,0 +1,299 @@
+"""
+Compile job queue
+/compile no longer runs arduino-cli inside the HTTP request: it enqueues a job
+and returns its id. COMPILE_QUEUE_CONCURRENCY jobs run at once (default: one
+per CPU core), at most COMPILE_QUEUE_PER_USER per user, and the 'exam' lane
+(students with a mission in progress) is always served before 'interactive'.
+Submitting a compile identical to one already waiting (same user, sketch and
+board), or to a running one whose sources have not changed since it started,
+returns the existing job. Progress is pushed as 'compile_status' events, and
+each compiler error/warning as a 'compile_diagnostic' event while the build
+runs, on the /upload_status namespace to sockets that subscribed to the job;
+finished jobs can be polled for COMPILE_QUEUE_RESULT_TTL seconds.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import deque, defaultdict
+from prometheus_client import Counter, Gauge, Histogram
+from config import get_db_connection, SYSTEM_CONFIG
+from utils import make_safe_name
+from services.compile_cache import compile_cache
+
+logger = logging.getLogger(__name__)
+
+COMPILE_QUEUE_DEPTH = Gauge('compile_queue_depth', 'Compile jobs waiting to run', ['lane'])
+COMPILE_QUEUE_RUNNING = Gauge('compile_queue_running', 'Compile jobs running')
+COMPILE_QUEUE_JOBS = Counter('compile_queue_jobs_total', 'Compile jobs by outcome', ['lane', 'result'])
+COMPILE_QUEUE_WAIT_SECONDS = Histogram('compile_queue_wait_seconds', 'Time a compile job waited in the queue', ['lane'],
+                                       buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300))
+
+# Thứ tự ưu tiên: lane đứng trước luôn được phục vụ trước
+LANES = ('exam', 'interactive')
+
+
+class QueueFull(Exception):
+    """The user already has the maximum number of compiles waiting"""
+
+
+class CompileJob:
+    __slots__ = ('id', 'username', 'board_fqbn', 'sketch_path', 'key', 'lane', 'state', 'result',
+                 'source_key', 'sids', 'created', 'started', 'finished', '_done')
+
+    def __init__(self, username, board_fqbn, sketch_path, lane):
+        self.id = uuid.uuid4().hex
+        self.username = username
+        self.board_fqbn = board_fqbn
+        self.sketch_path = sketch_path
+        self.key = (make_safe_name(username), os.path.basename(sketch_path), board_fqbn)
+        self.lane = lane
+        self.state = 'queued'        # queued -> running -> done
+        self.result = None
+        self.source_key = None       # hash mã nguồn lúc bắt đầu chạy (gộp job khi chưa đổi)
+        self.sids = set()            # socket /upload_status đang theo dõi
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self, position=None):
+        data = {
+            'job_id': self.id,
+            'state': self.state,
+            'lane': self.lane,
+            'sketch_path': self.sketch_path,
+            'board_fqbn': self.board_fqbn,
+            'position': position,
+            'queued_at': self.created,
+            'started_at': self.started,
+            'finished_at': self.finished,
+        }
+        if self.result is not None:
+            data['result'] = self.result
+        return data
+
+
+def compile_lane(username):
+    """'exam' while the user has an assigned mission in progress and not yet submitted"""
+    db = get_db_connection()
+    if not db:
+        return 'interactive'
+    try:
+        cur = db.cursor()
+        cur.execute("""
+            SELECT 1 FROM missions m
+            JOIN mission_assignments ma ON m.id = ma.mission_id
+            JOIN users u ON u.id = ma.user_id
+            LEFT JOIN submissions s ON s.mission_id = m.id AND s.user_id = u.id
+            WHERE u.username = %s
+              AND m.start_time <= CURRENT_TIMESTAMP
+              AND m.end_time >= CURRENT_TIMESTAMP
+              AND s.id IS NULL
+            LIMIT 1
+        """, (username,))
+        in_exam = cur.fetchone() is not None
+        cur.close()
+        return 'exam' if in_exam else 'interactive'
+    except Exception as e:
+        logger.warning(f"Compile lane lookup for {username} failed: {e}")
+        return 'interactive'
+    finally:
+        db.close()
+
+
+class CompileQueue:
+    """Priority lanes + global and per-user concurrency limits for compiles"""
+
+    def __init__(self, concurrency, per_user, per_user_pending, result_ttl):
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.per_user = max(1, per_user)
+        self.per_user_pending = per_user_pending
+        self.result_ttl = result_ttl
+        self.socketio = None
+        self._lanes = {lane: deque() for lane in LANES}
+        self._jobs = {}                     # job_id -> job (chờ, đang chạy, xong trong result_ttl)
+        self._queued = {}                   # key -> job đang chờ
+        self._active = {}                   # key -> job đang chạy
+        self._running = defaultdict(int)    # safe_username -> số job đang chạy
+        self._finished = deque()            # (thời điểm xong, job_id) để dọn kết quả cũ
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self, socketio=None):
+        """Start the worker threads (idempotent); socketio is used to push job updates"""
+        if socketio is not None:
+            self.socketio = socketio
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.concurrency):
+            threading.Thread(target=self._worker, name=f"compile-queue-{i}", daemon=True).start()
+        logger.info(f"Compile queue started ({self.concurrency} concurrent, {self.per_user} per user)")
+
+    # ---------- Nhận job ----------
+    def submit(self, username, board_fqbn, sketch_path, lane='interactive'):
+        """Queue a compile, or return the identical job already queued/running"""
+        if lane not in self._lanes:
+            raise ValueError(f"Unknown compile lane: {lane}")
+        self.start()
+        job = CompileJob(username, board_fqbn, sketch_path, lane)
+        running = self._active.get(job.key)
+        # Đọc mã nguồn ngoài khóa; chỉ cần khi có job giống hệt đang chạy
+        source_key = compile_cache.key(*job.key) if running and running.source_key else None
+        with self._cond:
+            self._prune_locked()
+            existing = self._queued.get(job.key)
+            if existing:
+                if LANES.index(lane) < LANES.index(existing.lane):
+                    self._lanes[existing.lane].remove(existing)
+                    existing.lane = lane
+                    self._lanes[lane].append(existing)
+                    self._update_gauges_locked()
+                COMPILE_QUEUE_JOBS.labels(lane=lane, result='deduplicated').inc()
+                return existing
+            running = self._active.get(job.key)
+            if running and source_key and running.source_key == source_key:
+                COMPILE_QUEUE_JOBS.labels(lane=lane, result='deduplicated').inc()
+                return running
+            pending = sum(1 for j in self._queued.values() if j.key[0] == job.key[0])
+            if self.per_user_pending and pending >= self.per_user_pending:
+                COMPILE_QUEUE_JOBS.labels(lane=lane, result='rejected').inc()
+                raise QueueFull(f"Đang có {pending} lượt biên dịch chờ, vui lòng đợi")
+            self._jobs[job.id] = job
+            self._queued[job.key] = job
+            self._lanes[lane].append(job)
+            self._update_gauges_locked()
+            self._cond.notify()
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def status(self, job):
+        with self._cond:
+            return job.to_dict(self._position_locked(job))
+
+    def subscribe(self, job_id, sid):
+        """Push this job's updates to socket sid; returns the current status or None"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            if job.state != 'done':
+                job.sids.add(sid)
+            return job.to_dict(self._position_locked(job))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'concurrency': self.concurrency,
+                'running': sum(self._running.values()),
+                'queued': {lane: len(q) for lane, q in self._lanes.items()},
+            }
+
+    # ---------- Điều phối ----------
+    def _position_locked(self, job):
+        if job.state != 'queued':
+            return None
+        position = 0
+        for lane in LANES:
+            if lane == job.lane:
+                return position + self._lanes[lane].index(job)
+            position += len(self._lanes[lane])
+        return None
+
+    def _next_locked(self):
+        """Oldest job of the highest lane whose user is below the per-user limit"""
+        for lane in LANES:
+            for job in self._lanes[lane]:
+                if self._running[job.key[0]] < self.per_user:
+                    self._lanes[lane].remove(job)
+                    return job
+        return None
+
+    def _update_gauges_locked(self):
+        for lane, q in self._lanes.items():
+            COMPILE_QUEUE_DEPTH.labels(lane=lane).set(len(q))
+        COMPILE_QUEUE_RUNNING.set(sum(self._running.values()))
+
+    def _prune_locked(self):
+        cutoff = time.time() - self.result_ttl
+        while self._finished and self._finished[0][0] < cutoff:
+            self._jobs.pop(self._finished.popleft()[1], None)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_locked()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_locked()
+                del self._queued[job.key]
+                self._active[job.key] = job
+                self._running[job.key[0]] += 1
+                job.state = 'running'
+                job.started = time.time()
+                self._update_gauges_locked()
+                waiting = [j for q in self._lanes.values() for j in q if j.sids]
+            COMPILE_QUEUE_WAIT_SECONDS.labels(lane=job.lane).observe(job.started - job.created)
+            self._notify(job)
+            for other in waiting:
+                self._notify(other)     # vị trí trong hàng đợi đã đổi
+            self._run(job)
+
+    def _run(self, job):
+        from services.arduino import compile_sketch
+        try:
+            job.source_key = compile_cache.key(*job.key)
+            result = compile_sketch(job.username, job.board_fqbn, job.sketch_path,
+                                    on_diagnostic=lambda diagnostic: self._push_diagnostic(job, diagnostic))
+        except Exception as e:
+            logger.error(f"Compile job {job.id} crashed: {e}")
+            result = {'success': False, 'output': str(e), 'analysis': {'error_count': 1}}
+        with self._cond:
+            job.result = result
+            job.state = 'done'
+            job.finished = time.time()
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+            self._running[job.key[0]] -= 1
+            if not self._running[job.key[0]]:
+                del self._running[job.key[0]]
+            self._finished.append((job.finished, job.id))
+            self._update_gauges_locked()
+            self._cond.notify_all()
+        job._done.set()
+        COMPILE_QUEUE_JOBS.labels(lane=job.lane, result='success' if result.get('success') else 'failed').inc()
+        self._notify(job)
+
+    def _push_diagnostic(self, job, diagnostic):
+        if not self.socketio or not job.sids:
+            return
+        payload = {'job_id': job.id, 'diagnostic': diagnostic}
+        for sid in list(job.sids):
+            self.socketio.emit('compile_diagnostic', payload, namespace='/upload_status', room=sid)
+
+    def _notify(self, job):
+        if not self.socketio or not job.sids:
+            return
+        payload = self.status(job)
+        for sid in list(job.sids):
+            try:
+                self.socketio.emit('compile_status', payload, namespace='/upload_status', room=sid)
+            except Exception as e:
+                logger.debug(f"compile_status to {sid} failed: {e}")
+
+
+compile_queue = CompileQueue(
+    concurrency=SYSTEM_CONFIG['COMPILE_QUEUE_CONCURRENCY'],
+    per_user=SYSTEM_CONFIG['COMPILE_QUEUE_PER_USER'],
+    per_user_pending=SYSTEM_CONFIG['COMPILE_QUEUE_USER_PENDING'],
+    result_ttl=SYSTEM_CONFIG['COMPILE_QUEUE_RESULT_TTL'],
+)
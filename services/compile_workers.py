@@ -0,0 +1,293 @@
+"""
+Shared compile worker pool
+COMPILE_WORKERS dedicated containers (compile-worker-<n>) run arduino-cli for
+everybody, so user containers need no toolchain in memory and a compile does
+not wake a hibernated container. Workers mount the shared Arduino
+cores/libraries, a per-worker build cache volume and the artifacts directory,
+and (COMPILE_DAEMON) run `arduino-cli daemon` for services.compile_daemon.
+They do not see the workspaces: job() copies only the requesting user's sketch
+and libraries into the worker for the duration of one compile. A user is
+pinned to one worker (crc32 of the name) so incremental builds hit a warm build
+path; when that worker is busy the job goes to any idle worker.
+"""
+import io
+import os
+import time
+import zlib
+import tarfile
+import logging
+import threading
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+from config import SYSTEM_CONFIG
+from utils import is_sketch_filename
+from services import arduino_shared, build_cache
+from services.container_runtime import get_runtime
+from services.container_setup import USER_ENV_IMAGE
+from services.cpu_scheduler import CPU_PERIOD
+
+logger = logging.getLogger(__name__)
+
+COMPILE_WORKER_JOBS = Counter('compile_worker_jobs_total', 'Compiles dispatched to workers', ['placement'])
+COMPILE_WORKERS_BUSY = Gauge('compile_workers_busy', 'Compile workers running a job')
+COMPILE_WORKER_WAIT_SECONDS = Histogram('compile_worker_wait_seconds', 'Time a compile waited for a worker',
+                                        buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60))
+
+WORKER_PREFIX = "compile-worker-"
+BUILD_MOUNT = "/build"
+ARTIFACTS_MOUNT = "/artifacts"
+
+DAEMON_PORT = 50051
+
+# Trước mỗi job: xóa mọi thứ của user trong worker trừ build/ (put_archive chép sketch + thư viện vào sau)
+STAGE_SCRIPT = r"""
+set -e
+user="$1"; file="$2"
+name="${file%.*}"
+mkdir -p "/build/$user"
+find "/build/$user" -mindepth 1 -maxdepth 1 ! -name build -exec rm -rf {} +
+mkdir -p "/build/$user/sketch/$name" "/build/$user/libraries" "/artifacts/$user/$name"
+"""
+
+COMPILE_SCRIPT = r"""
+user="$1"; file="$2"; fqbn="$3"
+name="${file%.*}"
+exec arduino-cli compile --fqbn "$fqbn" \
+    --libraries "/build/$user/libraries" \
+    --build-path "/build/$user/build/$name" \
+    --output-dir "/artifacts/$user/$name" \
+    "/build/$user/sketch/$name"
+"""
+
+# Sau job: xóa mã nguồn đã chép và bản sao/tiền xử lý trong build path (giữ .o/.d cho build tăng dần),
+# để sketch của user khác cùng worker không #include được
+CLEAR_SCRIPT = r"""
+user="$1"; file="$2"
+name="${file%.*}"
+[ -d "/build/$user" ] && find "/build/$user" -mindepth 1 -maxdepth 1 ! -name build -exec rm -rf {} +
+[ -d "/build/$user/build/$name" ] && find "/build/$user/build/$name" -type f \
+    \( -name '*.ino' -o -name '*.pde' -o -name '*.cpp' -o -name '*.c' -o -name '*.h' -o -name '*.hpp' -o -name '*.S' \) -delete
+exit 0
+"""
+
+
+def _add_tree(tar, path, arcname):
+    """Add a directory to the archive without following or storing symlinks"""
+    if not os.path.isdir(path) or os.path.islink(path):
+        return
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(root, d))]
+        rel = os.path.relpath(root, path)
+        base = arcname if rel == '.' else f"{arcname}/{rel}"
+        tar.add(root, base, recursive=False)
+        for f in files:
+            full = os.path.join(root, f)
+            if os.path.isfile(full) and not os.path.islink(full):
+                tar.add(full, f"{base}/{f}")
+
+
+# arduino-cli daemon chạy nền cho compile qua gRPC (tự chạy lại nếu chết); container sống nhờ sleep.
+# Daemon không xác thực: worker chỉ nằm trên mạng internal riêng, container user không tham gia
+DAEMON_SCRIPT = (f"(while true; do arduino-cli daemon --ip 0.0.0.0 --port {DAEMON_PORT}; sleep 2; done)"
+                 " >/tmp/arduino-daemon.log 2>&1 & exec sleep infinity")
+
+
+class CompileWorkerPool:
+    """Fixed set of compile containers with per-user affinity"""
+
+    def __init__(self, size, cpus, memory_limit, artifacts_root, daemon=False, network=None):
+        self.size = size
+        self.cpus = cpus
+        self.memory_limit = memory_limit
+        self.artifacts_root = artifacts_root
+        self.daemon = daemon
+        self.network = network
+        self.names = [f"{WORKER_PREFIX}{i}" for i in range(size)]
+        self._slots = {name: threading.Lock() for name in self.names}
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._started = False
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    # ---------- Vòng đời worker ----------
+    def start(self):
+        """Create or restart missing workers (idempotent)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        os.makedirs(self.artifacts_root, exist_ok=True)
+        if self.network:
+            try:
+                get_runtime().ensure_network(self.network, internal=True)
+            except Exception as e:
+                logger.error(f"Compile worker network {self.network} not available: {e}")
+                return
+        for name in self.names:
+            try:
+                self._ensure_worker(name)
+            except Exception as e:
+                logger.error(f"Compile worker {name} not available: {e}")
+        logger.info(f"Compile worker pool started ({self.size} workers)")
+
+    def _ensure_worker(self, name):
+        runtime = get_runtime()
+        status = runtime.status(name)
+        if status and self.network and self.network not in self._networks(name):
+            status = 'stale'     # worker cũ nằm trên mạng bridge chung: tạo lại
+        if status == 'running':
+            return
+        if status in ('exited', 'created'):
+            runtime.start(name)
+            return
+        if status:
+            runtime.remove(name, force=True)
+        arduino_volumes, arduino_env = arduino_shared.container_options()
+        limits = {}
+        if self.cpus > 0:
+            limits.update(cpu_period=CPU_PERIOD, cpu_quota=int(self.cpus * CPU_PERIOD))
+        if self.memory_limit:
+            limits.update(mem_limit=self.memory_limit, memswap_limit=self.memory_limit)
+        runtime.run(
+            name, USER_ENV_IMAGE,
+            command=["-c", DAEMON_SCRIPT if self.daemon else "exec sleep infinity"],
+            entrypoint="/bin/bash",
+            restart_policy={"Name": "unless-stopped"},
+            environment={"ARDUINO_DIRECTORIES_DOWNLOADS": f"{BUILD_MOUNT}/staging", **arduino_env},
+            volumes={
+                f"epu-compile-cache-{name[len(WORKER_PREFIX):]}": {"bind": BUILD_MOUNT, "mode": "rw"},
+                self.artifacts_root: {"bind": ARTIFACTS_MOUNT, "mode": "rw"},
+                **arduino_volumes,
+                **build_cache.container_volumes(writable=True),
+            },
+            labels={"epu.role": "compile-worker"},
+            network=self.network,
+            **limits,
+        )
+        logger.info(f"Created compile worker {name}")
+
+    # ---------- Điều phối ----------
+    def preferred(self, safe_username):
+        return self.names[zlib.crc32(safe_username.encode('utf-8')) % self.size]
+
+    @contextmanager
+    def acquire(self, safe_username):
+        """Reserve a worker for one compile; yields the worker container name"""
+        self.start()
+        started = time.monotonic()
+        name = self.preferred(safe_username)
+        placement = 'affinity'
+        if not self._slots[name].acquire(blocking=False):
+            idle = next((n for n in self.names if n != name and self._slots[n].acquire(blocking=False)), None)
+            if idle:
+                name, placement = idle, 'spill'
+            else:
+                # Mọi worker đều bận: xếp hàng ở worker ưu tiên (giữ cache)
+                self._slots[name].acquire()
+                placement = 'queued'
+        COMPILE_WORKER_WAIT_SECONDS.observe(time.monotonic() - started)
+        COMPILE_WORKER_JOBS.labels(placement=placement).inc()
+        with self._lock:
+            self._busy += 1
+            COMPILE_WORKERS_BUSY.set(self._busy)
+        try:
+            if get_runtime().status(name) != 'running':
+                self._ensure_worker(name)
+            yield name
+        finally:
+            with self._lock:
+                self._busy -= 1
+                COMPILE_WORKERS_BUSY.set(self._busy)
+            self._slots[name].release()
+
+    @contextmanager
+    def job(self, safe_username, sketch_filename):
+        """acquire() with the user's sources copied into the worker until the compile is over"""
+        with self.acquire(safe_username) as worker:
+            self.stage(worker, safe_username, sketch_filename)
+            try:
+                yield worker
+            finally:
+                self.clear(worker, safe_username, sketch_filename)
+
+    def sources_archive(self, safe_username, sketch_filename):
+        """Tar of the user's sketch folder and ~/Arduino/libraries, like prepare_sketch_folder.
+
+        A file of the same name at the workspace root overrides the one in the
+        sketch folder. Symlinks are left out so nothing outside the user's home
+        reaches the worker; mtimes are kept so unchanged libraries are not rebuilt.
+        """
+        # Import muộn: workspace_storage -> ssh_manager -> docker_manager -> ... -> compile_workers
+        from services.workspace_storage import get_host_user_dir
+        home = get_host_user_dir(safe_username)
+        name = os.path.splitext(sketch_filename)[0]
+        if not is_sketch_filename(sketch_filename) or \
+                os.path.dirname(os.path.realpath(os.path.join(home, name))) != os.path.realpath(home):
+            raise ValueError(f"Invalid sketch name: {sketch_filename!r}")
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            _add_tree(tar, os.path.join(home, name), f"sketch/{name}")
+            root_file = os.path.join(home, sketch_filename)
+            if os.path.isfile(root_file) and not os.path.islink(root_file):
+                tar.add(root_file, f"sketch/{name}/{sketch_filename}")
+            _add_tree(tar, os.path.join(home, 'Arduino', 'libraries'), "libraries")
+        return buffer.getvalue()
+
+    def stage(self, worker, safe_username, sketch_filename):
+        runtime = get_runtime()
+        result = runtime.exec(worker, ["bash", "-c", STAGE_SCRIPT, "stage", safe_username, sketch_filename], timeout=60)
+        if result.exit_code != 0:
+            raise RuntimeError(f"Preparing {worker} failed: {(result.stderr or result.stdout).strip()}")
+        runtime.put_archive(worker, f"{BUILD_MOUNT}/{safe_username}", self.sources_archive(safe_username, sketch_filename))
+
+    def clear(self, worker, safe_username, sketch_filename):
+        try:
+            get_runtime().exec(worker, ["bash", "-c", CLEAR_SCRIPT, "clear", safe_username, sketch_filename], timeout=60)
+        except Exception as e:
+            logger.warning(f"Clearing sources of {safe_username} on {worker} failed: {e}")
+
+    def command(self, safe_username, sketch_filename, board_fqbn):
+        return ["bash", "-c", COMPILE_SCRIPT, "compile", safe_username, sketch_filename, board_fqbn]
+
+    def paths(self, safe_username, sketch_filename):
+        """Worker-side paths used by COMPILE_SCRIPT"""
+        name = os.path.splitext(sketch_filename)[0]
+        return {
+            'sketch': f"{BUILD_MOUNT}/{safe_username}/sketch/{name}",
+            'build': f"{BUILD_MOUNT}/{safe_username}/build/{name}",
+            'output': f"{ARTIFACTS_MOUNT}/{safe_username}/{name}",
+            'libraries': f"{BUILD_MOUNT}/{safe_username}/libraries",
+        }
+
+    def artifacts_dir(self, safe_username, sketch_filename):
+        return os.path.join(self.artifacts_root, safe_username, os.path.splitext(sketch_filename)[0])
+
+    def artifacts(self, safe_username, sketch_filename):
+        """Host paths of the build outputs (.bin/.hex/.elf) of the last compile"""
+        out_dir = self.artifacts_dir(safe_username, sketch_filename)
+        try:
+            return sorted(os.path.join(out_dir, f) for f in os.listdir(out_dir))
+        except OSError:
+            return []
+
+    def _networks(self, name):
+        info = get_runtime().inspect(name) or {}
+        return (info.get('NetworkSettings') or {}).get('Networks') or {}
+
+    def stats(self):
+        return {'workers': self.size, 'busy': self._busy}
+
+
+compile_workers = CompileWorkerPool(
+    size=SYSTEM_CONFIG['COMPILE_WORKERS'],
+    cpus=SYSTEM_CONFIG['COMPILE_WORKER_CPUS'],
+    memory_limit=SYSTEM_CONFIG['COMPILE_WORKER_MEMORY'],
+    artifacts_root=SYSTEM_CONFIG['COMPILE_ARTIFACTS_ROOT'],
+    daemon=SYSTEM_CONFIG['COMPILE_DAEMON'],
+    network=SYSTEM_CONFIG['COMPILE_WORKER_NETWORK'],
+)
@@ -0,0 +1,199 @@
+"""
+Container readiness service
+Tracks whether the sshd of each user container accepts connections.
+Callers for the same container share one probe loop (exponential backoff with
+jitter) instead of each sleeping in its own retry loop, and containers known to
+be dead fail fast through a circuit breaker.
+"""
+import time
+import random
+import socket
+import threading
+import logging
+from prometheus_client import Counter, Histogram
+from config import SYSTEM_CONFIG
+
+logger = logging.getLogger(__name__)
+
+READINESS_WAIT_SECONDS = Histogram('container_ready_wait_seconds', 'Time spent waiting for a container sshd to become ready',
+                                   buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 20, 30))
+READINESS_FAST_FAILS = Counter('container_ready_fast_fail_total', 'Requests rejected immediately by the readiness circuit breaker')
+
+STATE_UNKNOWN = 'unknown'
+STATE_STARTING = 'starting'
+STATE_READY = 'ready'
+STATE_DEAD = 'dead'
+
+
+class ContainerUnavailableError(Exception):
+    """Container sshd is not reachable (dead container or readiness timeout)"""
+
+
+class _Readiness:
+    __slots__ = ('state', 'event', 'probing', 'failures', 'open_until', 'reason')
+
+    def __init__(self):
+        self.state = STATE_UNKNOWN
+        self.event = threading.Event()
+        self.probing = False
+        self.failures = 0
+        self.open_until = 0.0
+        self.reason = ''
+
+
+_states = {}
+_lock = threading.Lock()
+
+
+def _get(cname):
+    st = _states.get(cname)
+    if st is None:
+        st = _states[cname] = _Readiness()
+    return st
+
+
+def mark_starting(cname, keep_ready=False):
+    """Container was just (re)started: close the breaker and wait for sshd again"""
+    with _lock:
+        st = _get(cname)
+        if keep_ready and st.state == STATE_READY:
+            return
+        st.state = STATE_STARTING
+        st.failures = 0
+        st.open_until = 0.0
+        st.reason = ''
+
+
+def mark_ready(cname):
+    with _lock:
+        st = _get(cname)
+        st.state = STATE_READY
+        st.failures = 0
+        st.open_until = 0.0
+        st.event.set()
+
+
+def mark_unready(cname):
+    """sshd stopped answering although we thought it was ready; probe again next time"""
+    with _lock:
+        st = _states.get(cname)
+        if st and st.state == STATE_READY:
+            st.state = STATE_UNKNOWN
+
+
+def mark_dead(cname, reason='container not running'):
+    """Container is known dead: open the breaker and wake up everybody waiting"""
+    with _lock:
+        st = _get(cname)
+        st.state = STATE_DEAD
+        st.reason = reason
+        st.open_until = time.monotonic() + SYSTEM_CONFIG['READINESS_BREAKER_COOLDOWN']
+        st.event.set()
+    logger.warning(f"Readiness: {cname} marked dead ({reason})")
+
+
+def forget(cname):
+    with _lock:
+        st = _states.pop(cname, None)
+    if st:
+        st.event.set()
+
+
+def get_state(cname):
+    st = _states.get(cname)
+    return st.state if st else STATE_UNKNOWN
+
+
+def probe_sshd(ssh_port, timeout=2.0):
+    """True if something on the port answers with an SSH banner.
+
+    docker-proxy accepts TCP connections even before sshd runs inside the
+    container, so a plain connect() is not enough.
+    """
+    try:
+        with socket.create_connection(('127.0.0.1', int(ssh_port)), timeout=timeout) as s:
+            s.settimeout(timeout)
+            return s.recv(8).startswith(b'SSH-')
+    except OSError:
+        return False
+
+
+def _container_alive(cname):
+    # Import muộn để tránh vòng import docker_manager -> ssh_manager -> readiness
+    from services.docker_manager import docker_status
+    status = docker_status(cname)
+    return status in ('running', 'restarting', 'created')
+
+
+def _probe_loop(cname, ssh_port, deadline):
+    base = SYSTEM_CONFIG['READINESS_BACKOFF_BASE']
+    cap = SYSTEM_CONFIG['READINESS_BACKOFF_MAX']
+    attempt = 0
+    while True:
+        if probe_sshd(ssh_port):
+            return True, ''
+        attempt += 1
+        # Thỉnh thoảng hỏi Docker: container chết thì thôi không chờ nữa
+        if attempt % 3 == 0 and not _container_alive(cname):
+            return False, 'container not running'
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False, 'sshd readiness timeout'
+        delay = min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        time.sleep(min(delay, remaining))
+
+
+def wait_until_ready(cname, ssh_port, timeout=None):
+    """Block until the container sshd answers, sharing one probe per container.
+
+    Raises ContainerUnavailableError on timeout or when the breaker is open.
+    """
+    timeout = timeout if timeout is not None else SYSTEM_CONFIG['CONTAINER_READY_TIMEOUT']
+    started = time.monotonic()
+    deadline = started + timeout
+
+    with _lock:
+        st = _get(cname)
+        if st.state == STATE_READY:
+            return
+        if st.open_until > started:
+            READINESS_FAST_FAILS.inc()
+            raise ContainerUnavailableError(f"Container {cname} unavailable: {st.reason}")
+        if st.probing:
+            event = st.event
+            leader = False
+        else:
+            st.probing = True
+            st.event = event = threading.Event()
+            leader = True
+
+    if not leader:
+        event.wait(timeout)
+        READINESS_WAIT_SECONDS.observe(time.monotonic() - started)
+        st = _states.get(cname)
+        if st and st.state == STATE_READY:
+            return
+        raise ContainerUnavailableError(f"Container {cname} unavailable: {st.reason if st else 'reset'}")
+
+    ok, reason = False, 'probe crashed'
+    try:
+        ok, reason = _probe_loop(cname, ssh_port, deadline)
+    finally:
+        with _lock:
+            st.probing = False
+            if ok:
+                st.state = STATE_READY
+                st.failures = 0
+            else:
+                st.failures += 1
+                st.reason = reason
+                if reason == 'container not running':
+                    st.state = STATE_DEAD
+                if st.state == STATE_DEAD or st.failures >= SYSTEM_CONFIG['READINESS_BREAKER_THRESHOLD']:
+                    st.open_until = time.monotonic() + SYSTEM_CONFIG['READINESS_BREAKER_COOLDOWN']
+            event.set()
+        READINESS_WAIT_SECONDS.observe(time.monotonic() - started)
+
+    if not ok:
+        logger.error(f"Readiness: {cname} on port {ssh_port} not ready: {reason}")
+        raise ContainerUnavailableError(f"Container {cname} unavailable: {reason}")
@@ -0,0 +1,446 @@
+"""
+Container runtime layer
+Talks to the Docker Engine API over one persistent unix-socket connection
+(docker SDK) instead of forking the docker CLI for every call. InMemoryRuntime
+is a swappable fake used by tests and local development without Docker.
+"""
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from functools import wraps
+from prometheus_client import Counter, Histogram
+from config import SYSTEM_CONFIG
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_CALL_SECONDS = Histogram('container_runtime_call_seconds', 'Latency of container runtime calls', ['op'],
+                                   buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 120))
+CONTAINER_CALL_ERRORS = Counter('container_runtime_errors_total', 'Failed container runtime calls', ['op'])
+
+ExecResult = namedtuple('ExecResult', ['exit_code', 'stdout', 'stderr'])
+
+
+class ContainerRuntimeError(Exception):
+    pass
+
+
+def _timed(op):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return f(*args, **kwargs)
+            except Exception:
+                CONTAINER_CALL_ERRORS.labels(op=op).inc()
+                raise
+            finally:
+                CONTAINER_CALL_SECONDS.labels(op=op).observe(time.monotonic() - started)
+        return wrapper
+    return decorator
+
+
+def _with_timeout(cmd, timeout):
+    # Engine API không có timeout cho exec: dùng coreutils timeout bên trong container
+    return ['timeout', str(int(timeout))] + list(cmd) if timeout else list(cmd)
+
+
+class ExecStream:
+    """Line iterator over a running exec; exit_code is set once exhausted"""
+
+    def __init__(self, chunks, get_exit_code):
+        self._chunks = chunks
+        self._get_exit_code = get_exit_code
+        self.exit_code = None
+
+    def __iter__(self):
+        buffer = b''
+        for chunk in self._chunks:
+            buffer += chunk
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                yield line.decode('utf-8', errors='replace')
+        if buffer:
+            yield buffer.decode('utf-8', errors='replace')
+        self.exit_code = self._get_exit_code()
+
+
+class ContainerRuntime(ABC):
+    """Operations the platform needs from the container engine"""
+
+    @abstractmethod
+    def status(self, name):
+        """State.Status of a container ('running', 'exited', ...) or '' if missing"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def inspect(self, name):
+        """Full inspect document of a container or None if missing"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def run(self, name, image, command=None, entrypoint=None, ports=None, volumes=None,
+            environment=None, privileged=False, restart_policy=None, group_add=None, **extra):
+        """Create and start a detached container, return its id"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove(self, name, force=True):
+        raise NotImplementedError
+
+    @abstractmethod
+    def ensure_network(self, name, internal=True):
+        """Create a bridge network unless it exists; internal = no route out of the host"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def rename(self, name, new_name):
+        raise NotImplementedError
+
+    @abstractmethod
+    def start(self, name):
+        raise NotImplementedError
+
+    @abstractmethod
+    def stop(self, name, timeout=10):
+        raise NotImplementedError
+
+    @abstractmethod
+    def pause(self, name):
+        raise NotImplementedError
+
+    @abstractmethod
+    def unpause(self, name):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, name, **resources):
+        """Change cgroup limits of a running container (cpu_period, cpu_quota, mem_limit, ...)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def exec(self, name, cmd, user=None, timeout=None):
+        """Run cmd in the container and wait: ExecResult(exit_code, stdout, stderr)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def exec_stream(self, name, cmd, user=None, timeout=None):
+        """Run cmd with stdout+stderr merged, streamed line by line (ExecStream)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_archive(self, name, path, data):
+        """Extract a tar archive (bytes) into directory `path` of the container"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_names(self, name_filter=None, running=True):
+        """Container names; running=True also lists paused containers, as Docker does"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_states(self, name_filter=None):
+        """{name: State.Status} of every container, running or not"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def events(self, since=None, until=None):
+        """Container lifecycle events (decoded dicts as in the Engine API), blocking until `until`"""
+        raise NotImplementedError
+
+
+# ================== DOCKER ENGINE API ==================
+class DockerEngineRuntime(ContainerRuntime):
+
+    def __init__(self, base_url=None, timeout=60):
+        self.base_url = base_url or SYSTEM_CONFIG['DOCKER_HOST']
+        self.timeout = timeout
+        self._client = None
+        self._exec_api = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Một DockerClient dùng chung: requests giữ kết nối unix socket giữa các lần gọi
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import docker
+                    self._client = docker.DockerClient(base_url=self.base_url, timeout=self.timeout)
+        return self._client
+
+    @property
+    def api(self):
+        return self.client.api
+
+    @property
+    def exec_api(self):
+        # timeout của docker SDK là timeout đọc socket: exec im lặng lâu (build esp32 nguội không -v)
+        # sẽ bị cắt sau self.timeout giây. Exec dùng client riêng không timeout, giới hạn bằng coreutils timeout
+        if self._exec_api is None:
+            version = self.api.api_version
+            with self._lock:
+                if self._exec_api is None:
+                    import docker
+                    self._exec_api = docker.APIClient(base_url=self.base_url, version=version, timeout=None)
+        return self._exec_api
+
+    @_timed('inspect')
+    def inspect(self, name):
+        import docker.errors
+        try:
+            return self.api.inspect_container(name)
+        except docker.errors.NotFound:
+            return None
+
+    def status(self, name):
+        try:
+            data = self.inspect(name)
+        except Exception as e:
+            logger.warning(f"Docker inspect {name} failed: {e}")
+            return ""
+        return data['State']['Status'] if data else ""
+
+    @_timed('run')
+    def run(self, name, image, command=None, entrypoint=None, ports=None, volumes=None,
+            environment=None, privileged=False, restart_policy=None, group_add=None, **extra):
+        container = self.client.containers.run(
+            image, command=command, name=name, detach=True, entrypoint=entrypoint,
+            ports=ports or {}, volumes=volumes or {}, environment=environment or {},
+            privileged=privileged, restart_policy=restart_policy, group_add=group_add, **extra
+        )
+        return container.id
+
+    @_timed('ensure_network')
+    def ensure_network(self, name, internal=True):
+        if not any(n.name == name for n in self.client.networks.list(names=[name])):
+            self.client.networks.create(name, driver="bridge", internal=internal)
+
+    @_timed('remove')
+    def remove(self, name, force=True):
+        import docker.errors
+        try:
+            self.api.remove_container(name, force=force)
+        except docker.errors.NotFound:
+            pass
+
+    @_timed('rename')
+    def rename(self, name, new_name):
+        self.api.rename(name, new_name)
+
+    @_timed('start')
+    def start(self, name):
+        self.api.start(name)
+
+    @_timed('stop')
+    def stop(self, name, timeout=10):
+        self.api.stop(name, timeout=timeout)
+
+    @_timed('pause')
+    def pause(self, name):
+        self.api.pause(name)
+
+    @_timed('unpause')
+    def unpause(self, name):
+        self.api.unpause(name)
+
+    @_timed('update')
+    def update(self, name, **resources):
+        self.api.update_container(name, **resources)
+
+    @_timed('exec')
+    def exec(self, name, cmd, user=None, timeout=None):
+        exec_id = self.api.exec_create(name, _with_timeout(cmd, timeout), user=user or '')['Id']
+        stdout, stderr = self.exec_api.exec_start(exec_id, demux=True)
+        exit_code = self.api.exec_inspect(exec_id).get('ExitCode')
+        return ExecResult(exit_code, (stdout or b'').decode('utf-8', errors='replace'),
+                          (stderr or b'').decode('utf-8', errors='replace'))
+
+    @_timed('exec_stream')
+    def exec_stream(self, name, cmd, user=None, timeout=None):
+        exec_id = self.api.exec_create(name, _with_timeout(cmd, timeout), user=user or '')['Id']
+        chunks = self.exec_api.exec_start(exec_id, stream=True)
+        return ExecStream(chunks, lambda: self.api.exec_inspect(exec_id).get('ExitCode'))
+
+    @_timed('put_archive')
+    def put_archive(self, name, path, data):
+        if not self.exec_api.put_archive(name, path, data):
+            raise ContainerRuntimeError(f"Copy into {name}:{path} failed")
+
+    @_timed('list')
+    def list_names(self, name_filter=None, running=True):
+        filters = {'name': name_filter} if name_filter else None
+        containers = self.api.containers(all=not running, filters=filters)
+        return [c['Names'][0].lstrip('/') for c in containers if c.get('Names')]
+
+    @_timed('list')
+    def list_states(self, name_filter=None):
+        filters = {'name': name_filter} if name_filter else None
+        containers = self.api.containers(all=True, filters=filters)
+        return {c['Names'][0].lstrip('/'): c.get('State', '') for c in containers if c.get('Names')}
+
+    def events(self, since=None, until=None):
+        # Request được gửi ngay khi gọi: sự kiện sau thời điểm này không bị lỡ
+        return self.api.events(since=since, until=until, filters={'type': 'container'}, decode=True)
+
+
+# ================== IN-MEMORY FAKE ==================
+# Tham số docker SDK -> khóa HostConfig trong kết quả inspect
+_HOST_CONFIG_KEYS = {
+    'cpu_period': 'CpuPeriod', 'cpu_quota': 'CpuQuota', 'cpu_shares': 'CpuShares',
+    'mem_limit': 'Memory', 'memswap_limit': 'MemorySwap', 'pids_limit': 'PidsLimit',
+}
+
+
+class InMemoryRuntime(ContainerRuntime):
+    """Fake runtime: containers are dicts, exec is answered by exec_handler(name, cmd)"""
+
+    def __init__(self, exec_handler=None):
+        self.containers = {}
+        self.exec_calls = []
+        self.archives = []
+        self.networks = {}       # name -> internal
+        self.exec_handler = exec_handler or (lambda name, cmd: ExecResult(0, '', ''))
+        self.pending_events = []
+
+    def emit(self, action, name, **attributes):
+        container = self.containers.get(name) or {}
+        self.pending_events.append({
+            'Type': 'container', 'Action': action, 'time': int(time.time()),
+            'Actor': {'ID': container.get('Id', ''), 'Attributes': {'name': name, **attributes}},
+        })
+
+    def _require(self, name):
+        if name not in self.containers or self.containers[name]['State']['Status'] != 'running':
+            raise ContainerRuntimeError(f"Container {name} is not running")
+
+    @_timed('inspect')
+    def inspect(self, name):
+        return self.containers.get(name)
+
+    def status(self, name):
+        data = self.inspect(name)
+        return data['State']['Status'] if data else ""
+
+    @_timed('run')
+    def run(self, name, image, command=None, entrypoint=None, ports=None, volumes=None,
+            environment=None, privileged=False, restart_policy=None, group_add=None, **extra):
+        if name in self.containers:
+            raise ContainerRuntimeError(f"Conflict: container name {name} already in use")
+        self.containers[name] = {
+            'Id': f"fake-{len(self.containers) + 1}",
+            'Name': f"/{name}",
+            'Image': image,
+            'State': {'Status': 'running'},
+            'Config': {'Env': [f"{k}={v}" for k, v in (environment or {}).items()], 'Cmd': command,
+                       'Labels': extra.get('labels') or {}},
+            'HostConfig': {'Devices': extra.get('devices') or [], 'Binds': volumes or {},
+                           'PortBindings': ports or {}, 'Privileged': privileged,
+                           **{_HOST_CONFIG_KEYS[k]: v for k, v in extra.items() if k in _HOST_CONFIG_KEYS}},
+            'NetworkSettings': {'Networks': {extra.get('network') or 'bridge': {'IPAddress': ''}}},
+        }
+        self.emit('create', name)
+        self.emit('start', name)
+        return self.containers[name]['Id']
+
+    @_timed('remove')
+    def remove(self, name, force=True):
+        if name in self.containers:
+            if self.containers[name]['State']['Status'] == 'running':
+                self.emit('die', name)
+            self.emit('destroy', name)
+            self.containers.pop(name)
+
+    @_timed('ensure_network')
+    def ensure_network(self, name, internal=True):
+        self.networks.setdefault(name, internal)
+
+    @_timed('rename')
+    def rename(self, name, new_name):
+        if name not in self.containers:
+            raise ContainerRuntimeError(f"No such container: {name}")
+        if new_name in self.containers:
+            raise ContainerRuntimeError(f"Conflict: container name {new_name} already in use")
+        container = self.containers[new_name] = self.containers.pop(name)
+        container['Name'] = f"/{new_name}"
+        self.emit('rename', new_name, oldName=f"/{name}")
+
+    def _set_status(self, name, status, action, **attributes):
+        if name not in self.containers:
+            raise ContainerRuntimeError(f"No such container: {name}")
+        self.containers[name]['State']['Status'] = status
+        self.emit(action, name, **attributes)
+
+    @_timed('start')
+    def start(self, name):
+        self._set_status(name, 'running', 'start')
+
+    @_timed('stop')
+    def stop(self, name, timeout=10):
+        self.containers.get(name, {}).get('State', {})['ExitCode'] = 143
+        self._set_status(name, 'exited', 'die', exitCode='143')
+
+    @_timed('pause')
+    def pause(self, name):
+        self._set_status(name, 'paused', 'pause')
+
+    @_timed('unpause')
+    def unpause(self, name):
+        self._set_status(name, 'running', 'unpause')
+
+    @_timed('update')
+    def update(self, name, **resources):
+        self._require(name)
+        host_config = self.containers[name]['HostConfig']
+        for key, value in resources.items():
+            host_config[_HOST_CONFIG_KEYS.get(key, key)] = value
+
+    @_timed('exec')
+    def exec(self, name, cmd, user=None, timeout=None):
+        self._require(name)
+        self.exec_calls.append((name, list(cmd)))
+        return self.exec_handler(name, list(cmd))
+
+    @_timed('exec_stream')
+    def exec_stream(self, name, cmd, user=None, timeout=None):
+        result = self.exec(name, cmd, user=user, timeout=timeout)
+        output = (result.stdout + result.stderr).encode('utf-8')
+        return ExecStream([output], lambda: result.exit_code)
+
+    @_timed('put_archive')
+    def put_archive(self, name, path, data):
+        self._require(name)
+        self.archives.append((name, path, data))
+
+    @_timed('list')
+    def list_names(self, name_filter=None, running=True):
+        # Như Docker: không có all=True vẫn liệt kê container đang pause
+        return [n for n, c in self.containers.items()
+                if (not name_filter or name_filter in n) and (not running or c['State']['Status'] in ('running', 'paused'))]
+
+    def list_states(self, name_filter=None):
+        return {n: c['State']['Status'] for n, c in self.containers.items() if not name_filter or name_filter in n}
+
+    def events(self, since=None, until=None):
+        # Không chặn: trả các sự kiện đang chờ rồi kết thúc
+        events, self.pending_events = self.pending_events, []
+        return iter(events)
+
+
+_runtime = None
+
+
+def get_runtime():
+    """Process-wide runtime selected by SYSTEM_CONFIG['CONTAINER_RUNTIME']"""
+    global _runtime
+    if _runtime is None:
+        _runtime = InMemoryRuntime() if SYSTEM_CONFIG['CONTAINER_RUNTIME'] == 'memory' else DockerEngineRuntime()
+    return _runtime
+
+
+def set_runtime(runtime):
+    """Swap the runtime (tests)"""
+    global _runtime
+    _runtime = runtime
@@ -0,0 +1,231 @@
+"""
+Shell scripts run inside user environment containers
+Split into a generic provisioning part (toolchain, cores, libraries, sshd config)
+and a per-user part (account, dotfiles, home ownership) so warm pool containers
+can provision ahead of time and only run the per-user part when claimed.
+
+Provisioning happens at image build time (docker/provision-manifest.json); at
+start the scripts only verify the manifest and record per-phase timings in
+STARTUP_PHASES_FILE ("<phase> <ms>" per line).
+"""
+
+from services.arduino_shared import SHARED_MOUNT, SHARED_DATA_DIR, SHARED_LIBRARIES_DIR, SHARED_MANIFEST
+
+USER_ENV_IMAGE = "my-dev-env:v2"
+
+# Thư mục gốc workspace của mọi user bên trong container warm pool (chỉ tồn tại trước khi claim)
+WARM_WORKSPACES_MOUNT = "/srv/workspaces"
+WARM_READY_MARKER = "/etc/epu/warm_ready"
+WARM_CLAIMED_MARKER = "/etc/epu/claimed_user"
+STARTUP_PHASES_FILE = "/run/epu/startup-phases"
+
+# phase <tên>: kết thúc phase đang chạy (ghi thời gian ms) và bắt đầu phase mới
+PHASE_FUNCTIONS = f"""
+PHASES_FILE="{STARTUP_PHASES_FILE}"
+mkdir -p "$(dirname "$PHASES_FILE")"
+phase() {{
+    local now=$(date +%s%3N)
+    if [ -n "$PHASE" ]; then echo "$PHASE $((now - PHASE_START))" >> "$PHASES_FILE"; fi
+    PHASE="$1"
+    PHASE_START=$now
+}}
+"""
+
+
+# Image cũ (chưa có epu-provision): cài qua mạng như trước
+LEGACY_PROVISION_SCRIPT = r"""
+legacy_provision() {
+(
+    if ! python3 -c "import serial" &>/dev/null; then
+        apt-get update -y &>/dev/null
+        apt-get install -y python3-serial python3-pip &>/dev/null
+        pip3 install pyserial esptool --break-system-packages &>/dev/null || pip3 install pyserial esptool &>/dev/null
+    fi
+) &
+
+# TỰ ĐỘNG CÀI ĐẶT CORE ARDUINO VÀ ESP32 NẾU CHƯA CÓ
+if command -v arduino-cli &> /dev/null; then
+    if ! arduino-cli core list | grep -q "arduino:avr"; then
+        echo "Installing arduino:avr core..."
+        arduino-cli core update-index &>/dev/null
+        arduino-cli core install arduino:avr &>/dev/null
+    fi
+    if ! arduino-cli core list | grep -q "esp32:esp32.*2.0.17"; then
+        echo "Installing/Downgrading esp32:esp32 core to v2.0.17..."
+        arduino-cli config init &>/dev/null || true
+        arduino-cli config add board_manager.additional_urls https://dl.espressif.com/dl/package_esp32_index.json &>/dev/null || true
+        arduino-cli core update-index &>/dev/null
+        arduino-cli core uninstall esp32:esp32 &>/dev/null || true
+        arduino-cli core install esp32:esp32@2.0.17 &>/dev/null
+    fi
+
+    # CÀI CÁC THƯ VIỆN NHÚNG THEO CONFIG CHUNG
+    arduino-cli lib install "Adafruit NeoPixel" "DHT sensor library" "Adafruit Unified Sensor" "PubSubClient" "ArduinoJson" &>/dev/null || true
+fi
+
+if ! grep -q "^ClientAliveInterval 30" /etc/ssh/sshd_config; then
+    echo "ClientAliveInterval 30" >> /etc/ssh/sshd_config
+    echo "ClientAliveCountMax 100" >> /etc/ssh/sshd_config
+    echo "TCPKeepAlive yes" >> /etc/ssh/sshd_config
+fi
+}
+"""
+
+# Volume dùng chung (read-only): chỉ kiểm tra, không cài; phiên SSH nhận đường dẫn qua /etc/environment.
+# Chưa có volume dùng chung: so manifest với đĩa, cài bù (có khóa) khi volume core cũ còn thiếu.
+PROVISION_SCRIPT = LEGACY_PROVISION_SCRIPT + f"""
+SHARED="{SHARED_MOUNT}"
+if [ -f "$SHARED/{SHARED_MANIFEST}" ]; then
+    if ! grep -q "^ARDUINO_DIRECTORIES_DATA=" /etc/environment; then
+        echo "ARDUINO_DIRECTORIES_DATA={SHARED_DATA_DIR}" >> /etc/environment
+        echo "ARDUINO_DIRECTORIES_BUILTIN_LIBRARIES={SHARED_LIBRARIES_DIR}" >> /etc/environment
+    fi
+    if command -v epu-provision &>/dev/null && ! ARDUINO_DATA_DIR="{SHARED_DATA_DIR}" ARDUINO_USER_DIR="$SHARED" \\
+            EPU_PROVISION_MANIFEST="$SHARED/{SHARED_MANIFEST}" epu-provision check; then
+        echo "WARNING: shared Arduino volume does not match its manifest" >&2
+    fi
+elif command -v epu-provision &>/dev/null; then
+    if ! epu-provision check >/dev/null; then
+        echo "Provision manifest not satisfied, installing missing items..."
+        flock /root/.arduino15/.epu-provision.lock epu-provision install
+    fi
+else
+    legacy_provision
+fi
+mkdir -p /run/sshd
+"""
+
+# Dùng biến $USER đã gán trước đó
+USER_SETUP_SCRIPT = r"""
+if ! id "$USER" &>/dev/null; then
+    useradd -m -s /bin/bash "$USER"
+    echo "$USER:password123" | chpasswd
+    usermod -aG dialout "$USER" || true
+    usermod -aG sudo "$USER" || true
+fi
+
+cat > /home/"$USER"/.bashrc << 'EOF_BASHRC'
+case $- in *i*) ;; *) return;; esac
+export PATH="/usr/local/bin:$PATH"
+alias ll='ls -alF'
+alias cls='clear'
+# Volume core dùng chung là read-only: arduino-cli tải gói vào thư mục của user
+export ARDUINO_DIRECTORIES_DOWNLOADS="$HOME/.cache/arduino/staging"
+if [ -f ~/WELCOME.txt ]; then cat ~/WELCOME.txt; fi
+EOF_BASHRC
+
+cat > /home/"$USER"/WELCOME.txt << EOF
+================================================================
+HE THONG THUC HANH IOT - EPU TECH
+================================================================
+[+] USER: $USER
+[+] TRANG THAI: SAN SANG (Connected)
+[+] PHAN CUNG HO TRO: ESP32 , ESP8266, ARDUINO
+[+] TAT CA CAC THU VIEN CO BAN CAN THIET (LCD, DHT, MQTT...)
+[+] HE THONG PHAT TRIEN BOI: EPU TECH TEAM
+[+] HE THONG TRONG GIAI DOAN PHAT TRIEN
+EOF
+
+# Thư viện/core dùng chung nằm ở volume read-only; ~/Arduino/libraries chỉ chứa thư viện user tự cài
+mkdir -p /home/"$USER"/Arduino/libraries
+if [ ! -f /opt/arduino-shared/manifest.json ]; then
+    ln -sfn /root/.arduino15 /home/"$USER"/.arduino15 2>/dev/null || true
+fi
+
+chown -R "$USER:$USER" /home/"$USER"
+"""
+
+
+# sshd -D chiếm tiến trình chính nên không ghi được phase sau nó: tiến trình nền chờ cổng 22
+# nhận kết nối rồi kết thúc phase sshd (tối đa ~60s)
+SSHD_READY_WATCH = r"""
+(
+    for _ in $(seq 1 1200); do
+        if (exec 3<>/dev/tcp/127.0.0.1/22) 2>/dev/null; then phase done; break; fi
+        sleep 0.05
+    done
+) &
+"""
+
+
+def startup_script(safe_username):
+    """Cold start: verify provisioning, set up the user, run sshd in the foreground"""
+    return (
+        "#!/bin/bash\n"
+        f'USER="{safe_username}"\n'
+        + PHASE_FUNCTIONS
+        + ': > "$PHASES_FILE"\nphase provision\n'
+        + PROVISION_SCRIPT
+        + "phase user_setup\n"
+        + USER_SETUP_SCRIPT
+        + "\nphase sshd\n"
+        + SSHD_READY_WATCH
+        + 'echo "Starting SSH Daemon..."\nexec /usr/sbin/sshd -D\n'
+    )
+
+
+def warm_script():
+    """Warm pool container command.
+
+    No arguments: provision, mark the container ready and wait. A container that
+    was already claimed (restart after a host reboot or an idle stop) re-binds
+    its user and drops the workspace root before anything else runs.
+    "claim <user>" (run via exec): bind the user's workspace onto /home/<user>,
+    drop the view of the other workspaces, set the user up and start sshd. The
+    claim fails (and sshd is not started) if the workspace root cannot be
+    unmounted.
+    """
+    return (
+        f'ROOT="{WARM_WORKSPACES_MOUNT}"\n'
+        f'READY="{WARM_READY_MARKER}"\n'
+        f'CLAIMED="{WARM_CLAIMED_MARKER}"\n'
+        + PHASE_FUNCTIONS
+        + r"""
+bind_workspace() {
+USER="$1"
+[ -n "$USER" ] || return 1
+if ! mountpoint -q /home/"$USER"; then
+    [ -d "$ROOT/$USER" ] || { echo "workspace $ROOT/$USER not found" >&2; return 1; }
+    mkdir -p /home/"$USER"
+    mount --bind "$ROOT/$USER" /home/"$USER" || return 1
+fi
+# Fail closed: còn thấy workspace của user khác thì không giao container cho user này
+if mountpoint -q "$ROOT"; then
+    umount -l "$ROOT" || { echo "cannot unmount $ROOT" >&2; return 1; }
+fi
+}
+
+claim() {
+phase bind
+bind_workspace "$1" || return 1
+phase user_setup
+""" + USER_SETUP_SCRIPT + r"""
+phase sshd
+mkdir -p /etc/epu /run/sshd
+echo "$USER" > "$CLAIMED"
+rm -f "$READY"
+pgrep -x sshd >/dev/null || /usr/sbin/sshd
+phase done
+}
+
+if [ "$1" = "claim" ]; then
+    claim "$2"
+    exit $?
+fi
+mkdir -p /etc/epu
+# Restart (reboot host, dậy từ idle stop): Docker gắn lại toàn bộ thư mục gốc workspace, gỡ ngay trước mọi bước khác
+if [ -f "$CLAIMED" ]; then
+    bind_workspace "$(cat "$CLAIMED")" || exit 1
+fi
+: > "$PHASES_FILE"
+phase provision
+""" + PROVISION_SCRIPT + r"""
+phase done
+if [ -f "$CLAIMED" ]; then
+    claim "$(cat "$CLAIMED")" || exit 1
+else
+    touch "$READY"
+fi
+exec sleep infinity
+"""
+    )
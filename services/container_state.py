@@ -0,0 +1,194 @@
+"""
+Container state registry
+Answers "is this container running?" from memory. A background thread follows
+the Docker events stream (create/start/die/destroy/rename/health) and reconciles
+against a container listing whenever the stream (re)connects and at the end of
+every events window. Until the first reconciliation succeeds, and whenever the
+stream is down, lookups return None so callers fall back to `docker inspect`.
+"""
+import time
+import logging
+import threading
+from prometheus_client import Counter
+from config import SYSTEM_CONFIG
+from services import container_readiness
+from services.container_runtime import get_runtime
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_STATE_LOOKUPS = Counter('container_state_lookups_total', 'Container state lookups', ['result'])
+CONTAINER_EVENTS = Counter('container_events_total', 'Docker container events applied to the state registry', ['action'])
+
+# Action của Docker event -> State.Status tương ứng
+_ACTION_STATUS = {
+    'create': 'created',
+    'start': 'running',
+    'restart': 'running',
+    'unpause': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+    'stop': 'exited',
+    'kill': None,  # die theo sau nếu tiến trình thực sự dừng
+}
+
+
+class ContainerEntry:
+    __slots__ = ('status', 'health', 'ssh_port', 'verified')
+
+    def __init__(self, status):
+        self.status = status
+        self.health = ''
+        self.ssh_port = None     # cổng SSH đã xác nhận của container đang chạy
+        self.verified = False    # đã qua kiểm tra đầy đủ (thiết bị, sshd) kể từ lần start gần nhất
+
+
+class ContainerStateRegistry:
+    """In-process view of container states fed by the Docker events stream"""
+
+    def __init__(self, window, name_suffixes=('-dev',)):
+        self.window = window
+        self.name_suffixes = name_suffixes
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._synced = False
+        self._thread = None
+
+    def _tracked(self, name):
+        return bool(name) and name.endswith(self.name_suffixes)
+
+    # ---------- Background follower ----------
+    def start(self):
+        """Start following the events stream (idempotent)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="container-events", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        backoff = 1
+        since = int(time.time())
+        while True:
+            until = since + self.window
+            try:
+                stream = get_runtime().events(since=since, until=until)
+                self.reconcile()
+                for event in stream:
+                    self.apply(event)
+                backoff = 1
+                since = until
+                # InMemoryRuntime / stream kết thúc sớm: chờ tới hết cửa sổ
+                time.sleep(max(0, until - time.time()))
+            except Exception as e:
+                with self._lock:
+                    self._synced = False
+                logger.warning(f"Docker events stream lost ({e}), reconnecting in {backoff}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                since = int(time.time())
+
+    def reconcile(self):
+        """Rebuild the view from a full listing (fallback for missed events)"""
+        # State.Status thật: danh sách "running" của Docker gồm cả container đang pause
+        states = get_runtime().list_states()
+        with self._lock:
+            for name in list(self._entries):
+                if name not in states:
+                    del self._entries[name]
+            for name, status in states.items():
+                if not self._tracked(name):
+                    continue
+                entry = self._entries.get(name)
+                if entry is None:
+                    self._entries[name] = ContainerEntry(status)
+                elif entry.status != status:
+                    entry.status = status
+                    entry.verified = False
+            self._synced = True
+
+    def apply(self, event):
+        """Apply one decoded Docker event"""
+        if event.get('Type', 'container') != 'container':
+            return
+        action = event.get('Action') or event.get('status') or ''
+        attributes = (event.get('Actor') or {}).get('Attributes') or {}
+        name = attributes.get('name', '')
+        base_action = action.split(':', 1)[0]
+        CONTAINER_EVENTS.labels(action=base_action).inc()
+
+        if base_action == 'rename':
+            old = attributes.get('oldName', '').lstrip('/')
+            with self._lock:
+                entry = self._entries.pop(old, None)
+                if self._tracked(name):
+                    self._entries[name] = entry or ContainerEntry('running')
+            return
+        if not self._tracked(name):
+            return
+
+        if base_action == 'destroy':
+            with self._lock:
+                self._entries.pop(name, None)
+            container_readiness.forget(name)
+            return
+        if base_action == 'health_status':
+            with self._lock:
+                entry = self._entries.setdefault(name, ContainerEntry('running'))
+                entry.health = action.split(':', 1)[1].strip()
+            return
+        status = _ACTION_STATUS.get(base_action)
+        if status is None:
+            return
+        with self._lock:
+            entry = self._entries.setdefault(name, ContainerEntry(status))
+            entry.status = status
+            if status != 'running':
+                entry.verified = False
+        # Sự kiện đến trễ so với code đồng bộ (xóa rồi tạo lại cùng tên): chỉ hạ READY, không đánh dấu chết
+        if base_action == 'start':
+            container_readiness.mark_starting(name, keep_ready=True)
+        elif base_action == 'die':
+            container_readiness.mark_unready(name)
+            if name.endswith('-dev'):
+                # Import muộn: ssh_manager -> readiness -> docker_manager -> container_state
+                from services.ssh_manager import invalidate_ssh_session
+                invalidate_ssh_session(name[:-len('-dev')])
+
+    # ---------- Lookups ----------
+    def status(self, name):
+        """State.Status from memory ('' if missing), or None when not synced"""
+        if not self._synced or not self._tracked(name):
+            CONTAINER_STATE_LOOKUPS.labels(result='fallback').inc()
+            return None
+        CONTAINER_STATE_LOOKUPS.labels(result='hit').inc()
+        entry = self._entries.get(name)
+        return entry.status if entry else ''
+
+    def ready_port(self, name):
+        """SSH port of a running, verified container whose sshd is known ready, else None"""
+        if not self._synced:
+            return None
+        entry = self._entries.get(name)
+        if not entry or entry.status != 'running' or not entry.verified or not entry.ssh_port:
+            return None
+        if container_readiness.get_state(name) != container_readiness.STATE_READY:
+            return None
+        return entry.ssh_port
+
+    def mark_verified(self, name, ssh_port):
+        """Slow path checked the container: later page loads may skip inspect/DB/exec"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry and entry.status == 'running':
+                entry.ssh_port = ssh_port
+                entry.verified = True
+
+    @property
+    def synced(self):
+        return self._synced
+
+    def __len__(self):
+        return len(self._entries)
+
+
+container_state = ContainerStateRegistry(window=SYSTEM_CONFIG['CONTAINER_EVENTS_WINDOW'])
@@ -0,0 +1,168 @@
+"""
+Per-container resource quotas and compile CPU bursts
+User containers are created with a CFS quota of CONTAINER_CPU_LIMIT CPUs, a
+memory limit without swap and a pids limit, so a `while true` loop or a fork
+bomb only slows its own container. While a compile runs, the container's quota
+is raised to COMPILE_CPU_BURST CPUs, paid from a per-container credit bucket
+(COMPILE_BURST_CREDIT seconds, refilled over COMPILE_BURST_REFILL_SECONDS) and
+limited to COMPILE_BURST_SLOTS concurrent bursts per host. Idle shells never
+get more than the base quota.
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge
+from config import SYSTEM_CONFIG
+from services.container_runtime import get_runtime
+
+logger = logging.getLogger(__name__)
+
+COMPILE_CPU_BURSTS = Counter('compile_cpu_bursts_total', 'Compile CPU burst requests', ['result'])
+COMPILE_CPU_BURSTS_ACTIVE = Gauge('compile_cpu_bursts_active', 'Containers currently running with burst CPU quota')
+
+CPU_PERIOD = 100000  # µs, chu kỳ CFS mặc định
+
+
+def _quota(cpus):
+    return int(cpus * CPU_PERIOD)
+
+
+class _Bucket:
+    __slots__ = ('credit', 'updated', 'active', 'started', 'timer', 'expired')
+
+    def __init__(self, credit, now):
+        self.credit = credit
+        self.updated = now
+        self.active = 0        # số lần compile đang chạy trong container
+        self.started = None
+        self.timer = None
+        self.expired = False   # hết credit giữa chừng: đã hạ về quota cơ bản
+
+
+class CompileCpuScheduler:
+    """Base cgroup limits for user containers plus credit-based CPU bursts during compiles"""
+
+    def __init__(self, base_cpus, memory_limit, pids_limit, burst_cpus, slots, credit, refill_seconds):
+        self.base_cpus = base_cpus
+        self.memory_limit = memory_limit
+        self.pids_limit = pids_limit
+        self.burst_cpus = burst_cpus
+        self.slots = slots or max(1, int((os.cpu_count() or 1) // max(burst_cpus, 1)))
+        self.credit = credit
+        self.refill_rate = credit / refill_seconds if refill_seconds > 0 else credit
+        self._buckets = {}
+        self._bursting = 0
+        self._lock = threading.Lock()
+
+    @property
+    def bursts_enabled(self):
+        return self.base_cpus > 0 and self.burst_cpus > self.base_cpus and self.credit > 0
+
+    def container_limits(self):
+        """Keyword arguments for runtime.run() of a user container"""
+        limits = {}
+        if self.base_cpus > 0:
+            limits.update(cpu_period=CPU_PERIOD, cpu_quota=_quota(self.base_cpus))
+        if self.memory_limit:
+            limits.update(mem_limit=self.memory_limit, memswap_limit=self.memory_limit)
+        if self.pids_limit > 0:
+            limits['pids_limit'] = self.pids_limit
+        return limits
+
+    def _refill(self, bucket, now):
+        bucket.credit = min(self.credit, bucket.credit + (now - bucket.updated) * self.refill_rate)
+        bucket.updated = now
+
+    def _set_quota(self, cname, cpus):
+        try:
+            get_runtime().update(cname, cpu_period=CPU_PERIOD, cpu_quota=_quota(cpus))
+            return True
+        except Exception as e:
+            logger.warning(f"CPU quota update of {cname} to {cpus} CPUs failed: {e}")
+            return False
+
+    def _expire(self, cname, bucket):
+        """Credit ran out before the compile finished"""
+        with self._lock:
+            if bucket.active == 0 or bucket.expired:
+                return
+            bucket.expired = True
+            self._bursting -= 1
+            COMPILE_CPU_BURSTS_ACTIVE.set(self._bursting)
+        COMPILE_CPU_BURSTS.labels(result='expired').inc()
+        self._set_quota(cname, self.base_cpus)
+
+    def _grant(self, cname, now):
+        """Take a burst for cname. Returns (bucket, result); bucket is None when not bursting."""
+        bucket = self._buckets.get(cname)
+        if bucket is None:
+            bucket = self._buckets[cname] = _Bucket(self.credit, now)
+        if bucket.active:
+            bucket.active += 1       # compile song song trong cùng container: dùng chung burst
+            return bucket, 'shared'
+        self._refill(bucket, now)
+        if bucket.credit < 1:
+            return None, 'no_credit'
+        if self._bursting >= self.slots:
+            return None, 'no_slot'
+        bucket.active = 1
+        bucket.started = now
+        bucket.expired = False
+        self._bursting += 1
+        return bucket, 'granted'
+
+    @contextmanager
+    def compile_burst(self, cname):
+        """Raise cname's CPU quota while the block runs. Yields True if the burst was granted."""
+        if not self.bursts_enabled:
+            yield False
+            return
+        with self._lock:
+            bucket, result = self._grant(cname, time.monotonic())
+            COMPILE_CPU_BURSTS_ACTIVE.set(self._bursting)
+        COMPILE_CPU_BURSTS.labels(result=result).inc()
+        if bucket is None:
+            yield False
+            return
+        if result == 'granted':
+            if self._set_quota(cname, self.burst_cpus):
+                bucket.timer = threading.Timer(bucket.credit, self._expire, args=(cname, bucket))
+                bucket.timer.daemon = True
+                bucket.timer.start()
+            else:
+                COMPILE_CPU_BURSTS.labels(result='error').inc()
+        try:
+            yield True
+        finally:
+            self._release(cname, bucket)
+
+    def _release(self, cname, bucket):
+        with self._lock:
+            bucket.active -= 1
+            if bucket.active:
+                return
+            now = time.monotonic()
+            bucket.credit = max(0.0, bucket.credit - (now - bucket.started))
+            bucket.updated = now
+            if bucket.timer:
+                bucket.timer.cancel()
+                bucket.timer = None
+            restore = not bucket.expired
+            if restore:
+                self._bursting -= 1
+            COMPILE_CPU_BURSTS_ACTIVE.set(self._bursting)
+        if restore:
+            self._set_quota(cname, self.base_cpus)
+
+
+cpu_scheduler = CompileCpuScheduler(
+    base_cpus=SYSTEM_CONFIG['CONTAINER_CPU_LIMIT'],
+    memory_limit=SYSTEM_CONFIG['CONTAINER_MEMORY_LIMIT'],
+    pids_limit=SYSTEM_CONFIG['CONTAINER_PIDS_LIMIT'],
+    burst_cpus=SYSTEM_CONFIG['COMPILE_CPU_BURST'],
+    slots=SYSTEM_CONFIG['COMPILE_BURST_SLOTS'],
+    credit=SYSTEM_CONFIG['COMPILE_BURST_CREDIT'],
+    refill_seconds=SYSTEM_CONFIG['COMPILE_BURST_REFILL_SECONDS'],
+)
@@ -0,0 +1,144 @@
+"""
+Incremental compiler diagnostics parser
+Consumes arduino-cli / GCC output one line at a time, as it streams out of the
+container, and turns it into structured diagnostics: errors, warnings and the
+notes attached to them, each with the source context lines GCC prints under
+it, the enclosing function and the "In file included from" chain. A finished
+diagnostic is handed to on_diagnostic immediately, so the IDE can show it
+while the build is still running. One precompiled regex per line kind, no
+copy of the whole log.
+"""
+import os
+import re
+
+# file:line[:col]: (fatal error|error|warning|note): message
+DIAGNOSTIC_RE = re.compile(r'^(?P<path>[^\s:][^:]*?):(?P<line>\d+):(?:(?P<column>\d+):)?\s*'
+                           r'(?P<kind>fatal error|error|warning|note):\s*(?P<message>.*)$')
+INCLUDED_FROM_RE = re.compile(r'^In file included from (?P<loc>.+?)[,:]$')
+INCLUDED_MORE_RE = re.compile(r'^\s+from (?P<loc>.+?)[,:]$')
+SCOPE_RE = re.compile(r'^(?P<path>[^\s:][^:]*?): (?P<scope>(?:In|At) [^:]*?(?:\'.*\')?):$')
+# Dòng mã nguồn + dấu ^ GCC in dưới mỗi chẩn đoán ("  12 |   foo();", "     |   ^~~" hoặc dòng thụt lề)
+CONTEXT_RE = re.compile(r'^(?:\s+\S|\s*\d*\s*\|)')
+CONTEXT_PREFIXES = frozenset(' \t|0123456789')
+
+MAX_CONTEXT_LINES = 8
+
+
+class DiagnosticsParser:
+    """Single-pass parser; feed() lines as they arrive, finish() for the summary"""
+
+    def __init__(self, on_diagnostic=None):
+        self.on_diagnostic = on_diagnostic
+        self.errors = []
+        self.warnings = []
+        self.lines = 0
+        self._pending = None       # chẩn đoán đang nhận dòng context
+        self._parent = None        # error/warning gần nhất, note gắn vào đây
+        self._includes = []
+        self._include_path = None  # file mà chuỗi include dẫn tới
+        self._collecting_includes = False
+        self._scope = None         # (file, "In function '...'")
+
+    def feed(self, line):
+        self.lines += 1
+        line = line.rstrip('\r\n')
+        indented = line[:1] in CONTEXT_PREFIXES
+        if ':' not in line:
+            # Phần lớn log là lệnh g++ dài / tiến độ, không có dấu ':' -> bỏ qua mọi regex
+            if self._pending is not None:
+                if indented and CONTEXT_RE.match(line):
+                    if len(self._pending['context']) < MAX_CONTEXT_LINES:
+                        self._pending['context'].append(line)
+                    return
+                self._flush()
+            if self._includes or self._scope is not None:
+                self._includes = []
+                self._collecting_includes = False
+                self._scope = None
+            return
+        # Kiểm tra chuỗi con trước khi chạy regex
+        if 'error:' in line or 'warning:' in line or 'note:' in line:
+            match = DIAGNOSTIC_RE.match(line)
+            if match:
+                self._flush()
+                self._start(match, line)
+                return
+        if self._pending is not None and indented and CONTEXT_RE.match(line) and not INCLUDED_MORE_RE.match(line):
+            if len(self._pending['context']) < MAX_CONTEXT_LINES:
+                self._pending['context'].append(line)
+            return
+        self._flush()
+        if line.startswith('In file included from '):
+            match = INCLUDED_FROM_RE.match(line)
+            if match:
+                self._includes = [match.group('loc')]
+                self._include_path = None
+                self._collecting_includes = True
+                return
+        if self._collecting_includes and indented:
+            match = INCLUDED_MORE_RE.match(line)
+            if match:
+                self._includes.append(match.group('loc'))
+                return
+        match = SCOPE_RE.match(line) if line.endswith(':') else None
+        if match:
+            self._bind_includes(match.group('path'))
+            self._scope = (match.group('path'), match.group('scope'))
+            return
+        # Dòng khác (lệnh build, tiến độ...) kết thúc chuỗi include/scope
+        self._includes = []
+        self._collecting_includes = False
+        self._scope = None
+
+    def _bind_includes(self, path):
+        """An include chain belongs to the first file reported after it"""
+        if self._collecting_includes:
+            self._include_path = path
+            self._collecting_includes = False
+
+    def feed_text(self, text):
+        for line in text.splitlines():
+            self.feed(line)
+        return self
+
+    def _start(self, match, line):
+        kind = match.group('kind')
+        column = match.group('column')
+        diagnostic = {
+            'kind': 'error' if kind == 'fatal error' else kind,
+            'file': os.path.basename(match.group('path')),
+            'path': match.group('path'),
+            'line': int(match.group('line')),
+            'column': int(column) if column else None,
+            'message': match.group('message'),
+            'raw': line,
+            'context': [],
+        }
+        self._bind_includes(diagnostic['path'])
+        if self._scope and self._scope[0] == diagnostic['path']:
+            diagnostic['scope'] = self._scope[1]
+        if self._includes and self._include_path == diagnostic['path']:
+            diagnostic['included_from'] = list(self._includes)
+        if diagnostic['kind'] == 'note':
+            if self._parent is not None:
+                self._parent.setdefault('notes', []).append(diagnostic)
+            self._pending = diagnostic
+            return
+        diagnostic['notes'] = []
+        (self.errors if diagnostic['kind'] == 'error' else self.warnings).append(diagnostic)
+        self._parent = self._pending = diagnostic
+
+    def _flush(self):
+        """The pending diagnostic has all its context lines: publish it"""
+        diagnostic, self._pending = self._pending, None
+        if diagnostic is not None and self.on_diagnostic:
+            self.on_diagnostic(diagnostic)      # note đi ngay sau error/warning cha của nó
+
+    def finish(self):
+        self._flush()
+        return self.summary()
+
+    def summary(self):
+        """Same shape as the former analyze_compile_errors() result"""
+        return {'errors': self.errors, 'warnings': self.warnings,
+                'error_count': len(self.errors), 'warning_count': len(self.warnings)}
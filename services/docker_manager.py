@@ -1,19 +1,35 @@
 """
 Docker Container Management Service
-UPDATED: Strict Device Mounting via Subprocess (No /dev:/dev) + Fix Full Arduino Libs
+UPDATED: Strict Device Mounting (No /dev:/dev) + Fix Full Arduino Libs
+All engine calls go through services.container_runtime (Docker Engine API).
 """
 import os
-import subprocess
 import time
 import logging
-import json
-import glob
-from utils import make_safe_name, find_free_port
+from prometheus_client import Histogram
+from utils import make_safe_name
 from config import get_db_connection, DEFAULT_ARDUINO_LIBRARIES
 from services.logger import log_action
+from services.ssh_manager import invalidate_ssh_session
+from services import container_readiness
+from services.workspace_storage import get_host_user_dir
+from services.container_runtime import get_runtime
+from services.container_setup import USER_ENV_IMAGE, STARTUP_PHASES_FILE, startup_script
+from services import arduino_shared, build_cache
+from services.warm_pool import warm_pool, POOL_LABEL
+from services.container_state import container_state
+from services import idle_reaper
+from services.port_allocator import port_allocator
+from services.cpu_scheduler import cpu_scheduler
 
 logger = logging.getLogger(__name__)
 
+CONTAINER_STARTUP_PHASE_SECONDS = Histogram('container_startup_phase_seconds', 'Duration of user container startup phases',
+                                            ['phase'], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300))
+
+# (container id, StartedAt) đã ghi vào metric, tránh đếm trùng khi xem báo cáo nhiều lần
+_reported_starts = set()
+
 # Platform cache for Arduino CLI
 platform_cache = {}
 
@@ -24,13 +40,12 @@ def get_assigned_ports(username):
     return []
 
 def docker_status(cname):
-    """Check Docker container status"""
+    """Check Docker container status (from the events-fed registry, inspect as fallback)"""
+    cached = container_state.status(cname)
+    if cached is not None:
+        return cached
     try:
-        r = subprocess.run(
-            ["docker", "inspect", "-f", "{{.State.Status}}", cname], 
-            capture_output=True, text=True, check=False, timeout=5
-        )
-        return r.stdout.strip() if r.returncode == 0 else ""
+        return get_runtime().status(cname)
     except Exception:
         return ""
 
@@ -39,17 +54,10 @@ def get_container_devices(cname):
     Lấy danh sách các thiết bị hiện đang được mount vào container
     """
     try:
-        r = subprocess.run(
-            ["docker", "inspect", cname],
-            capture_output=True, text=True, check=False, timeout=5
-        )
-        if r.returncode == 0:
-            data = json.loads(r.stdout)
-            if data and len(data) > 0:
-                host_config = data[0].get('HostConfig', {})
-                devices = host_config.get('Devices', [])
-                if devices:
-                    return set(d['PathOnHost'] for d in devices)
+        data = get_runtime().inspect(cname)
+        if data:
+            devices = data.get('HostConfig', {}).get('Devices') or []
+            return set(d['PathOnHost'] for d in devices)
         return set()
     except Exception:
         return set()
@@ -58,7 +66,12 @@ def ensure_user_container(username):
     """Ensure user container exists, is running, AND HAS CORRECT DEVICES"""
     safe_username = make_safe_name(username)
     cname = f"{safe_username}-dev"
-    image = "my-dev-env:v2"
+    idle_reaper.touch(username)
+
+    # 0. Đường nhanh: container đang chạy, đã kiểm tra kể từ lần start gần nhất và sshd sẵn sàng
+    ssh_port = container_state.ready_port(cname)
+    if ssh_port:
+        return ssh_port
     
     # 1. Lấy danh sách thiết bị cần thiết từ Database
     required_ports = get_assigned_ports(username)
@@ -67,6 +80,10 @@ def ensure_user_container(username):
     # 2. Kiểm tra container hiện tại
     status = docker_status(cname)
     needs_recreate = False
+
+    # Container đang ngủ (idle reaper dừng/pause): đánh thức thay vì tạo lại
+    if status in ('paused', 'exited') and idle_reaper.ensure_awake(cname, status):
+        status = 'running'
     
     if status == 'running':
         # Kiểm tra xem container đang chạy có đúng thiết bị không
@@ -82,7 +99,12 @@ def ensure_user_container(username):
         
     # Xóa container cũ nếu cần update thiết bị
     if needs_recreate:
-        subprocess.run(["docker", "rm", "-f", cname], check=False)
+        invalidate_ssh_session(username)
+        container_readiness.forget(cname)
+        try:
+            get_runtime().remove(cname, force=True)
+        except Exception as e:
+            logger.error(f"Remove container {cname} failed: {e}")
         status = "" # Đánh dấu là đã xóa
 
     # Nếu container đang chạy và đúng device -> Chỉ cần start SSH
@@ -97,147 +119,108 @@ def ensure_user_container(username):
         db.close()
         
         if ssh_port:
-            subprocess.run(["docker", "exec", cname, "service", "ssh", "start"], check=False)
+            try:
+                get_runtime().exec(cname, ["service", "ssh", "start"])
+            except Exception as e:
+                logger.warning(f"service ssh start in {cname} failed: {e}")
+            container_readiness.mark_starting(cname, keep_ready=True)
+            container_state.mark_verified(cname, ssh_port)
             return ssh_port
 
+        # Không còn lease cổng SSH (cổng trùng với user khác): tạo lại với cổng mới
+        logger.warning(f"Container {cname} has no SSH port lease. Recreating...")
+        invalidate_ssh_session(username)
+        container_readiness.forget(cname)
+        try:
+            get_runtime().remove(cname, force=True)
+        except Exception as e:
+            logger.error(f"Remove container {cname} failed: {e}")
+
     # --- TẠO MỚI CONTAINER ---
-    
+
+    # Prepare host directory
+    host_user_dir = get_host_user_dir(safe_username)
+    os.makedirs(host_user_dir, exist_ok=True)
+    os.chmod(host_user_dir, 0o777)
+
+    # Ưu tiên lấy container dựng sẵn từ warm pool (không phải chờ docker run + cài đặt)
+    warm = warm_pool.claim(safe_username, cname)
+    if warm and not port_allocator.assign(username, warm.ssh_port, from_holder=warm.name):
+        # Cổng của container warm đã bị cấp cho người khác: bỏ container, khởi động nguội
+        container_readiness.forget(cname)
+        try:
+            get_runtime().remove(cname, force=True)
+        except Exception as e:
+            logger.error(f"Remove container {cname} failed: {e}")
+        warm = None
+    if warm:
+        db = get_db_connection()
+        cur = db.cursor()
+        cur.execute("UPDATE users SET ssh_port=%s WHERE username=%s", (warm.ssh_port, username))
+        db.commit()
+        cur.close()
+        db.close()
+        return warm.ssh_port
+
     # Get or create SSH port
     db = get_db_connection()
     cur = db.cursor(dictionary=True)
     cur.execute("SELECT ssh_port FROM users WHERE username=%s", (username,))
     user_data = cur.fetchone()
-    ssh_port = user_data.get("ssh_port") if user_data else None
+    current_port = user_data.get("ssh_port") if user_data else None
     
-    if not ssh_port:
-        ssh_port = find_free_port()
+    # Lease cổng trong DB (giữ cổng cũ nếu user vẫn đang giữ hoặc cổng còn trống)
+    ssh_port = port_allocator.claim(username, preferred=current_port)
+    if ssh_port is None:
+        # Hết cổng trong dải: không docker run (Docker sẽ publish cổng ngẫu nhiên ngoài allocator)
+        logger.error(f"No free SSH port in {port_allocator.start}-{port_allocator.end} for {username}; not starting {cname}")
+        cur.close()
+        db.close()
+        return None
+    if ssh_port != current_port:
         cur.execute("UPDATE users SET ssh_port=%s WHERE username=%s", (ssh_port, username))
         db.commit()
     cur.close()
     db.close()
 
-    # Prepare host directory
-    host_user_dir = f"/home/toan/QUAN_LY_USER/{safe_username}"
-    os.makedirs(host_user_dir, exist_ok=True)
-    os.chmod(host_user_dir, 0o777)
-
     # Create setup script
     setup_script_path = os.path.join(host_user_dir, "setup_container.sh")
     if os.path.exists(setup_script_path) and os.path.isdir(setup_script_path):
         import shutil
         shutil.rmtree(setup_script_path)
     
-    # Script nội dung (ĐÃ FIX PHẦN THƯ VIỆN & CORE CHO ESP32)
-    script_content = f"""#!/bin/bash
-USER="{safe_username}"
-(
-    if ! python3 -c "import serial" &>/dev/null; then
-        apt-get update -y &>/dev/null
-        apt-get install -y python3-serial python3-pip &>/dev/null
-        pip3 install pyserial esptool --break-system-packages &>/dev/null || pip3 install pyserial esptool &>/dev/null
-    fi
-) &
-
-if ! id "$USER" &>/dev/null; then
-    useradd -m -s /bin/bash "$USER"
-    echo "$USER:password123" | chpasswd
-    usermod -aG dialout "$USER" || true
-    usermod -aG sudo "$USER" || true
-fi
-
-cat > /home/"$USER"/.bashrc << 'EOF_BASHRC'
-case $- in *i*) ;; *) return;; esac
-export PATH="/usr/local/bin:$PATH"
-alias ll='ls -alF'
-alias cls='clear'
-if [ -f ~/WELCOME.txt ]; then cat ~/WELCOME.txt; fi
-EOF_BASHRC
-
-cat > /home/"$USER"/WELCOME.txt << EOF
-================================================================
-HE THONG THUC HANH IOT - EPU TECH
-================================================================
-[+] USER: $USER
-[+] TRANG THAI: SAN SANG (Connected)
-[+] PHAN CUNG HO TRO: ESP32 , ESP8266, ARDUINO
-[+] TAT CA CAC THU VIEN CO BAN CAN THIET (LCD, DHT, MQTT...)
-[+] HE THONG PHAT TRIEN BOI: EPU TECH TEAM 
-[+] HE THONG TRONG GIAI DOAN PHAT TRIEN
-EOF
-
-# --- ĐOẠN FIX : SHARE THƯ VIỆN & CORE TỪ ROOT SANG CHO USER ---
-mkdir -p /home/"$USER"/Arduino/libraries
-cp -rn /root/Arduino/libraries/* /home/"$USER"/Arduino/libraries/ 2>/dev/null || true
-ln -sfn /root/.arduino15 /home/"$USER"/.arduino15 2>/dev/null || true
-
-# TỰ ĐỘNG CÀI ĐẶT CORE ARDUINO VÀ ESP32 NẾU CHƯA CÓ
-if command -v arduino-cli &> /dev/null; then
-    if ! arduino-cli core list | grep -q "arduino:avr"; then
-        echo "Installing arduino:avr core..."
-        arduino-cli core update-index &>/dev/null
-        arduino-cli core install arduino:avr &>/dev/null
-    fi
-    if ! arduino-cli core list | grep -q "esp32:esp32.*2.0.17"; then
-        echo "Installing/Downgrading esp32:esp32 core to v2.0.17..."
-        arduino-cli config init &>/dev/null || true
-        arduino-cli config add board_manager.additional_urls https://dl.espressif.com/dl/package_esp32_index.json &>/dev/null || true
-        arduino-cli core update-index &>/dev/null
-        arduino-cli core uninstall esp32:esp32 &>/dev/null || true
-        arduino-cli core install esp32:esp32@2.0.17 &>/dev/null
-    fi
-    
-    # CÀI CÁC THƯ VIỆN NHÚNG THEO CONFIG CHUNG
-    arduino-cli lib install "Adafruit NeoPixel" "DHT sensor library" "Adafruit Unified Sensor" "PubSubClient" "ArduinoJson" &>/dev/null || true
-fi
-# ----------------------------------------------------------------------
-
-chown -R "$USER:$USER" /home/"$USER"
-
-mkdir -p /run/sshd
-echo "ClientAliveInterval 30" >> /etc/ssh/sshd_config
-echo "ClientAliveCountMax 100" >> /etc/ssh/sshd_config
-echo "TCPKeepAlive yes" >> /etc/ssh/sshd_config
-
-echo "Starting SSH Daemon..."
-exec /usr/sbin/sshd -D
-"""
-    
     with open(setup_script_path, "w", encoding="utf-8") as f:
-        f.write(script_content)
+        f.write(startup_script(safe_username))
     os.chmod(setup_script_path, 0o777)
 
     logger.info(f"Starting container {cname} with devices: {required_ports}...")
     
-    # Xây dựng lệnh Docker Run (ĐÃ XÓA DÒNG MOUNT VOLUME LÀM HỎNG CORE ESP32)
-    docker_command = [
-        "docker", "run", "-d", 
-        "--name", cname, 
-        "--restart", "unless-stopped",
-        "--privileged",  
-        "-p", f"{ssh_port}:22", 
-        "-e", f"USERNAME={safe_username}", 
-        "-v", f"{host_user_dir}:/home/{safe_username}",
-        "-v", f"{setup_script_path}:/startup.sh",
-        # THÊM LẠI CÁI DÒNG NÀY ĐỂ NÓ NHẬN LÕI ESP32 TỪ MÁY CHỦ:
-        "-v", "/home/toan/flask-kerberos-demo/esp32_core:/root/.arduino15",
-        "--group-add", "dialout", 
-        "--entrypoint", "/bin/bash"
-    ]
+    # Core + thư viện Arduino: volume dùng chung read-only (hoặc volume lõi ESP32 cũ)
+    arduino_volumes, arduino_env = arduino_shared.container_options()
+    run_options = dict(
+        restart_policy={"Name": "unless-stopped"},
+        privileged=True,
+        ports={"22/tcp": ssh_port},
+        environment={"USERNAME": safe_username, **arduino_env},
+        volumes={
+            host_user_dir: {"bind": f"/home/{safe_username}", "mode": "rw"},
+            setup_script_path: {"bind": "/startup.sh", "mode": "rw"},
+            **arduino_volumes,
+            **build_cache.container_volumes(),
+        },
+        group_add=["dialout"],
+        entrypoint="/bin/bash",
+        **cpu_scheduler.container_limits(),
+    )
     # [ARCHITECT PIVOT]: Removed --device mappings to enforce isolated Testbench mode
-    pass
-
-    docker_command.append(image)
-    docker_command.append("/startup.sh")
     
     try:
-        subprocess.run(docker_command, check=True, timeout=30)
-        time.sleep(5)
-        
-        if os.path.exists(setup_script_path):
-            os.remove(setup_script_path)
-             
+        get_runtime().run(cname, USER_ENV_IMAGE, command=["/startup.sh"], **run_options)
+        # sshd chưa chắc đã lên: ssh_manager sẽ chờ qua container_readiness
+        container_readiness.mark_starting(cname)
     except Exception as e:
         logger.error(f"Error starting container: {e}")
+        container_readiness.mark_dead(cname, f"docker run failed: {e}")
 
     return ssh_port
 
@@ -272,23 +255,52 @@ def ensure_user_container_and_setup(username):
 def setup_container_permissions(cname, username):
     """Setup serial device permissions in container"""
     try:
-        cmd = ["docker", "exec", cname, "sh", "-c", "chmod 666 /dev/ttyUSB* /dev/ttyACM* 2>/dev/null || true"]
-        subprocess.run(cmd, check=False, timeout=5)
+        get_runtime().exec(cname, ["sh", "-c", "chmod 666 /dev/ttyUSB* /dev/ttyACM* 2>/dev/null || true"], timeout=5)
     except Exception:
         pass
 
 def get_all_running_users():
     """Get list of usernames with running containers"""
     try:
-        result = subprocess.run(
-            ["docker", "ps", "--format", "{{.Names}}", "--filter", "name=-dev"],
-            capture_output=True, text=True, check=True
-        )
-        names = result.stdout.strip().split('\n')
+        names = get_runtime().list_names(name_filter="-dev")
         users = [name.replace('-dev', '') for name in names if name]
         return users
     except Exception:
         return []
 
+def get_startup_report(cname):
+    """Per-phase startup timings written by the container scripts, or None"""
+    runtime = get_runtime()
+    data = runtime.inspect(cname)
+    if not data or data.get('State', {}).get('Status') != 'running':
+        return None
+    try:
+        result = runtime.exec(cname, ["cat", STARTUP_PHASES_FILE], timeout=5)
+    except Exception as e:
+        logger.warning(f"Read startup phases of {cname} failed: {e}")
+        return None
+    phases = {}
+    for line in result.stdout.splitlines() if result.exit_code == 0 else []:
+        name, _, ms = line.partition(' ')
+        if ms.strip().isdigit():
+            phases[name] = phases.get(name, 0) + int(ms) / 1000.0
+    started_at = data['State'].get('StartedAt')
+    key = (data.get('Id'), started_at)
+    if phases and key not in _reported_starts:
+        _reported_starts.add(key)
+        for name, seconds in phases.items():
+            CONTAINER_STARTUP_PHASE_SECONDS.labels(phase=name).observe(seconds)
+    labels = data.get('Config', {}).get('Labels') or {}
+    warm = labels.get(POOL_LABEL) == 'warm'
+    # Container warm đã provision từ trước khi user claim: không tính vào thời gian user phải chờ
+    waited = sum(v for k, v in phases.items() if not (warm and k == 'provision'))
+    return {
+        'container': cname,
+        'started_at': started_at,
+        'warm': warm,
+        'phases': phases,
+        'total': round(waited, 3),
+    }
+
 def docker_status_all():
      return {}
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Linux inotify watcher (ctypes, no extra dependency)
+Used by the workspace listing cache to learn about changes made on the host
+bind mount, including the ones made from the student's terminal.
+Falls back to "unavailable" on non-Linux hosts; callers then validate by mtime.
+"""
+import os
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Watch directories and call on_change(key) when something inside changes.
+
+    on_overflow() is called when the kernel queue overflowed and events were lost.
+    """
+
+    def __init__(self, on_change, on_overflow=None):
+        self.on_change = on_change
+        self.on_overflow = on_overflow
+        self._libc = None
+        self._fd = -1
+        self._wd_to_key = {}
+        self._key_to_wd = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.available = self._init()
+
+    def _init(self):
+        if not hasattr(os, 'O_NONBLOCK'):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return False
+        if fd < 0:
+            logger.warning(f"inotify_init1 failed: errno {ctypes.get_errno()}")
+            return False
+        self._libc, self._fd = libc, fd
+        return True
+
+    def watch(self, path, key):
+        if not self.available:
+            return False
+        with self._lock:
+            if key in self._key_to_wd:
+                return True
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                # ENOSPC: hết fs.inotify.max_user_watches -> caller dùng mtime
+                return False
+            self._wd_to_key[wd] = key
+            self._key_to_wd[key] = wd
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='inotify-watcher', daemon=True)
+                self._thread.start()
+        return True
+
+    def unwatch(self, key):
+        with self._lock:
+            wd = self._key_to_wd.pop(key, None)
+            if wd is None:
+                return
+            self._wd_to_key.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def is_watched(self, key):
+        return key in self._key_to_wd
+
+    def _run(self):
+        while True:
+            try:
+                # select() được eventlet monkey-patch nên không chặn hub
+                readable, _, _ = select.select([self._fd], [], [], 1.0)
+                if not readable:
+                    continue
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except Exception as e:
+                logger.error(f"inotify watcher stopped: {e}")
+                return
+            self._dispatch(data)
+
+    def _dispatch(self, data):
+        offset = 0
+        changed = set()
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size + name_len
+            if mask & IN_Q_OVERFLOW:
+                if self.on_overflow:
+                    self.on_overflow()
+                continue
+            with self._lock:
+                key = self._wd_to_key.get(wd)
+                if mask & IN_IGNORED and key is not None:
+                    # Thư mục bị xóa/di chuyển: kernel tự gỡ watch
+                    self._wd_to_key.pop(wd, None)
+                    self._key_to_wd.pop(key, None)
+            if key is not None:
+                changed.add(key)
+        for key in changed:
+            self.on_change(key)
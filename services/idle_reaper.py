@@ -0,0 +1,180 @@
+"""
+Idle container hibernation
+Terminal input, file API calls, compiles and workspace page loads record a
+timestamp per container in memory (one dict write). A background reaper stops
+(or pauses) user containers idle for longer than IDLE_TIMEOUT; the next access
+resumes them transparently through ensure_awake() before SSH connects.
+"""
+import time
+import logging
+import threading
+from prometheus_client import Counter, Gauge, Histogram
+from config import SYSTEM_CONFIG
+from utils import make_safe_name
+from services import container_readiness
+from services.container_runtime import get_runtime
+
+logger = logging.getLogger(__name__)
+
+USER_CONTAINERS = Gauge('user_containers', 'User containers on this host', ['state'])
+HOST_MEMORY_AVAILABLE = Gauge('host_memory_available_bytes', 'MemAvailable of the container host')
+HIBERNATIONS = Counter('container_hibernations_total', 'Idle user containers hibernated', ['mode'])
+RESUMES = Counter('container_resumes_total', 'Hibernated user containers resumed on access', ['mode'])
+RESUME_SECONDS = Histogram('container_resume_seconds', 'Time to resume a hibernated container (engine call only)',
+                           buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10))
+
+# Mã thoát khi container bị dừng êm (docker stop: SIGTERM/SIGKILL hoặc tự thoát 0) -> start lại được
+_GRACEFUL_EXIT_CODES = (0, 137, 143)
+
+_activity = {}
+_hibernated = set()
+_wake_locks = {}
+_lock = threading.Lock()
+_thread = None
+
+
+def _cname(username_raw):
+    return f"{make_safe_name(username_raw)}-dev"
+
+
+def touch(username_raw):
+    """Record activity of a user's container"""
+    _activity[_cname(username_raw)] = time.monotonic()
+
+
+def idle_seconds(cname):
+    last = _activity.get(cname)
+    return None if last is None else time.monotonic() - last
+
+
+# ================== NGỦ / ĐÁNH THỨC ==================
+def hibernate(cname, mode=None):
+    """Stop or pause an idle container and drop everything that points at its sshd"""
+    mode = mode or SYSTEM_CONFIG['IDLE_HIBERNATE_MODE']
+    from services.ssh_manager import invalidate_ssh_session  # import muộn: ssh_manager dùng ensure_awake
+    invalidate_ssh_session(cname[:-len('-dev')])
+    runtime = get_runtime()
+    if mode == 'pause':
+        runtime.pause(cname)
+    else:
+        runtime.stop(cname, timeout=10)
+    with _lock:
+        _hibernated.add(cname)
+    container_readiness.forget(cname)
+    HIBERNATIONS.labels(mode=mode).inc()
+    logger.info(f"Hibernated idle container {cname} ({mode})")
+
+
+def resumable(cname, data=None):
+    """Exited container that may be started again instead of recreated"""
+    if cname in _hibernated:
+        return True
+    data = data if data is not None else get_runtime().inspect(cname)
+    state = (data or {}).get('State') or {}
+    return (state.get('Status') == 'exited' and not state.get('OOMKilled')
+            and state.get('ExitCode') in _GRACEFUL_EXIT_CODES)
+
+
+def _wake_lock(cname):
+    with _lock:
+        lock = _wake_locks.get(cname)
+        if lock is None:
+            lock = _wake_locks[cname] = threading.Lock()
+        return lock
+
+
+def ensure_awake(cname, status=None):
+    """Resume a paused or hibernated container. Returns True if it was resumed."""
+    if status is None:
+        from services.docker_manager import docker_status  # import muộn tránh vòng import
+        status = docker_status(cname)
+    if status not in ('paused', 'exited'):
+        return False
+    with _wake_lock(cname):
+        runtime = get_runtime()
+        # Request khác có thể đã đánh thức trong lúc chờ khóa
+        data = runtime.inspect(cname)
+        status = ((data or {}).get('State') or {}).get('Status')
+        started = time.monotonic()
+        if status == 'paused':
+            runtime.unpause(cname)
+            mode = 'pause'
+        elif status == 'exited' and resumable(cname, data):
+            runtime.start(cname)
+            mode = 'stop'
+        else:
+            return False
+        RESUME_SECONDS.observe(time.monotonic() - started)
+    with _lock:
+        _hibernated.discard(cname)
+    _activity[cname] = time.monotonic()
+    container_readiness.mark_starting(cname)
+    RESUMES.labels(mode=mode).inc()
+    logger.info(f"Resumed container {cname} ({mode})")
+    return True
+
+
+# ================== REAPER ==================
+def _host_memory_available():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def reap_once(now=None):
+    """One scan: hibernate idle containers, refresh density metrics. Returns hibernated names."""
+    timeout = SYSTEM_CONFIG['IDLE_TIMEOUT']
+    now = now if now is not None else time.monotonic()
+    runtime = get_runtime()
+    # Container đang pause vẫn nằm trong danh sách "running" của Docker
+    running = [n for n in runtime.list_names(name_filter="-dev", running=True)
+               if n.endswith('-dev') and n not in _hibernated]
+    all_names = [n for n in runtime.list_names(name_filter="-dev", running=False) if n.endswith('-dev')]
+    reaped = []
+    for cname in running:
+        last = _activity.setdefault(cname, now)  # chưa thấy hoạt động nào: tính từ lần quét đầu tiên
+        if timeout > 0 and now - last > timeout:
+            try:
+                hibernate(cname)
+                reaped.append(cname)
+            except Exception as e:
+                logger.error(f"Hibernate {cname} failed: {e}")
+
+    active_window = SYSTEM_CONFIG['IDLE_ACTIVE_WINDOW']
+    with _lock:
+        _hibernated.intersection_update(all_names)
+        hibernated = len(_hibernated)
+    running_count = len(running) - len(reaped)
+    USER_CONTAINERS.labels(state='running').set(running_count)
+    USER_CONTAINERS.labels(state='active').set(sum(1 for n in running if n not in reaped and now - _activity[n] <= active_window))
+    USER_CONTAINERS.labels(state='hibernated').set(hibernated)
+    USER_CONTAINERS.labels(state='total').set(len(all_names))
+    memory = _host_memory_available()
+    if memory is not None:
+        HOST_MEMORY_AVAILABLE.set(memory)
+    return reaped
+
+
+def _run():
+    while True:
+        try:
+            reap_once()
+        except Exception as e:
+            logger.error(f"Idle reaper scan failed: {e}")
+        time.sleep(SYSTEM_CONFIG['IDLE_CHECK_INTERVAL'])
+
+
+def start():
+    """Start the background reaper (idempotent)"""
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, name="idle-reaper", daemon=True)
+    _thread.start()
+    logger.info(f"Idle reaper started (timeout {SYSTEM_CONFIG['IDLE_TIMEOUT']}s, mode {SYSTEM_CONFIG['IDLE_HIBERNATE_MODE']})")
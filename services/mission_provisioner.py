@@ -0,0 +1,226 @@
+"""
+Bulk pre-provisioning of a mission's assignees
+When an exam starts every assigned student opens the workspace within the same
+minute. An admin action, or the scheduler MISSION_PREPROVISION_LEAD minutes
+before missions.start_time, starts and health-checks the container of every
+user in mission_assignments (at most MISSION_PROVISION_CONCURRENCY at a time)
+and creates the mission folder with its template.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import Counter, Histogram
+from config import get_db_connection, SYSTEM_CONFIG
+from utils import make_safe_name
+from utils.helpers import slugify_vn
+from services import container_readiness
+from services.docker_manager import ensure_user_container_and_setup
+from services.workspace_storage import open_workspace
+
+logger = logging.getLogger(__name__)
+
+MISSION_PROVISION_USERS = Counter('mission_provision_users_total', 'Users pre-provisioned for a mission', ['result'])
+MISSION_PROVISION_SECONDS = Histogram('mission_provision_seconds', 'Time to provision and check one assignee',
+                                      buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300))
+
+DEFAULT_MISSION_TEMPLATE = "// Bắt đầu code bài làm của bạn tại đây\nvoid setup() {\n  Serial.begin(115200);\n}\n\nvoid loop() {\n  \n}\n"
+
+
+# ================== THƯ MỤC BÀI LÀM ==================
+def mission_slug(mission):
+    return slugify_vn(mission['name']) or f"mission_{mission['id']}"
+
+
+def create_mission_files(fs, mission):
+    """Create <slug>/<slug>.ino from the mission template unless it already exists"""
+    slug = mission_slug(mission)
+    try:
+        fs.mkdir(slug)
+    except IOError:
+        pass
+    ino_path = os.path.join(slug, f"{slug}.ino")
+    try:
+        fs.stat(ino_path)
+    except FileNotFoundError:
+        template = mission.get('template_code') or DEFAULT_MISSION_TEMPLATE
+        fs.write_bytes(ino_path, template.encode('utf-8'))
+    return slug
+
+
+# ================== CHUẨN BỊ HÀNG LOẠT ==================
+class ProvisionJob:
+    __slots__ = ('mission_id', 'trigger', 'total', 'done', 'failed', 'started', 'finished')
+
+    def __init__(self, mission_id, trigger, total):
+        self.mission_id = mission_id
+        self.trigger = trigger
+        self.total = total
+        self.done = 0
+        self.failed = {}         # username -> lỗi
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def running(self):
+        return self.finished is None
+
+    def to_dict(self):
+        return {
+            'mission_id': self.mission_id,
+            'trigger': self.trigger,
+            'total': self.total,
+            'done': self.done,
+            'ok': self.done - len(self.failed),
+            'failed': [{'username': u, 'error': e} for u, e in sorted(self.failed.items())],
+            'running': self.running,
+            'started_at': self.started,
+            'finished_at': self.finished,
+        }
+
+
+def load_mission(mission_id):
+    """(mission row, [assigned usernames]) or (None, [])"""
+    db = get_db_connection()
+    if not db:
+        return None, []
+    cur = db.cursor(dictionary=True)
+    cur.execute("SELECT * FROM missions WHERE id=%s", (mission_id,))
+    mission = cur.fetchone()
+    users = []
+    if mission:
+        cur.execute("""
+            SELECT u.username FROM mission_assignments ma
+            JOIN users u ON u.id = ma.user_id
+            WHERE ma.mission_id = %s AND u.status = 'active'
+            ORDER BY u.username
+        """, (mission_id,))
+        users = [row['username'] for row in cur.fetchall()]
+    cur.close()
+    db.close()
+    return mission, users
+
+
+def provision_user(username, mission):
+    """Start the user's container, wait for sshd and create the mission folder"""
+    ssh_port = ensure_user_container_and_setup(username)
+    if not ssh_port:
+        raise RuntimeError("no SSH port")
+    container_readiness.wait_until_ready(f"{make_safe_name(username)}-dev", ssh_port)
+    # Mở workspace qua SSH cũng là bước kiểm tra sức khỏe cuối cùng
+    with open_workspace(username) as fs:
+        create_mission_files(fs, mission)
+
+
+class MissionProvisioner:
+    """Provisions all assignees of a mission with bounded parallelism"""
+
+    def __init__(self, concurrency, lead_minutes, check_interval):
+        self.concurrency = max(1, concurrency)
+        self.lead_minutes = lead_minutes
+        self.check_interval = check_interval
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, mission_id, trigger='admin'):
+        """Start provisioning a mission in the background. Returns the job, None if the mission is unknown."""
+        with self._lock:
+            job = self._jobs.get(mission_id)
+            if job and job.running:
+                return job
+        mission, users = load_mission(mission_id)
+        if not mission:
+            return None
+        job = ProvisionJob(mission_id, trigger, len(users))
+        with self._lock:
+            current = self._jobs.get(mission_id)
+            if current and current.running:
+                return current
+            self._jobs[mission_id] = job
+        threading.Thread(target=self._run_job, args=(job, mission, users),
+                         name=f"mission-provision-{mission_id}", daemon=True).start()
+        logger.info(f"Provisioning {len(users)} assignees of mission {mission_id} ({trigger})")
+        return job
+
+    def _provision_one(self, job, username, mission):
+        started = time.monotonic()
+        try:
+            provision_user(username, mission)
+            MISSION_PROVISION_USERS.labels(result='ok').inc()
+        except Exception as e:
+            logger.error(f"Mission {job.mission_id}: provisioning {username} failed: {e}")
+            MISSION_PROVISION_USERS.labels(result='error').inc()
+            with self._lock:
+                job.failed[username] = str(e)
+        finally:
+            MISSION_PROVISION_SECONDS.observe(time.monotonic() - started)
+            with self._lock:
+                job.done += 1
+
+    def _run_job(self, job, mission, users):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="mission-provision") as pool:
+            for username in users:
+                pool.submit(self._provision_one, job, username, mission)
+        job.finished = time.time()
+        logger.info(f"Mission {job.mission_id} provisioned: {job.total - len(job.failed)}/{job.total} ok")
+
+    def progress(self, mission_id):
+        with self._lock:
+            job = self._jobs.get(mission_id)
+            return job.to_dict() if job else None
+
+    # ---------- Tự động trước giờ bắt đầu ----------
+    def start(self):
+        """Start the scheduler thread (idempotent, disabled when lead is 0)"""
+        if self.lead_minutes <= 0:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="mission-provisioner", daemon=True)
+        self._thread.start()
+        logger.info(f"Mission pre-provisioning scheduled {self.lead_minutes} min before start")
+
+    def due_missions(self):
+        """Ids of missions starting within the lead window"""
+        db = get_db_connection()
+        if not db:
+            return []
+        cur = db.cursor(dictionary=True)
+        cur.execute("""
+            SELECT id FROM missions
+            WHERE start_time > CURRENT_TIMESTAMP
+              AND start_time <= CURRENT_TIMESTAMP + INTERVAL %s MINUTE
+        """, (self.lead_minutes,))
+        ids = [row['id'] for row in cur.fetchall()]
+        cur.close()
+        db.close()
+        return ids
+
+    def check_schedule(self):
+        """Submit due missions that were not provisioned yet by this process"""
+        submitted = []
+        for mission_id in self.due_missions():
+            with self._lock:
+                if mission_id in self._jobs:
+                    continue
+            if self.submit(mission_id, trigger='schedule'):
+                submitted.append(mission_id)
+        return submitted
+
+    def _run(self):
+        while True:
+            try:
+                self.check_schedule()
+            except Exception as e:
+                logger.error(f"Mission pre-provisioning check failed: {e}")
+            time.sleep(self.check_interval)
+
+
+mission_provisioner = MissionProvisioner(
+    concurrency=SYSTEM_CONFIG['MISSION_PROVISION_CONCURRENCY'],
+    lead_minutes=SYSTEM_CONFIG['MISSION_PREPROVISION_LEAD'],
+    check_interval=SYSTEM_CONFIG['MISSION_PREPROVISION_CHECK_INTERVAL'],
+)
@@ -0,0 +1,171 @@
+"""
+SSH host port allocator
+Every user container (and warm pool container) publishes sshd on a host port
+leased from the ssh_port_leases table: one row per port of the configured range,
+holder = users.username or the warm container name. A claim is a single UPDATE
+... WHERE holder IS NULL LIMIT 1, so API replicas never hand out the same port,
+and a stopped container keeps its port until the user is deleted.
+"""
+import logging
+import mysql.connector
+from prometheus_client import Counter, Gauge
+from config import get_db_connection, SYSTEM_CONFIG
+from utils import find_free_port
+from services.container_runtime import get_runtime
+
+logger = logging.getLogger(__name__)
+
+SSH_PORTS = Gauge('ssh_ports', 'SSH host ports in the configured range', ['state'])
+SSH_PORT_CLAIMS = Counter('ssh_port_claims_total', 'SSH port lease requests', ['result'])
+
+WARM_HOLDER_PREFIX = "warm-"
+
+
+class PortAllocator:
+    """Atomic SSH port leases stored in MySQL"""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def _refresh_gauges(self, cur):
+        cur.execute("SELECT COUNT(holder), COUNT(*) FROM ssh_port_leases WHERE port BETWEEN %s AND %s",
+                    (self.start, self.end))
+        leased, total = cur.fetchone()
+        SSH_PORTS.labels(state='leased').set(leased)
+        SSH_PORTS.labels(state='free').set(total - leased)
+
+    def _lease_of(self, cur, holder):
+        cur.execute("SELECT port FROM ssh_port_leases WHERE holder=%s", (holder,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def claim(self, holder, preferred=None):
+        """Port leased to holder: its current lease, else `preferred` if free, else the lowest free port"""
+        db = get_db_connection()
+        if not db:
+            # Không có DB thì cũng không đăng nhập được; dò cổng trên host như trước
+            SSH_PORT_CLAIMS.labels(result='fallback').inc()
+            logger.warning(f"Port allocator: database unavailable, probing host ports for {holder}")
+            return find_free_port(self.start, self.end)
+        cur = db.cursor()
+        try:
+            port = self._lease_of(cur, holder)
+            if port:
+                SSH_PORT_CLAIMS.labels(result='existing').inc()
+                return port
+            try:
+                claimed = 0
+                if preferred:
+                    cur.execute("UPDATE ssh_port_leases SET holder=%s, leased_at=CURRENT_TIMESTAMP "
+                                "WHERE port=%s AND holder IS NULL", (holder, preferred))
+                    claimed = cur.rowcount
+                if not claimed:
+                    cur.execute("UPDATE ssh_port_leases SET holder=%s, leased_at=CURRENT_TIMESTAMP "
+                                "WHERE holder IS NULL AND port BETWEEN %s AND %s ORDER BY port LIMIT 1",
+                                (holder, self.start, self.end))
+            except mysql.connector.IntegrityError:
+                pass  # request khác vừa cấp cổng cho cùng holder (UNIQUE holder)
+            port = self._lease_of(cur, holder)
+            SSH_PORT_CLAIMS.labels(result='new' if port else 'exhausted').inc()
+            if not port:
+                logger.error(f"Port allocator: no free SSH port in {self.start}-{self.end} for {holder}")
+            self._refresh_gauges(cur)
+            return port
+        finally:
+            cur.close()
+            db.close()
+
+    def assign(self, holder, port, from_holder=None):
+        """Move the lease of `port` to holder, releasing holder's other port.
+
+        Only a free lease or one held by `from_holder` (the warm container being
+        claimed) is moved. Returns False when the port is leased to someone else.
+        """
+        db = get_db_connection()
+        if not db:
+            return True
+        cur = db.cursor()
+        try:
+            cur.execute("UPDATE ssh_port_leases SET holder=NULL, leased_at=NULL WHERE holder=%s AND port<>%s",
+                        (holder, port))
+            cur.execute("INSERT IGNORE INTO ssh_port_leases (port) VALUES (%s)", (port,))
+            cur.execute("UPDATE ssh_port_leases SET holder=%s, leased_at=CURRENT_TIMESTAMP "
+                        "WHERE port=%s AND (holder IS NULL OR holder=%s OR holder=%s)",
+                        (holder, port, holder, from_holder))
+            assigned = self._lease_of(cur, holder) == port
+            if not assigned:
+                logger.error(f"Port allocator: port {port} is leased to another holder, not moved to {holder}")
+            self._refresh_gauges(cur)
+            return assigned
+        finally:
+            cur.close()
+            db.close()
+
+    def release(self, holder):
+        """Return holder's port to the pool (user deleted, warm container removed)"""
+        db = get_db_connection()
+        if not db:
+            return
+        cur = db.cursor()
+        try:
+            cur.execute("UPDATE ssh_port_leases SET holder=NULL, leased_at=NULL WHERE holder=%s", (holder,))
+            if cur.rowcount:
+                logger.info(f"Released SSH port lease of {holder}")
+            self._refresh_gauges(cur)
+        finally:
+            cur.close()
+            db.close()
+
+    def sync(self):
+        """Startup: create rows for the range, adopt users.ssh_port, reclaim stale leases"""
+        db = get_db_connection()
+        if not db:
+            return
+        cur = db.cursor()
+        try:
+            cur.executemany("INSERT IGNORE INTO ssh_port_leases (port) VALUES (%s)",
+                            [(p,) for p in range(self.start, self.end + 1)])
+            # Cổng ngoài dải hiện tại vẫn đang dùng: giữ lại, chỉ không cấp mới
+            cur.execute("INSERT IGNORE INTO ssh_port_leases (port) SELECT DISTINCT ssh_port FROM users WHERE ssh_port IS NOT NULL")
+            # Cổng gán trước khi có bảng lease: user đầu tiên giữ cổng, user trùng cổng sẽ được cấp cổng mới
+            cur.execute("""
+                UPDATE ssh_port_leases l
+                JOIN (SELECT ssh_port, MIN(username) AS username FROM users
+                      WHERE ssh_port IS NOT NULL GROUP BY ssh_port) u ON u.ssh_port = l.port
+                LEFT JOIN ssh_port_leases mine ON mine.holder = u.username
+                SET l.holder = u.username, l.leased_at = CURRENT_TIMESTAMP
+                WHERE l.holder IS NULL AND mine.port IS NULL
+            """)
+            cur.execute("""
+                UPDATE users u LEFT JOIN ssh_port_leases l ON l.holder = u.username
+                SET u.ssh_port = l.port
+                WHERE u.ssh_port IS NOT NULL AND NOT (u.ssh_port <=> l.port)
+            """)
+            # User đã bị xóa
+            cur.execute("""
+                UPDATE ssh_port_leases l LEFT JOIN users u ON u.username = l.holder
+                SET l.holder = NULL, l.leased_at = NULL
+                WHERE l.holder IS NOT NULL AND l.holder NOT LIKE %s AND u.id IS NULL
+            """, (WARM_HOLDER_PREFIX + '%',))
+            reclaimed = cur.rowcount
+            # Container warm không còn tồn tại
+            cur.execute("SELECT holder FROM ssh_port_leases WHERE holder LIKE %s", (WARM_HOLDER_PREFIX + '%',))
+            warm_holders = {row[0] for row in cur.fetchall()}
+            if warm_holders:
+                existing = set(get_runtime().list_names(name_filter=WARM_HOLDER_PREFIX, running=False))
+                for holder in warm_holders - existing:
+                    cur.execute("UPDATE ssh_port_leases SET holder=NULL, leased_at=NULL WHERE holder=%s", (holder,))
+                    reclaimed += 1
+            db.commit()
+            self._refresh_gauges(cur)
+            logger.info(f"SSH port leases synced ({self.start}-{self.end}, {reclaimed} reclaimed)")
+        finally:
+            cur.close()
+            db.close()
+
+
+port_allocator = PortAllocator(
+    start=SYSTEM_CONFIG['SSH_PORT_RANGE_START'],
+    end=SYSTEM_CONFIG['SSH_PORT_RANGE_END'],
+)
@@ -1,17 +1,33 @@
 """
 SSH connection management service
+Keeps one authenticated SSH transport per user alive in a pool; file APIs open
+cheap SFTP/exec channels over it instead of doing a full handshake per request.
 """
 import time
+import threading
 import paramiko
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
 from utils import make_safe_name
-from config import get_db_connection
+from config import get_db_connection, SYSTEM_CONFIG
+from services.container_readiness import wait_until_ready, mark_unready, get_state, STATE_READY, ContainerUnavailableError
+from services import idle_reaper
 
 logger = logging.getLogger(__name__)
 
-def get_ssh_client(username_raw):
-    """Get SSH client connection for a user's container"""
-    # Get port using original username from DB
+# ================== METRICS ==================
+SSH_POOL_HITS = Counter('ssh_pool_hits_total', 'Requests served by an already authenticated pooled SSH session')
+SSH_POOL_MISSES = Counter('ssh_pool_misses_total', 'Requests that needed a new SSH handshake')
+SSH_POOL_EVICTIONS = Counter('ssh_pool_evictions_total', 'Pooled SSH sessions closed by the pool', ['reason'])
+SSH_POOL_SESSIONS = Gauge('ssh_pool_sessions', 'Live pooled SSH sessions')
+SSH_HANDSHAKE_SECONDS = Histogram('ssh_handshake_seconds', 'SSH connect + password auth latency',
+                                  buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+
+
+def get_user_ssh_port(username_raw):
+    """Look up the host port mapped to the user's container sshd"""
     db = get_db_connection()
     cur = db.cursor(dictionary=True)
     cur.execute("SELECT ssh_port FROM users WHERE username=%s", (username_raw,))
@@ -20,32 +36,277 @@ def get_ssh_client(username_raw):
     db.close()
 
     ssh_port = user_data.get("ssh_port") if user_data else None
-    
     if not ssh_port:
         logger.error(f"DB search failed for port with username: '{username_raw}'")
         raise Exception("Không tìm thấy thông tin Port trong Database")
+    return int(ssh_port)
 
-    # Connect SSH using safe username
-    safe_username = make_safe_name(username_raw)
+
+def _connect(ssh_port, safe_username):
+    """Open and authenticate one SSH connection (single attempt)"""
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
-    for i in range(30):
+    started = time.monotonic()
+    client.connect(
+        '127.0.0.1',
+        port=int(ssh_port),
+        username=safe_username,
+        password='password123',
+        timeout=10,
+        banner_timeout=30,
+        allow_agent=False,
+        look_for_keys=False
+    )
+    SSH_HANDSHAKE_SECONDS.observe(time.monotonic() - started)
+    return client
+
+
+def _connect_when_ready(ssh_port, safe_username):
+    """Wait for the container sshd (shared per container), then connect.
+
+    One reconnect is allowed when sshd dies between the probe and the handshake.
+    """
+    cname = f"{safe_username}-dev"
+    if get_state(cname) != STATE_READY:
+        # Container có thể đang ngủ do idle reaper: đánh thức trước khi chờ sshd
+        idle_reaper.ensure_awake(cname)
+    wait_until_ready(cname, ssh_port)
+    try:
+        return _connect(ssh_port, safe_username)
+    except Exception as e:
+        logger.warning(f"SSH connect to {cname} failed after readiness probe: {e}")
+        mark_unready(cname)
+        wait_until_ready(cname, ssh_port)
+        return _connect(ssh_port, safe_username)
+
+
+def get_ssh_client(username_raw):
+    """Get a dedicated SSH client connection for a user's container.
+
+    The caller owns the returned client and must close it. Short-lived file
+    operations should use ssh_session()/sftp_session() instead.
+    """
+    ssh_port = get_user_ssh_port(username_raw)
+
+    # Connect SSH using safe username
+    safe_username = make_safe_name(username_raw)
+    try:
+        return _connect_when_ready(ssh_port, safe_username)
+    except ContainerUnavailableError:
+        raise
+    except Exception as e:
+        logger.error(f"SSH connect failed: {str(e)}")
+        raise Exception(f"KHONG THE KET NOI SSH TOI PORT {ssh_port}: {e}")
+
+
+# ================== SESSION POOL ==================
+class _PooledSession:
+    """One authenticated SSH client kept alive for a user"""
+    __slots__ = ('client', 'ssh_port', 'last_used', 'last_checked', 'in_use', 'dead')
+
+    def __init__(self, client, ssh_port):
+        now = time.monotonic()
+        self.client = client
+        self.ssh_port = ssh_port
+        self.last_used = now
+        self.last_checked = now
+        self.in_use = 0
+        self.dead = None    # lý do loại bỏ; đóng khi người mượn cuối cùng trả lại
+
+
+class SSHSessionPool:
+    """Keyed pool of per-user SSH sessions with LRU/TTL eviction and health checks"""
+
+    def __init__(self, max_sessions, idle_ttl, healthcheck_interval, connect=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.healthcheck_interval = healthcheck_interval
+        self._connect = connect or _connect_when_ready
+        self._sessions = OrderedDict()
+        self._retired = {}      # id(client) -> entry đã loại bỏ nhưng còn người mượn
+        self._lock = threading.Lock()
+        self._user_locks = {}
+
+    def _user_lock(self, key):
+        with self._lock:
+            lock = self._user_locks.get(key)
+            if lock is None:
+                lock = self._user_locks[key] = threading.Lock()
+            return lock
+
+    def _is_healthy(self, entry):
+        transport = entry.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        now = time.monotonic()
+        if now - entry.last_checked >= self.healthcheck_interval:
+            try:
+                transport.send_ignore()
+            except Exception:
+                return False
+            entry.last_checked = now
+        return True
+
+    def _close(self, entry, reason):
+        SSH_POOL_EVICTIONS.labels(reason=reason).inc()
+        try:
+            entry.client.close()
+        except Exception:
+            pass
+
+    def _pop_locked(self, key):
+        entry = self._sessions.pop(key, None)
+        SSH_POOL_SESSIONS.set(len(self._sessions))
+        return entry
+
+    def _retire_locked(self, entry, reason):
+        """Mark a popped entry dead; True if it can be closed right away"""
+        if entry.in_use > 0:
+            entry.dead = reason
+            self._retired[id(entry.client)] = entry
+            return False
+        return True
+
+    def _take(self, key):
+        """Return a healthy pooled entry for key (marked in use) or None"""
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                return None
+            self._sessions.move_to_end(key)
+            entry.in_use += 1
+        if self._is_healthy(entry):
+            entry.last_used = time.monotonic()
+            return entry
+        self.release(key, entry.client)
+        with self._lock:
+            if self._sessions.get(key) is not entry:
+                return None     # đã bị loại bỏ bởi luồng khác
+            self._pop_locked(key)
+            closable = self._retire_locked(entry, 'unhealthy')
+        if closable:
+            self._close(entry, 'unhealthy')
+        return None
+
+    def _sweep(self):
+        """Drop idle sessions past the TTL and trim the pool down to max_sessions"""
+        now = time.monotonic()
+        closing = []
+        with self._lock:
+            for key, entry in list(self._sessions.items()):
+                if entry.in_use == 0 and now - entry.last_used > self.idle_ttl:
+                    closing.append((self._pop_locked(key), 'idle'))
+            # LRU: oldest entries first in the OrderedDict
+            for key, entry in list(self._sessions.items()):
+                if len(self._sessions) <= self.max_sessions:
+                    break
+                if entry.in_use == 0:
+                    closing.append((self._pop_locked(key), 'lru'))
+        for entry, reason in closing:
+            self._close(entry, reason)
+
+    def acquire(self, username_raw):
+        """Borrow the user's pooled client; pair every call with release()"""
+        self._sweep()
+        entry = self._take(username_raw)
+        if entry:
+            SSH_POOL_HITS.inc()
+            return entry.client
+
+        with self._user_lock(username_raw):
+            # Another request may have connected while we waited for the lock
+            entry = self._take(username_raw)
+            if entry:
+                SSH_POOL_HITS.inc()
+                return entry.client
+
+            SSH_POOL_MISSES.inc()
+            ssh_port = get_user_ssh_port(username_raw)
+            client = self._connect(ssh_port, make_safe_name(username_raw))
+            entry = _PooledSession(client, ssh_port)
+            entry.in_use = 1
+            with self._lock:
+                self._sessions[username_raw] = entry
+                SSH_POOL_SESSIONS.set(len(self._sessions))
+        self._sweep()
+        return client
+
+    def release(self, username_raw, client):
+        with self._lock:
+            entry = self._sessions.get(username_raw)
+            if entry is not None and entry.client is client:
+                entry.in_use = max(0, entry.in_use - 1)
+                entry.last_used = time.monotonic()
+                return
+            entry = self._retired.get(id(client))
+            if entry is not None:
+                entry.in_use = max(0, entry.in_use - 1)
+                if entry.in_use > 0:
+                    return
+                del self._retired[id(client)]
+        if entry is not None:
+            # Session was retired while borrowed: the last borrower closes it
+            self._close(entry, entry.dead)
+            return
         try:
-            client.connect(
-                '127.0.0.1', 
-                port=int(ssh_port), 
-                username=safe_username, 
-                password='password123', 
-                timeout=10,
-                banner_timeout=30,
-                allow_agent=False,
-                look_for_keys=False
-            ) 
-            return client
-        except Exception as e:
-            if i == 29: # Last attempt
-                logger.error(f"SSH Final Attempt Failed: {str(e)}")
-            time.sleep(1)
-    
-    raise Exception(f"KHONG THE KET NOI SSH TOI PORT {ssh_port} SAU 30 GIAY")
+            client.close()
+        except Exception:
+            pass
+
+    def invalidate(self, username_raw):
+        """Forget a user's session, e.g. after the container was recreated"""
+        with self._lock:
+            entry = self._pop_locked(username_raw)
+            closable = entry is not None and self._retire_locked(entry, 'invalidated')
+        if closable:
+            self._close(entry, 'invalidated')
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._sessions.values())
+            self._sessions.clear()
+            SSH_POOL_SESSIONS.set(0)
+        for entry in entries:
+            self._close(entry, 'shutdown')
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+ssh_pool = SSHSessionPool(
+    max_sessions=SYSTEM_CONFIG['SSH_POOL_MAX_SESSIONS'],
+    idle_ttl=SYSTEM_CONFIG['SSH_POOL_IDLE_TTL'],
+    healthcheck_interval=SYSTEM_CONFIG['SSH_POOL_HEALTHCHECK_INTERVAL'],
+)
+
+
+@contextmanager
+def ssh_session(username_raw):
+    """Borrow the pooled SSH client of a user. Do NOT close it."""
+    client = ssh_pool.acquire(username_raw)
+    try:
+        yield client
+    except Exception:
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            # Broken transport: drop it so the next request reconnects
+            ssh_pool.invalidate(username_raw)
+        raise
+    finally:
+        ssh_pool.release(username_raw, client)
+
+
+@contextmanager
+def sftp_session(username_raw):
+    """Open an SFTP channel over the user's pooled SSH session"""
+    with ssh_session(username_raw) as client:
+        sftp = client.open_sftp()
+        try:
+            yield sftp
+        finally:
+            sftp.close()
+
+
+def invalidate_ssh_session(username_raw):
+    """Close the pooled session of a user (container recreated / user deleted)"""
+    ssh_pool.invalidate(username_raw)
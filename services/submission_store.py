@@ -0,0 +1,120 @@
+"""
+Content-addressed storage for submission files
+submissions.files only keeps a manifest [{name, path, size, sha256, blob, truncated}];
+file contents live once in submission_blobs keyed by the SHA-256 of the stored
+bytes, gzip-compressed, so template code shared by a whole class is stored once.
+"""
+import gzip
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION = 'gzip'
+
+
+def _compress(data):
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'none':
+        return data
+    raise ValueError(f"Unknown blob compression: {compression}")
+
+
+def put_blobs(cur, contents):
+    """Store contents (iterable of bytes), return their sha256 keys (dedup by INSERT IGNORE)"""
+    keys = []
+    rows = {}
+    for data in contents:
+        key = hashlib.sha256(data).hexdigest()
+        keys.append(key)
+        if key not in rows:
+            rows[key] = (key, len(data), COMPRESSION, _compress(data))
+    if rows:
+        cur.executemany(
+            "INSERT IGNORE INTO submission_blobs (sha256, size, compression, data) VALUES (%s,%s,%s,%s)",
+            list(rows.values())
+        )
+    return keys
+
+
+def get_blobs(cur, keys):
+    """Return {sha256: bytes} for the requested keys"""
+    keys = sorted(set(keys))
+    if not keys:
+        return {}
+    placeholders = ','.join(['%s'] * len(keys))
+    cur.execute(f"SELECT sha256, compression, data FROM submission_blobs WHERE sha256 IN ({placeholders})", keys)
+    blobs = {}
+    for row in cur.fetchall():
+        sha, compression, data = (row['sha256'], row['compression'], row['data']) if isinstance(row, dict) else row
+        blobs[sha] = _decompress(bytes(data), compression)
+    return blobs
+
+
+def store_submission_files(cur, files):
+    """Move the content of snapshot files into the blob store, return the manifest"""
+    files = list(files)
+    keys = put_blobs(cur, (f.get('content', '').encode('utf-8') for f in files))
+    manifest = []
+    for f, key in zip(files, keys):
+        entry = {k: v for k, v in f.items() if k != 'content'}
+        entry['blob'] = key
+        manifest.append(entry)
+    return manifest
+
+
+def load_submission_files(cur, manifest, paths=None):
+    """Resolve manifest entries to {..., content}. Lazy: only the given paths when set.
+
+    Rows written before the blob store still carry their content inline and are
+    returned unchanged.
+    """
+    if isinstance(manifest, (str, bytes)):
+        manifest = json.loads(manifest or '[]')
+    wanted = [f for f in manifest or [] if paths is None or f.get('path') in paths]
+    blobs = get_blobs(cur, [f['blob'] for f in wanted if 'blob' in f and 'content' not in f])
+    files = []
+    for f in wanted:
+        if 'content' in f or 'blob' not in f:
+            files.append(f)
+            continue
+        data = blobs.get(f['blob'])
+        if data is None:
+            logger.error(f"Missing submission blob {f['blob']} for {f.get('path')}")
+        files.append({**f, 'content': data.decode('utf-8', errors='replace') if data is not None else ''})
+    return files
+
+
+def migrate_inline_submissions(db, batch_size=100):
+    """Move inline contents of old submissions rows into submission_blobs.
+
+    Safe to re-run: rows that are already manifests are skipped. Returns the
+    number of migrated rows.
+    """
+    migrated = 0
+    last_id = 0
+    cur = db.cursor(dictionary=True)
+    try:
+        while True:
+            cur.execute("SELECT id, files FROM submissions WHERE id > %s ORDER BY id LIMIT %s", (last_id, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            for row in rows:
+                last_id = row['id']
+                files = json.loads(row['files'] or '[]')
+                if not any('content' in f for f in files):
+                    continue
+                manifest = store_submission_files(cur, files)
+                cur.execute("UPDATE submissions SET files=%s WHERE id=%s", (json.dumps(manifest), row['id']))
+                migrated += 1
+            db.commit()
+    finally:
+        cur.close()
+    return migrated
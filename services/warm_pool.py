@@ -0,0 +1,222 @@
+"""
+Warm pool of user environment containers
+Keeps WARM_POOL_SIZE generic my-dev-env containers provisioned in the background.
+A first-time or recreated user claims one instead of a cold docker run: the
+container binds the user's workspace onto /home/<user>, creates the account,
+starts sshd and is renamed to <user>-dev. The pool refills asynchronously.
+"""
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from prometheus_client import Counter, Gauge, Histogram
+from config import SYSTEM_CONFIG
+from services import container_readiness, arduino_shared, build_cache
+from services.container_runtime import get_runtime
+from services.port_allocator import port_allocator
+from services.cpu_scheduler import cpu_scheduler
+from services.container_setup import USER_ENV_IMAGE, WARM_WORKSPACES_MOUNT, WARM_READY_MARKER, warm_script
+
+logger = logging.getLogger(__name__)
+
+WARM_POOL_CONTAINERS = Gauge('warm_pool_containers', 'Warm pool containers', ['state'])
+WARM_POOL_CLAIMS = Counter('warm_pool_claims_total', 'Warm pool claim attempts', ['result'])
+WARM_POOL_CLAIM_SECONDS = Histogram('warm_pool_claim_seconds', 'Time to bind a warm container to a user',
+                                    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+
+WARM_PREFIX = "warm-"
+POOL_LABEL = "epu.pool"
+PORT_LABEL = "epu.ssh_port"
+
+
+class WarmSlot:
+    __slots__ = ('name', 'ssh_port', 'created')
+
+    def __init__(self, name, ssh_port, created=None):
+        self.name = name
+        self.ssh_port = ssh_port
+        self.created = created if created is not None else time.monotonic()
+
+
+class WarmContainerPool:
+    """Pre-started generic containers, claimed and bound to a user on demand"""
+
+    def __init__(self, target_size, refill_interval, start_timeout, claim_timeout):
+        self.target_size = target_size
+        self.refill_interval = refill_interval
+        self.start_timeout = start_timeout
+        self.claim_timeout = claim_timeout
+        self._ready = deque()
+        self._starting = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._adopted = False
+
+    @property
+    def enabled(self):
+        return self.target_size > 0
+
+    def _update_gauges(self):
+        WARM_POOL_CONTAINERS.labels(state='ready').set(len(self._ready))
+        WARM_POOL_CONTAINERS.labels(state='starting').set(len(self._starting))
+
+    # ---------- Background refill ----------
+    def start(self):
+        """Start the refill thread (idempotent)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="warm-pool", daemon=True)
+        self._thread.start()
+        logger.info(f"Warm pool started (target size {self.target_size})")
+
+    def _run(self):
+        while True:
+            try:
+                self.refill()
+            except Exception as e:
+                logger.error(f"Warm pool refill failed: {e}")
+            self._wake.wait(self.refill_interval)
+            self._wake.clear()
+
+    def _adopt(self):
+        """Pick up warm containers left by a previous API process"""
+        runtime = get_runtime()
+        for name in runtime.list_names(name_filter=WARM_PREFIX, running=False):
+            if not name.startswith(WARM_PREFIX):
+                continue
+            data = runtime.inspect(name) or {}
+            labels = data.get('Config', {}).get('Labels') or {}
+            port = labels.get(PORT_LABEL)
+            if data.get('State', {}).get('Status') != 'running' or labels.get(POOL_LABEL) != 'warm' or not port:
+                self._discard(name, "stale")
+                continue
+            self._starting[name] = WarmSlot(name, int(port))
+        self._adopted = True
+
+    def refill(self):
+        """One pass: promote provisioned containers, drop broken ones, create missing ones"""
+        if not self.enabled:
+            return
+        if not self._adopted:
+            self._adopt()
+        runtime = get_runtime()
+        now = time.monotonic()
+        for name, slot in list(self._starting.items()):
+            try:
+                ready = runtime.exec(name, ["test", "-f", WARM_READY_MARKER], timeout=5).exit_code == 0
+            except Exception as e:
+                logger.warning(f"Warm container {name} not reachable: {e}")
+                ready = False
+                if runtime.status(name) != 'running':
+                    with self._lock:
+                        self._starting.pop(name, None)
+                    self._discard(name, "exited")
+                    continue
+            with self._lock:
+                if ready:
+                    self._ready.append(self._starting.pop(name))
+                elif now - slot.created > self.start_timeout:
+                    self._starting.pop(name, None)
+                else:
+                    continue
+            if not ready:
+                self._discard(name, "provisioning timeout")
+        while len(self._ready) + len(self._starting) < self.target_size:
+            if not self._create():
+                break
+        self._update_gauges()
+
+    def _create(self):
+        name = f"{WARM_PREFIX}{uuid.uuid4().hex[:10]}"
+        ssh_port = port_allocator.claim(name)
+        if not ssh_port:
+            logger.error("Warm pool: no free SSH port")
+            return False
+        arduino_volumes, arduino_env = arduino_shared.container_options()
+        try:
+            get_runtime().run(
+                name, USER_ENV_IMAGE,
+                command=["-c", warm_script()],
+                entrypoint="/bin/bash",
+                restart_policy={"Name": "unless-stopped"},
+                privileged=True,
+                ports={"22/tcp": ssh_port},
+                environment=arduino_env,
+                volumes={
+                    SYSTEM_CONFIG['WORKSPACE_HOST_ROOT']: {"bind": WARM_WORKSPACES_MOUNT, "mode": "rw"},
+                    **arduino_volumes,
+                    **build_cache.container_volumes(),
+                },
+                group_add=["dialout"],
+                labels={POOL_LABEL: "warm", PORT_LABEL: str(ssh_port)},
+                **cpu_scheduler.container_limits(),
+            )
+        except Exception as e:
+            logger.error(f"Warm pool: create {name} failed: {e}")
+            port_allocator.release(name)
+            return False
+        with self._lock:
+            self._starting[name] = WarmSlot(name, ssh_port)
+        return True
+
+    def _discard(self, name, reason):
+        logger.warning(f"Removing warm container {name}: {reason}")
+        try:
+            get_runtime().remove(name, force=True)
+        except Exception as e:
+            logger.error(f"Remove warm container {name} failed: {e}")
+        port_allocator.release(name)
+
+    # ---------- Claim ----------
+    def claim(self, safe_username, cname):
+        """Bind a ready container to the user and rename it to cname.
+
+        The user's workspace directory must already exist on the host. Returns
+        the claimed WarmSlot (former warm name, SSH port), or None on a miss
+        (caller falls back to a cold start).
+        """
+        if not self.enabled:
+            return None
+        self.start()
+        started = time.monotonic()
+        runtime = get_runtime()
+        while True:
+            with self._lock:
+                slot = self._ready.popleft() if self._ready else None
+                self._update_gauges()
+            self._wake.set()
+            if slot is None:
+                WARM_POOL_CLAIMS.labels(result='miss').inc()
+                return None
+            try:
+                result = runtime.exec(slot.name, ["bash", "-c", warm_script(), "warm", "claim", safe_username],
+                                      timeout=self.claim_timeout)
+                if result.exit_code != 0:
+                    raise RuntimeError(f"exit {result.exit_code}: {(result.stderr or result.stdout).strip()}")
+                runtime.rename(slot.name, cname)
+            except Exception as e:
+                WARM_POOL_CLAIMS.labels(result='error').inc()
+                logger.error(f"Warm pool: binding {slot.name} to {safe_username} failed: {e}")
+                self._discard(slot.name, "claim failed")
+                continue
+            container_readiness.mark_starting(cname)
+            WARM_POOL_CLAIMS.labels(result='hit').inc()
+            WARM_POOL_CLAIM_SECONDS.observe(time.monotonic() - started)
+            logger.info(f"Warm container {slot.name} claimed as {cname}")
+            return slot
+
+    def stats(self):
+        return {'target': self.target_size, 'ready': len(self._ready), 'starting': len(self._starting)}
+
+
+warm_pool = WarmContainerPool(
+    target_size=SYSTEM_CONFIG['WARM_POOL_SIZE'],
+    refill_interval=SYSTEM_CONFIG['WARM_POOL_REFILL_INTERVAL'],
+    start_timeout=SYSTEM_CONFIG['WARM_POOL_START_TIMEOUT'],
+    claim_timeout=SYSTEM_CONFIG['WARM_POOL_CLAIM_TIMEOUT'],
+)
@@ -1,12 +1,20 @@
 """
 Workspace Manager Service
-Handles file operations inside user's container via SSH/SFTP.
+Handles file operations inside user's workspace through a storage backend
+(SFTP into the container or the host bind mount, see workspace_storage).
 Extracts business logic from Fat Controllers to adhere to Clean Code.
 """
 import os
-import stat
+import time
+import codecs
+import hashlib
+import threading
 import logging
-from config.settings import HIDDEN_SYSTEM_FILES
+from collections import OrderedDict
+from prometheus_client import Counter, Gauge, Histogram
+from config.settings import HIDDEN_SYSTEM_FILES, EXCLUDED_DIRS, SOURCE_FILE_EXTENSIONS, SYSTEM_CONFIG
+from services.workspace_storage import add_change_listener
+from services.fs_watcher import InotifyWatcher
 
 logger = logging.getLogger(__name__)
 
@@ -14,29 +22,200 @@ logger = logging.getLogger(__name__)
 # but using the one from utils.helpers is better.
 from utils.helpers import is_safe_path
 
-def list_workspace_files(username, safe_username, sftp, target_path="."):
-    """List files in the user's workspace directory."""
+# ==================== LISTING CACHE ====================
+
+LISTING_CACHE_REQUESTS = Counter('workspace_listing_cache_requests_total',
+                                 'Directory listings by cache outcome (hit/miss/stale)', ['result'])
+LISTING_CACHE_ENTRIES = Gauge('workspace_listing_cache_entries', 'Cached directory listings')
+
+
+def _cache_path(rel_path):
+    return os.path.normpath((rel_path or '.').lstrip('/') or '.')
+
+
+class _CachedListing:
+    __slots__ = ('files', 'version', 'cached_at', 'watched')
+
+    def __init__(self, files, version, watched):
+        self.files = files
+        self.version = version
+        self.cached_at = time.monotonic()
+        self.watched = watched
+
+
+class DirectoryListingCache:
+    """Size-bounded LRU of directory listings keyed by (safe_username, path).
+
+    Entries are dropped on writes made through a workspace backend. Changes
+    made elsewhere (terminal, compiler) are caught by inotify when the backend
+    exposes a host path, otherwise by comparing the directory mtime plus a
+    short TTL.
+    """
+
+    def __init__(self, max_entries, ttl, watched_ttl, watcher_factory=InotifyWatcher):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.watched_ttl = watched_ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._watcher_factory = watcher_factory
+        self._watcher = None
+
+    def _get_watcher(self):
+        if self._watcher is None and self._watcher_factory is not None:
+            self._watcher = self._watcher_factory(self._on_watch_event, self.clear)
+            if not self._watcher.available:
+                logger.info("inotify not available, listing cache falls back to mtime checks")
+        return self._watcher
+
+    def _unwatch(self, keys):
+        if self._watcher is not None:
+            for key in keys:
+                self._watcher.unwatch(key)
+
+    def _drop_locked(self, keys):
+        for key in keys:
+            self._entries.pop(key, None)
+        LISTING_CACHE_ENTRIES.set(len(self._entries))
+
+    def _lookup(self, fs, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        age = time.monotonic() - entry.cached_at
+        if entry.watched:
+            fresh = age < self.watched_ttl and self._watcher.is_watched(key)
+        else:
+            try:
+                fresh = age < self.ttl and fs.dir_version(key[1]) == entry.version
+            except Exception:
+                fresh = False
+        if fresh:
+            return entry.files
+        with self._lock:
+            if self._entries.get(key) is entry:
+                self._drop_locked([key])
+        self._unwatch([key])
+        LISTING_CACHE_REQUESTS.labels(result='stale').inc()
+        return None
+
+    def _prepare(self, fs, key):
+        """Start watching / read the version BEFORE listing so no change is missed"""
+        host_path = fs.host_path(key[1])
+        watcher = self._get_watcher() if host_path else None
+        if watcher is not None and watcher.watch(host_path, key):
+            return True, None
+        version = fs.dir_version(key[1])
+        # mtime của SFTP chỉ chính xác tới giây: thư mục vừa đổi thì chưa tin được
+        if time.time() - version < 1.0:
+            version = None
+        return False, version
+
+    def get_or_load(self, fs, rel_path, load):
+        """Return the cached listing of rel_path or call load() and cache it"""
+        if fs.owner is None:
+            return load()
+        key = (fs.owner, _cache_path(rel_path))
+        files = self._lookup(fs, key)
+        if files is not None:
+            LISTING_CACHE_REQUESTS.labels(result='hit').inc()
+            return files
+        LISTING_CACHE_REQUESTS.labels(result='miss').inc()
+
+        with self._lock:
+            generation = self._generations.get(fs.owner, 0)
+        watched, version = self._prepare(fs, key)
+        try:
+            files = load()
+        except BaseException:
+            if watched:
+                self._unwatch([key])
+            raise
+        if not watched and version is None:
+            return files
+
+        evicted = []
+        with self._lock:
+            # Có ghi xen giữa lúc đang liệt kê: kết quả có thể đã cũ, không cache
+            if self._generations.get(fs.owner, 0) == generation:
+                self._entries[key] = _CachedListing(files, version, watched)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._entries.popitem(last=False)[0])
+                LISTING_CACHE_ENTRIES.set(len(self._entries))
+            elif watched:
+                evicted.append(key)
+        self._unwatch(evicted)
+        return files
+
+    def invalidate(self, owner, rel_path):
+        """Drop the listing of rel_path's parent, rel_path itself and everything below it"""
+        path = _cache_path(rel_path)
+        parent = os.path.dirname(path) or '.'
+        with self._lock:
+            self._generations[owner] = self._generations.get(owner, 0) + 1
+            stale = [
+                key for key in self._entries
+                if key[0] == owner and (
+                    path == '.' or key[1] in (path, parent) or key[1].startswith(path + '/'))
+            ]
+            self._drop_locked(stale)
+        self._unwatch(stale)
+
+    def _on_watch_event(self, key):
+        with self._lock:
+            self._generations[key[0]] = self._generations.get(key[0], 0) + 1
+            self._drop_locked([key])
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+            for owner in self._generations:
+                self._generations[owner] += 1
+            self._drop_locked(keys)
+        self._unwatch(keys)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+listing_cache = DirectoryListingCache(
+    max_entries=SYSTEM_CONFIG['LISTING_CACHE_MAX_ENTRIES'],
+    ttl=SYSTEM_CONFIG['LISTING_CACHE_TTL'],
+    watched_ttl=SYSTEM_CONFIG['LISTING_CACHE_WATCHED_TTL'],
+)
+add_change_listener(listing_cache.invalidate)
+
+
+def _load_listing(fs, target_path):
+    files = []
+    for entry in fs.list_dir(target_path):
+        filename = entry.name
+        if filename.startswith('.') or filename in HIDDEN_SYSTEM_FILES or ':' in filename:
+            continue
+
+        files.append({
+            'name': filename, 
+            'is_dir': entry.is_dir, 
+            'size': entry.size, 
+            'modified': entry.mtime
+        })
+
+    files.sort(key=lambda x: (not x['is_dir'], x['name']))
+    return files
+
+
+def list_workspace_files(username, safe_username, fs, target_path="."):
+    """List files in the user's workspace directory (served from listing_cache when fresh)."""
     try:
-        base_path = os.path.join("/home", safe_username, target_path)
-        files = []
         try:
-            dir_items = sftp.listdir_attr(base_path)
+            files = listing_cache.get_or_load(fs, target_path, lambda: _load_listing(fs, target_path))
         except FileNotFoundError:
             return {"success": False, "error": "Directory not found", "status_code": 404}
-            
-        for attr in dir_items:
-            filename = attr.filename
-            if filename.startswith('.') or filename in HIDDEN_SYSTEM_FILES or ':' in filename:
-                continue
-
-            files.append({
-                'name': filename, 
-                'is_dir': stat.S_ISDIR(attr.st_mode), 
-                'size': attr.st_size, 
-                'modified': attr.st_mtime
-            })
-        
-        files.sort(key=lambda x: (not x['is_dir'], x['name']))
+
         return {"success": True, "files": files, "path": target_path}
 
     except Exception as e:
@@ -44,35 +223,397 @@ def list_workspace_files(username, safe_username, sftp, target_path="."):
         return {"success": False, "error": str(e), "status_code": 500}
 
 
-def load_workspace_file(username, safe_username, sftp, relative_path, filename):
-    """Read a file from user's workspace."""
+def build_workspace_manifest(fs, target_path=".", max_depth=None, extensions=None):
+    """Whole filtered tree of target_path in one backend call.
+
+    Returns [{name, path, size, modified, is_dir, type, partial}] sorted by
+    path, with paths in the '/dir/file' form used by submissions. Directories
+    in EXCLUDED_DIRS or at the depth limit are listed with partial=True (their
+    content is not included). extensions=None keeps every entry, otherwise
+    only files with one of these suffixes are returned.
+    """
+    max_depth = max_depth or SYSTEM_CONFIG['WORKSPACE_TREE_MAX_DEPTH']
+    base = _cache_path(target_path)
+    prefix = '/' if base == '.' else f"/{base}/"
+    manifest = []
+    for path, entry in fs.walk_tree(target_path, max_depth, HIDDEN_SYSTEM_FILES, EXCLUDED_DIRS):
+        if ':' in path:
+            continue
+        if extensions is not None and (entry.is_dir or not entry.name.endswith(extensions)):
+            continue
+        manifest.append({
+            'name': entry.name,
+            'path': prefix + path,
+            'size': entry.size,
+            'modified': entry.mtime,
+            'is_dir': entry.is_dir,
+            'type': 'dir' if entry.is_dir else 'file',
+            'partial': entry.is_dir and (entry.name in EXCLUDED_DIRS or path.count('/') + 1 >= max_depth),
+        })
+    manifest.sort(key=lambda x: x['path'])
+    return manifest
+
+
+def list_source_files(fs):
+    """Source files considered part of a submission (preview + snapshot)"""
+    return build_workspace_manifest(fs, '.', extensions=SOURCE_FILE_EXTENSIONS)
+
+
+# ==================== SUBMISSION SNAPSHOT ====================
+
+SNAPSHOT_SECONDS = Histogram('submission_snapshot_seconds', 'Time to snapshot a workspace on mission submit',
+                             buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+SNAPSHOT_CHUNK = 64 * 1024
+
+
+def snapshot_source_files(fs, content_limit=None, total_limit=None):
+    """Snapshot the submission source files as one stream.
+
+    Returns (files, elapsed_ms). Every file gets {name, path, size, sha256,
+    content, truncated}; the hash covers the whole file while content keeps at
+    most content_limit bytes, and no more than total_limit bytes of content
+    are kept for the whole submission.
+    """
+    content_limit = content_limit or SYSTEM_CONFIG['SUBMISSION_FILE_CONTENT_LIMIT']
+    total_limit = total_limit or SYSTEM_CONFIG['SUBMISSION_SNAPSHOT_MAX_BYTES']
+    started = time.monotonic()
+    manifest = list_source_files(fs)
+    files = []
+    kept = 0
+    for rel_path, f in fs.iter_files(m['path'] for m in manifest):
+        digest = hashlib.sha256()
+        head = bytearray()
+        size = 0
+        limit = max(0, min(content_limit, total_limit - kept))
+        while True:
+            chunk = f.read(SNAPSHOT_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            if len(head) < limit:
+                head += chunk[:limit - len(head)]
+        kept += len(head)
+        files.append({
+            'name': os.path.basename(rel_path),
+            'path': f"/{rel_path}",
+            'content': head.decode('utf-8', errors='replace'),
+            'size': size,
+            'sha256': digest.hexdigest(),
+            'truncated': len(head) < size,
+        })
+    elapsed = time.monotonic() - started
+    SNAPSHOT_SECONDS.observe(elapsed)
+    return files, int(elapsed * 1000)
+
+
+# ==================== EDITOR LOAD / SAVE ====================
+
+_save_locks = {}
+_save_locks_guard = threading.Lock()
+
+
+def file_version(data):
+    """ETag of a file's bytes, sent back by the editor as base_version"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def _save_lock(safe_username, rel_path):
+    key = (safe_username, _cache_path(rel_path))
+    with _save_locks_guard:
+        lock = _save_locks.get(key)
+        if lock is None:
+            if len(_save_locks) > 10000:
+                _save_locks.clear()
+            lock = _save_locks[key] = threading.Lock()
+        return lock
+
+
+def apply_text_patch(text, patch):
+    """Apply [{start, end, text}] splices to text.
+
+    Offsets are UTF-16 code units of the base text (what the browser editor
+    counts), sorted and non-overlapping.
+    """
+    units = text.encode('utf-16-le')
+    out = []
+    pos = 0
+    for op in patch:
+        start, end = int(op['start']), int(op['end'])
+        if start < pos or end < start or end * 2 > len(units):
+            raise ValueError("Invalid patch range")
+        out.append(units[pos * 2:start * 2])
+        out.append(str(op.get('text') or '').encode('utf-16-le'))
+        pos = end
+    out.append(units[pos * 2:])
+    return b''.join(out).decode('utf-16-le')
+
+
+def is_binary_content(head):
+    """NUL bytes or invalid UTF-8 in the first bytes of a file -> not editable text"""
+    if b'\0' in head:
+        return True
+    try:
+        # final=False: ký tự nhiều byte bị cắt ở cuối đoạn đầu không tính là lỗi
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return False
+    except UnicodeDecodeError:
+        return True
+
+
+def load_workspace_file(username, safe_username, fs, relative_path, filename):
+    """Read a text file from user's workspace (content + version ETag).
+
+    Files over MAX_WORKSPACE_FILE_SIZE are refused before reading (413) and
+    binary files come back as {binary: True} without content; both should be
+    fetched through the streamed download instead.
+    """
     home_dir = f"/home/{safe_username}"
     filepath = os.path.join(home_dir, relative_path, filename)
 
     if not is_safe_path(home_dir, filepath):
         return {"success": False, "error": "Invalid file path", "status_code": 400}
 
+    rel_path = os.path.join(relative_path, filename)
     try:
-        with sftp.open(filepath, 'r') as f: 
-            content = f.read().decode('utf-8', errors='ignore')
-        return {"success": True, "content": content}
+        size = fs.stat(rel_path).size
+        if size > SYSTEM_CONFIG['MAX_WORKSPACE_FILE_SIZE']:
+            return {"success": False, "error": "File quá lớn để mở trong editor", "status_code": 413, "size": size}
+        data = fs.read_bytes(rel_path)
+        if is_binary_content(data[:8192]):
+            return {"success": True, "binary": True, "size": len(data), "version": file_version(data)}
+        return {"success": True, "content": data.decode('utf-8', errors='ignore'), "version": file_version(data)}
+    except FileNotFoundError:
+        return {"success": False, "error": "File not found", "status_code": 404}
     except Exception as e: 
         logger.error(f"Workspace Manager Load File Error: {e}")
         return {"success": False, "error": str(e), "status_code": 500}
 
 
-def save_workspace_file(username, safe_username, sftp, relative_path, filename, content):
-    """Write content to a file in user's workspace."""
+def save_workspace_file(username, safe_username, fs, relative_path, filename, content=None,
+                        base_version=None, patch=None):
+    """Write content to a file in user's workspace.
+
+    base_version: reject with 409 when the file changed since it was loaded.
+    patch: splices applied to the current content instead of a full content
+    (requires base_version).
+    """
     home_dir = f"/home/{safe_username}"
     filepath = os.path.normpath(os.path.join(home_dir, relative_path, filename))
 
     if not is_safe_path(home_dir, filepath):
         return {"success": False, "error": "Invalid file path", "status_code": 400}
+    if patch is not None and not base_version:
+        return {"success": False, "error": "Patch requires base_version", "status_code": 400}
 
+    rel_path = os.path.join(relative_path, filename)
     try:
-        with sftp.open(filepath, 'w') as f: 
-            f.write(content)
-        return {"success": True}
+        with _save_lock(safe_username, rel_path):
+            if base_version:
+                try:
+                    current = fs.read_bytes(rel_path)
+                except FileNotFoundError:
+                    current = None
+                current_version = file_version(current) if current is not None else None
+                if current_version != base_version:
+                    return {"success": False, "error": "File đã bị thay đổi ở nơi khác", "status_code": 409,
+                            "current_version": current_version}
+                if patch is not None:
+                    try:
+                        content = apply_text_patch(current.decode('utf-8', errors='ignore'), patch)
+                    except (ValueError, KeyError, TypeError) as e:
+                        return {"success": False, "error": str(e), "status_code": 400}
+
+            data = (content or '').encode('utf-8')
+            fs.write_bytes(rel_path, data)
+        return {"success": True, "version": file_version(data)}
     except Exception as e: 
         logger.error(f"Workspace Manager Save File Error: {e}")
         return {"success": False, "error": str(e), "status_code": 500}
+
+
+# ==================== STREAMED DOWNLOAD / CHUNKED UPLOAD ====================
+
+STREAM_CHUNK = 256 * 1024
+
+
+def stream_workspace_file(f, start, end):
+    """Yield bytes [start, end] of an open workspace file in chunks"""
+    f.seek(start)
+    if hasattr(f, 'prefetch'):
+        # SFTP: gửi trước các yêu cầu đọc song song thay vì chờ từng round-trip
+        f.prefetch(end + 1)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = f.read(min(STREAM_CHUNK, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def write_upload_chunk(fs, relative_path, filename, offset, total_size, stream):
+    """Append one chunk of a resumable upload.
+
+    Data goes to a hidden '.<name>.part' file next to the target and is
+    renamed into place once total_size bytes were received. An offset that
+    does not match what was already received returns 409 with 'received' so
+    the client can resume from there.
+    """
+    if total_size > SYSTEM_CONFIG['MAX_UPLOAD_FILE_SIZE']:
+        return {"success": False, "error": "File vượt quá dung lượng cho phép", "status_code": 413}
+
+    target = os.path.join(relative_path, filename)
+    part = os.path.join(relative_path, f".{filename}.part")
+    received = 0
+    if offset:
+        try:
+            received = fs.stat(part).size
+        except FileNotFoundError:
+            pass
+    if offset != received:
+        return {"success": False, "error": "Offset mismatch", "status_code": 409, "received": received}
+
+    written = 0
+    with fs.open_write(part, offset) as f:
+        while True:
+            chunk = stream.read(STREAM_CHUNK)
+            if not chunk:
+                break
+            written += len(chunk)
+            if offset + written > total_size:
+                break
+            f.write(chunk)
+    if offset + written > total_size:
+        fs.remove(part)
+        return {"success": False, "error": "Upload lớn hơn total_size", "status_code": 400}
+
+    received = offset + written
+    if received < total_size:
+        return {"success": True, "received": received, "complete": False}
+    if fs.exists(target):
+        fs.remove(target)
+    fs.rename(part, target)
+    return {"success": True, "received": received, "complete": True}
+
+
+# ==================== BATCH OPERATIONS ====================
+
+BATCH_OPERATIONS = ('create_folder', 'new_file', 'save', 'rename', 'delete')
+
+
+def _validate_batch_op(op, home_dir):
+    """Return (kind, error). Same rules as the single-operation endpoints."""
+    kind = op.get('op') if isinstance(op, dict) else None
+    if kind not in BATCH_OPERATIONS:
+        return kind, f"Unknown operation: {kind}"
+
+    path = op.get('path', '.')
+    if kind in ('create_folder', 'new_file', 'save') and not is_safe_path(home_dir, path):
+        return kind, "Invalid path"
+    if kind == 'create_folder':
+        name = op.get('folder_name')
+        if not name or not is_safe_path("/home", name):
+            return kind, "Invalid folder name"
+    elif kind in ('new_file', 'save'):
+        name = (op.get('filename') or '').strip()
+        if not name or '..' in name or '/' in name:
+            return kind, "Invalid file name"
+    elif kind == 'rename':
+        old_path, new_name = op.get('old_path'), op.get('new_name')
+        if not old_path or not new_name or '/' in new_name or '..' in new_name or not is_safe_path(home_dir, old_path):
+            return kind, "Invalid parameters"
+    elif kind == 'delete':
+        target = op.get('path')
+        if not target or not is_safe_path(home_dir, target) or os.path.normpath(os.path.join(home_dir, target)) == home_dir:
+            return kind, "Invalid path"
+    return kind, None
+
+
+def run_workspace_batch(username, safe_username, fs, operations, atomic=False):
+    """Run an ordered list of file operations over one workspace session.
+
+    atomic=False: every operation runs, each gets its own result.
+    atomic=True: stop at the first failure and undo what already ran, so the
+    workspace is left as before the batch. Deletes are moved to a hidden trash
+    folder first and only purged once the whole batch succeeded.
+    """
+    home_dir = f"/home/{safe_username}"
+    results = []
+    undo = []
+    trash_dir = None
+    failed = False
+
+    for index, op in enumerate(operations):
+        kind, error = _validate_batch_op(op, home_dir)
+        if not error:
+            try:
+                path = op.get('path', '.')
+                if kind == 'create_folder':
+                    target = os.path.join(path, op['folder_name'])
+                    fs.mkdir(target)
+                    undo.append(lambda t=target: fs.remove(t))
+                elif kind == 'new_file':
+                    filename = op['filename'].strip()
+                    if '.' not in filename:
+                        filename += '.ino'
+                    target = os.path.join(path, filename)
+                    if fs.exists(target):
+                        raise FileExistsError("File đã tồn tại")
+                    fs.write_bytes(target, (op.get('content') or '').encode('utf-8'))
+                    undo.append(lambda t=target: fs.remove(t))
+                elif kind == 'save':
+                    target = os.path.join(path, op['filename'].strip())
+                    previous = None
+                    if atomic:
+                        try:
+                            previous = fs.read_bytes(target)
+                        except FileNotFoundError:
+                            pass
+                    fs.write_bytes(target, (op.get('content') or '').encode('utf-8'))
+                    if previous is None:
+                        undo.append(lambda t=target: fs.remove(t))
+                    else:
+                        undo.append(lambda t=target, data=previous: fs.write_bytes(t, data))
+                elif kind == 'rename':
+                    old_path = op['old_path']
+                    new_path = os.path.join(os.path.dirname(old_path), op['new_name'])
+                    fs.rename(old_path, new_path)
+                    undo.append(lambda o=old_path, n=new_path: fs.rename(n, o))
+                elif kind == 'delete':
+                    target = op['path']
+                    if atomic:
+                        if trash_dir is None:
+                            trash_dir = f".batch-trash-{os.urandom(4).hex()}"
+                            fs.mkdir(trash_dir)
+                        parked = os.path.join(trash_dir, str(index))
+                        fs.rename(target, parked)
+                        undo.append(lambda t=target, p=parked: fs.rename(p, t))
+                    else:
+                        fs.remove(target)
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+
+        results.append({'index': index, 'op': kind, 'success': error is None, **({'error': error} if error else {})})
+        if error:
+            failed = True
+            if atomic:
+                break
+
+    rolled_back = False
+    if atomic and failed:
+        rolled_back = True
+        for action in reversed(undo):
+            try:
+                action()
+            except Exception as e:
+                rolled_back = False
+                logger.error(f"Workspace batch rollback step failed for {username}: {e}")
+    # Rollback dở dang thì giữ lại thùng rác để còn cứu được file đã xóa
+    if trash_dir and (not failed or rolled_back):
+        try:
+            fs.remove(trash_dir)
+        except Exception as e:
+            logger.error(f"Workspace batch trash cleanup failed for {username}: {e}")
+
+    return {"success": not failed, "results": results, "rolled_back": rolled_back}
@@ -0,0 +1,448 @@
+"""
+Workspace storage backends
+All paths are relative to the user's home directory. Two drivers:
+- SFTPWorkspaceBackend: goes through the pooled SSH session into the container
+- LocalWorkspaceBackend: reads the host bind mount (/home/<user> in the
+  container is <WORKSPACE_HOST_ROOT>/<user> on the host) with plain file I/O
+The driver is chosen per deployment with SYSTEM_CONFIG['WORKSPACE_BACKEND'].
+Every mutation is reported to the registered change listeners (listing cache).
+"""
+import os
+import stat
+import shlex
+import shutil
+import tarfile
+import tempfile
+import logging
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import contextmanager
+from config import SYSTEM_CONFIG
+from utils import make_safe_name, is_safe_path
+from services.ssh_manager import ssh_session
+from services import idle_reaper
+
+logger = logging.getLogger(__name__)
+
+WorkspaceEntry = namedtuple('WorkspaceEntry', ['name', 'is_dir', 'size', 'mtime'])
+
+_change_listeners = []
+
+
+def add_change_listener(listener):
+    """Call listener(owner, rel_path) after every write made through a backend"""
+    _change_listeners.append(listener)
+
+
+def get_host_user_dir(safe_username):
+    """Host directory bind-mounted as /home/<user> inside the user's container"""
+    return os.path.join(SYSTEM_CONFIG['WORKSPACE_HOST_ROOT'], safe_username)
+
+
+def _relative(rel_path):
+    """'/a/b' and 'a/b' both mean <home>/a/b (same rule as is_safe_path)"""
+    return (rel_path or '.').lstrip('/') or '.'
+
+
+class WorkspaceBackend(ABC):
+    """Interface of a workspace storage driver (paths relative to the home dir)"""
+    name = 'base'
+    owner = None
+
+    def _changed(self, *rel_paths):
+        if self.owner is None:
+            return
+        for rel_path in rel_paths:
+            for listener in _change_listeners:
+                try:
+                    listener(self.owner, rel_path)
+                except Exception as e:
+                    logger.error(f"Workspace change listener failed: {e}")
+
+    @abstractmethod
+    def list_dir(self, rel_path):
+        """Return [WorkspaceEntry]; raise FileNotFoundError if missing"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def stat(self, rel_path):
+        """Return WorkspaceEntry; raise FileNotFoundError if missing"""
+        raise NotImplementedError
+
+    def dir_version(self, rel_path):
+        """Modification time of a directory, used to validate cached listings"""
+        return self.stat(rel_path).mtime
+
+    def host_path(self, rel_path):
+        """Path on this host's filesystem, or None when not locally mounted"""
+        return None
+
+    @abstractmethod
+    def walk_tree(self, rel_path, max_depth, skip_names, prune_names=()):
+        """Return [(path relative to rel_path, WorkspaceEntry)] for the whole tree.
+
+        Names starting with '.' or in skip_names are left out entirely; entries
+        in prune_names are reported but not descended into. Symlinks are
+        reported as files and never followed.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_files(self, rel_paths):
+        """Yield (rel_path, readable file object) for each file, streaming.
+
+        Each file object is only valid until the next item is requested.
+        Missing files are skipped.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def open_read(self, rel_path):
+        """Seekable binary file object for streaming a file"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def open_write(self, rel_path, offset=0):
+        """Binary file object positioned at offset; offset=0 truncates"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_bytes(self, rel_path, limit=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_bytes(self, rel_path, data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def upload(self, fileobj, rel_path):
+        raise NotImplementedError
+
+    @abstractmethod
+    def mkdir(self, rel_path):
+        raise NotImplementedError
+
+    @abstractmethod
+    def rename(self, old_rel_path, new_rel_path):
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove(self, rel_path):
+        """Delete a file or a whole directory tree"""
+        raise NotImplementedError
+
+    def exists(self, rel_path):
+        try:
+            self.stat(rel_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def close(self):
+        pass
+
+
+# ================== SFTP (qua container) ==================
+class SFTPWorkspaceBackend(WorkspaceBackend):
+    name = 'sftp'
+
+    def __init__(self, client, home_dir, owner=None):
+        self.client = client
+        self.home_dir = home_dir
+        self.owner = owner
+        self._sftp = None
+
+    @property
+    def sftp(self):
+        # Chỉ mở kênh SFTP khi thật sự cần (remove() chỉ dùng exec)
+        if self._sftp is None:
+            self._sftp = self.client.open_sftp()
+        return self._sftp
+
+    def _abs(self, rel_path):
+        path = os.path.normpath(os.path.join(self.home_dir, _relative(rel_path)))
+        if not is_safe_path(self.home_dir, path):
+            raise PermissionError(f"Path outside workspace: {rel_path}")
+        return path
+
+    def list_dir(self, rel_path):
+        return [
+            WorkspaceEntry(attr.filename, stat.S_ISDIR(attr.st_mode), attr.st_size, attr.st_mtime)
+            for attr in self.sftp.listdir_attr(self._abs(rel_path))
+        ]
+
+    def stat(self, rel_path):
+        attr = self.sftp.stat(self._abs(rel_path))
+        return WorkspaceEntry(os.path.basename(rel_path), stat.S_ISDIR(attr.st_mode), attr.st_size, attr.st_mtime)
+
+    def walk_tree(self, rel_path, max_depth, skip_names, prune_names=()):
+        # Một lệnh find duy nhất thay vì một listdir_attr cho mỗi thư mục
+        def names(values):
+            return ' -o '.join(f'-name {shlex.quote(name)}' for name in sorted(values))
+
+        fmt = "-printf '%y\\t%s\\t%T@\\t%P\\0'"
+        cmd = (f"find {shlex.quote(self._abs(rel_path))} -mindepth 1 -maxdepth {int(max_depth)} "
+               f"\\( -name '.*' -o {names(skip_names) or '-false'} \\) -prune -o ")
+        if prune_names:
+            cmd += f"\\( {names(prune_names)} \\) -prune {fmt} -o "
+        cmd += fmt
+        stdin, stdout, stderr = self.client.exec_command(cmd)
+        output = stdout.read()
+        if stdout.channel.recv_exit_status() != 0 and not output:
+            error = stderr.read().decode(errors='replace').strip()
+            if 'No such file' in error:
+                raise FileNotFoundError(rel_path)
+            raise IOError(error)
+
+        tree = []
+        for record in output.split(b'\0'):
+            if not record:
+                continue
+            kind, size, mtime, path = record.decode('utf-8', errors='replace').split('\t', 3)
+            tree.append((path, WorkspaceEntry(path.rsplit('/', 1)[-1], kind == 'd', int(size), int(float(mtime)))))
+        return tree
+
+    def iter_files(self, rel_paths):
+        # Một luồng tar.gz duy nhất từ container thay vì mở từng file qua SFTP
+        rel_paths = [_relative(p) for p in rel_paths]
+        for p in rel_paths:
+            self._abs(p)
+        if not rel_paths:
+            return
+        stdin, stdout, stderr = self.client.exec_command(
+            f"tar -C {shlex.quote(self.home_dir)} --null --no-recursion --ignore-failed-read -T - -czf -")
+        stdin.write(b''.join(os.fsencode(p) + b'\0' for p in rel_paths))
+        stdin.channel.shutdown_write()
+        with tarfile.open(fileobj=stdout, mode='r|gz') as tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, tar.extractfile(member)
+        if stdout.channel.recv_exit_status() != 0:
+            logger.warning(f"tar snapshot of {self.home_dir}: {stderr.read().decode(errors='replace').strip()}")
+
+    def open_read(self, rel_path):
+        return self.sftp.open(self._abs(rel_path), 'rb')
+
+    def open_write(self, rel_path, offset=0):
+        f = self.sftp.open(self._abs(rel_path), 'r+b' if offset else 'wb')
+        # Không chờ ACK từng gói ghi
+        f.set_pipelined(True)
+        if offset:
+            f.seek(offset)
+        return f
+
+    def read_bytes(self, rel_path, limit=None):
+        with self.sftp.open(self._abs(rel_path), 'r') as f:
+            return f.read(limit) if limit else f.read()
+
+    def write_bytes(self, rel_path, data):
+        try:
+            with self.sftp.open(self._abs(rel_path), 'w') as f:
+                f.write(data)
+        finally:
+            self._changed(rel_path)
+
+    def upload(self, fileobj, rel_path):
+        try:
+            self.sftp.putfo(fileobj, self._abs(rel_path))
+        finally:
+            self._changed(rel_path)
+
+    def mkdir(self, rel_path):
+        self.sftp.mkdir(self._abs(rel_path))
+        self._changed(rel_path)
+
+    def rename(self, old_rel_path, new_rel_path):
+        self.sftp.rename(self._abs(old_rel_path), self._abs(new_rel_path))
+        self._changed(old_rel_path, new_rel_path)
+
+    def remove(self, rel_path):
+        full_path = self._abs(rel_path)
+        if full_path == self.home_dir:
+            raise PermissionError("Cannot delete root home")
+        try:
+            stdin, stdout, stderr = self.client.exec_command(f'rm -rf {shlex.quote(full_path)}')
+            if stdout.channel.recv_exit_status() != 0:
+                raise IOError(stderr.read().decode().strip())
+        finally:
+            # rm -rf lỗi giữa chừng vẫn có thể đã xóa một phần
+            self._changed(rel_path)
+
+    def close(self):
+        if self._sftp is not None:
+            self._sftp.close()
+            self._sftp = None
+
+
+# ================== LOCAL (bind mount trên host) ==================
+class LocalWorkspaceBackend(WorkspaceBackend):
+    name = 'local'
+
+    def __init__(self, root, owner=None):
+        self.root = os.path.realpath(root)
+        self.owner = owner
+
+    def _abs(self, rel_path, follow=True):
+        path = os.path.normpath(os.path.join(self.root, _relative(rel_path)))
+        # realpath: symlink do sinh viên tạo trong container không được trỏ ra ngoài home trên host
+        check = os.path.realpath(path) if follow else os.path.join(os.path.realpath(os.path.dirname(path)), os.path.basename(path))
+        if check != self.root and not check.startswith(self.root + os.sep):
+            raise PermissionError(f"Path outside workspace: {rel_path}")
+        return path
+
+    def _match_owner(self, path):
+        """Files created by the API must stay writable by the container user"""
+        try:
+            st = os.stat(self.root)
+            os.chown(path, st.st_uid, st.st_gid)
+        except OSError:
+            pass
+
+    def list_dir(self, rel_path):
+        entries = []
+        with os.scandir(self._abs(rel_path)) as it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                entries.append(WorkspaceEntry(entry.name, stat.S_ISDIR(st.st_mode), st.st_size, int(st.st_mtime)))
+        return entries
+
+    def stat(self, rel_path):
+        st = os.stat(self._abs(rel_path))
+        return WorkspaceEntry(os.path.basename(rel_path), stat.S_ISDIR(st.st_mode), st.st_size, int(st.st_mtime))
+
+    def dir_version(self, rel_path):
+        return os.stat(self._abs(rel_path)).st_mtime
+
+    def host_path(self, rel_path):
+        return self._abs(rel_path)
+
+    def walk_tree(self, rel_path, max_depth, skip_names, prune_names=()):
+        tree = []
+
+        def scan(directory, prefix, depth):
+            try:
+                it = os.scandir(directory)
+            except (PermissionError, NotADirectoryError):
+                return
+            with it:
+                for entry in it:
+                    if entry.name.startswith('.') or entry.name in skip_names:
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    path = f"{prefix}{entry.name}"
+                    is_dir = stat.S_ISDIR(st.st_mode)
+                    tree.append((path, WorkspaceEntry(entry.name, is_dir, st.st_size, int(st.st_mtime))))
+                    if is_dir and depth < max_depth and entry.name not in prune_names:
+                        scan(entry.path, path + '/', depth + 1)
+
+        root = self._abs(rel_path)
+        if not os.path.isdir(root):
+            raise FileNotFoundError(rel_path)
+        scan(root, '', 1)
+        return tree
+
+    def iter_files(self, rel_paths):
+        for rel_path in rel_paths:
+            try:
+                path = self._abs(rel_path)
+                f = open(path, 'rb')
+            except (FileNotFoundError, PermissionError, IsADirectoryError):
+                continue
+            with f:
+                yield _relative(rel_path), f
+
+    def open_read(self, rel_path):
+        return open(self._abs(rel_path), 'rb')
+
+    def open_write(self, rel_path, offset=0):
+        path = self._abs(rel_path, follow=False)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW | (0 if offset else os.O_TRUNC)
+        fd = os.open(path, flags, 0o664)
+        if not offset:
+            self._match_owner(path)
+        f = os.fdopen(fd, 'wb')
+        f.seek(offset)
+        return f
+
+    def read_bytes(self, rel_path, limit=None):
+        with open(self._abs(rel_path), 'rb') as f:
+            return f.read(limit) if limit else f.read()
+
+    def write_bytes(self, rel_path, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        path = self._abs(rel_path, follow=False)
+        directory = os.path.dirname(path)
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o664
+        # Ghi ra file tạm rồi rename: trình biên dịch không bao giờ đọc phải file ghi dở
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.save-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp_path, mode)
+            self._match_owner(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._changed(rel_path)
+
+    def upload(self, fileobj, rel_path):
+        path = self._abs(rel_path, follow=False)
+        # O_NOFOLLOW: không ghi xuyên qua symlink ra ngoài workspace
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o664)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(fileobj, f, 1024 * 1024)
+            self._match_owner(path)
+        finally:
+            self._changed(rel_path)
+
+    def mkdir(self, rel_path):
+        path = self._abs(rel_path, follow=False)
+        os.mkdir(path)
+        self._match_owner(path)
+        self._changed(rel_path)
+
+    def rename(self, old_rel_path, new_rel_path):
+        os.rename(self._abs(old_rel_path, follow=False), self._abs(new_rel_path, follow=False))
+        self._changed(old_rel_path, new_rel_path)
+
+    def remove(self, rel_path):
+        path = self._abs(rel_path, follow=False)
+        if path == self.root:
+            raise PermissionError("Cannot delete root home")
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        finally:
+            self._changed(rel_path)
+
+
+@contextmanager
+def open_workspace(username):
+    """Yield the configured storage backend for a user's workspace"""
+    safe_username = make_safe_name(username)
+    idle_reaper.touch(username)
+    if SYSTEM_CONFIG['WORKSPACE_BACKEND'] == 'local':
+        yield LocalWorkspaceBackend(get_host_user_dir(safe_username), owner=safe_username)
+        return
+
+    with ssh_session(username) as client:
+        fs = SFTPWorkspaceBackend(client, f"/home/{safe_username}", owner=safe_username)
+        try:
+            yield fs
+        finally:
+            fs.close()
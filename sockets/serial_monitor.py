@@ -8,6 +8,7 @@ import time
 from flask import session, request
 from flask_socketio import emit
 from services.logger import log_action
+from services.compile_queue import compile_queue
 
 logger = logging.getLogger(__name__)
 
@@ -162,4 +163,14 @@ def register_upload_status_handlers(socketio):
         
         if username not in user_sids:
             user_sids[username] = []
-        user_sids[username].append(request.sid)
\ No newline at end of file
+        user_sids[username].append(request.sid)
+
+    @socketio.on('compile_subscribe', namespace='/upload_status')
+    def compile_subscribe(data):
+        """Follow a queued compile: 'compile_status' is emitted now and on every change"""
+        job_id = (data or {}).get('job_id')
+        job = compile_queue.get(job_id)
+        status = None
+        if job and job.username == session.get("username"):
+            status = compile_queue.subscribe(job_id, request.sid)
+        emit('compile_status', status or {'job_id': job_id, 'state': 'unknown'})
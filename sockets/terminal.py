@@ -4,7 +4,7 @@ Terminal Socket.IO handlers
 import logging
 from flask import session, request
 from flask_socketio import emit
-from services import get_ssh_client, log_action
+from services import get_ssh_client, log_action, idle_reaper
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +19,7 @@ def register_terminal_handlers(socketio):
 
         username = session['username']
         sid = request.sid 
+        idle_reaper.touch(username)
         
         try:
             client = get_ssh_client(username)
@@ -58,6 +59,7 @@ def register_terminal_handlers(socketio):
     def terminal_input(data):
         """Handle terminal input"""
         if 'ssh_chan' in session and session['ssh_chan'].active:
+            idle_reaper.touch(session.get('username', ''))
             try:
                 if isinstance(data, str):
                     session['ssh_chan'].send(data)
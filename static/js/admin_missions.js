@@ -595,6 +595,19 @@
                 return `<span class="badge ${cls}">${done}/${total} (${pct}%)</span>`;
             }
 
+            function provisionBadge(m) {
+                const p = m.provisioning;
+                if (!p) return '';
+                const failed = p.failed.map(f => `${f.username}: ${f.error}`).join('\n');
+                if (p.running) {
+                    return `<div class="small text-info mt-1"><i class="fa-solid fa-spinner fa-spin"></i> Đang chuẩn bị môi trường ${p.done}/${p.total}</div>`;
+                }
+                const cls = p.failed.length ? 'text-danger' : 'text-success';
+                return `<div class="small ${cls} mt-1" title="${escapeHtml(failed)}">
+                    <i class="fa-solid fa-server"></i> Môi trường sẵn sàng ${p.ok}/${p.total}${p.failed.length ? ` (${p.failed.length} lỗi)` : ''}
+                </div>`;
+            }
+
             function phaseSectionRow(label, color) {
                 return `<tr style="background:rgba(255,255,255,0.03);">
                     <td colspan="8" style="padding:0.4rem 0.8rem;font-size:0.72rem;font-weight:700;text-transform:uppercase;letter-spacing:.08em;color:${color};border-bottom:1px solid rgba(255,255,255,0.07);">
@@ -607,7 +620,7 @@
                 const faded = isFullySubmitted(m) ? 'opacity:0.55;' : '';
                 return `<tr style="${faded}">
                     <td>#${m.id}</td>
-                    <td><strong>${escapeHtml(m.name)}</strong></td>
+                    <td><strong>${escapeHtml(m.name)}</strong>${provisionBadge(m)}</td>
                     <td><span class="badge bg-secondary">${m.type.toUpperCase()}</span></td>
                     <td>${m.start_time ? new Date(m.start_time).toLocaleString('vi-VN') : ''}</td>
                     <td>${m.end_time ? new Date(m.end_time).toLocaleString('vi-VN') : ''}</td>
@@ -615,6 +628,7 @@
                     <td>${progressBadge(m)}</td>
                     <td class="text-end">
                         <button class="btn btn-sm btn-info" onclick="editMission(${m.id})" title="Chỉnh sửa"><i class="fa-solid fa-edit"></i></button>
+                        <button class="btn btn-sm btn-warning" onclick="provisionMission(${m.id})" title="Chuẩn bị môi trường cho sinh viên" ${m.provisioning && m.provisioning.running ? 'disabled' : ''}><i class="fa-solid fa-server"></i></button>
                         <button class="btn btn-sm btn-danger" onclick="deleteMission(${m.id})" title="Xóa bài thi"><i class="fa-solid fa-trash"></i></button>
                         <button class="btn btn-sm btn-success" onclick="exportMission(${m.id}, '${escapeHtml(m.name)}')">
                             <i class="fa-solid fa-file-excel"></i> Xuất
@@ -670,6 +684,31 @@
         window.scrollTo({top: 0, behavior: 'smooth'});
     };
 
+    // Chuẩn bị trước container + thư mục bài cho toàn bộ sinh viên được giao
+    window.provisionMission = async function(id) {
+        try {
+            const res = await fetch(`/admin/api/missions/${id}/provision`, {method: 'POST'});
+            const data = await res.json();
+            if (!data.success) {
+                showNotification(data.error, 'error');
+                return;
+            }
+            showNotification(`Đang chuẩn bị môi trường cho ${data.progress.total} sinh viên...`, 'info');
+            loadMissionsTable();
+            const timer = setInterval(async () => {
+                const r = await fetch(`/admin/api/missions/${id}/provision`);
+                const p = (await r.json()).progress;
+                loadMissionsTable();
+                if (!p || p.running) return;
+                clearInterval(timer);
+                if (p.failed.length) showNotification(`Chuẩn bị xong ${p.ok}/${p.total}, ${p.failed.length} lỗi`, 'error');
+                else showNotification(`Đã chuẩn bị xong môi trường cho ${p.total} sinh viên`, 'success');
+            }, 3000);
+        } catch(e) {
+            showNotification('Lỗi khi chuẩn bị môi trường', 'error');
+        }
+    };
+
     window.deleteMission = async function(id) {
         const result = await Swal.fire({
             title: 'Cảnh báo!',
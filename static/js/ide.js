@@ -765,25 +765,62 @@ function getFileIcon(filename) {
     return { icon: iconClass, color: '' };
 }
 
+// Nội dung thư mục lấy sẵn từ /files/tree (một request cho cả cây), dùng một lần khi mở thư mục.
+// Chỉ lấy ở lần tải đầu: các lần làm mới sau đi qua /files (có listing cache phía server)
+let prefetchedTree = new Map();
+let fileTreePrefetched = false;
+
+async function prefetchFileTree() {
+    prefetchedTree = new Map();
+    try {
+        const data = await apiCall(`/user/${username}/files/tree`);
+        prefetchedTree.set('.', []);
+        data.files.forEach(item => {
+            const rel = item.path.replace(/^\//, '');
+            const parent = rel.includes('/') ? rel.slice(0, rel.lastIndexOf('/')) : '.';
+            if (!prefetchedTree.has(parent)) prefetchedTree.set(parent, []);
+            prefetchedTree.get(parent).push(item);
+            // Thư mục bị cắt (libraries, quá sâu) sẽ tải bằng /files khi mở
+            if (item.is_dir && !item.partial && !prefetchedTree.has(rel)) prefetchedTree.set(rel, []);
+        });
+    } catch (e) {
+        prefetchedTree = new Map();
+    }
+}
+
 async function refreshRootFiles() {
     DOM.fileTreeRoot.innerHTML = '<div style="padding: 8px; color: #888;"><i>Loading...</i></div>';
     DOM.refreshIcon.classList.add('fa-spin');
     try {
-        await loadFolderContents('.', DOM.fileTreeRoot);
+        const firstLoad = !fileTreePrefetched;
+        if (firstLoad) {
+            fileTreePrefetched = true;
+            await prefetchFileTree();
+        } else {
+            prefetchedTree = new Map();     // nội dung lấy sẵn có thể đã cũ
+        }
+        await loadFolderContents('.', DOM.fileTreeRoot, firstLoad);
     } finally {
         DOM.refreshIcon.classList.remove('fa-spin');
     }
 }
 
-async function loadFolderContents(path, parentElement) {
+async function loadFolderContents(path, parentElement, usePrefetched = false) {
     try {
-        const data = await apiCall(`/user/${username}/files`, {
-            method: "POST", headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ path: path })
-        });
+        let files;
+        if (usePrefetched && prefetchedTree.has(path)) {
+            files = prefetchedTree.get(path).sort((a, b) => (b.is_dir - a.is_dir) || a.name.localeCompare(b.name));
+            prefetchedTree.delete(path);
+        } else {
+            const data = await apiCall(`/user/${username}/files`, {
+                method: "POST", headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ path: path })
+            });
+            files = data.files;
+        }
         parentElement.innerHTML = '';
-        if (data.files?.length > 0) {
-            data.files.forEach(item => parentElement.appendChild(createTreeItem(item, path)));
+        if (files?.length > 0) {
+            files.forEach(item => parentElement.appendChild(createTreeItem(item, path)));
         } else if (path !== '.') {
             parentElement.innerHTML = '<li style="padding-left: 20px; color: #888; font-style: italic;">(empty)</li>';
         }
@@ -821,7 +858,7 @@ function toggleFolder(liElement) {
             childUl = document.createElement('ul');
             liElement.appendChild(childUl);
         }
-        loadFolderContents(itemDiv.dataset.path, childUl);
+        loadFolderContents(itemDiv.dataset.path, childUl, true);
     }
 }
 
@@ -1008,16 +1045,43 @@ async function confirmDelete() {
         // Lỗi đã được xử lý trong hàm apiCall
     }
 }
+const UPLOAD_CHUNK_SIZE = 1024 * 1024;
+
+// Upload file lớn theo từng chunk 1MB (server ghép lại, gửi lại được từ offset đã nhận)
+async function uploadFileChunked(file, path) {
+    let offset = 0;
+    while (offset < file.size || offset === 0) {
+        const query = new URLSearchParams({ path, filename: file.name, offset, total_size: file.size });
+        const response = await fetch(`/user/${username}/upload-chunk?${query}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: file.slice(offset, offset + UPLOAD_CHUNK_SIZE)
+        });
+        const data = await response.json();
+        if (response.status === 409 && data.received !== undefined) { offset = data.received; continue; }
+        if (!response.ok || data.error) throw new Error(data.error || `HTTP error! status: ${response.status}`);
+        offset = data.received;
+        if (data.complete) return;
+    }
+}
+
 async function handleFileUpload(files) {
     if (files.length === 0) return;
     const formData = new FormData();
+    const largeFiles = [];
     for (const file of files) {
-        formData.append('files', file);
+        if (file.size > UPLOAD_CHUNK_SIZE) largeFiles.push(file);
+        else formData.append('files', file);
     }
     formData.append('path', uploadPath);
     showNotification(`Uploading ${files.length} file(s)...`, 'info');
     try {
-        await apiCall(`/user/${username}/upload-files`, { method: 'POST', body: formData });
+        if (formData.getAll('files').length > 0) {
+            await apiCall(`/user/${username}/upload-files`, { method: 'POST', body: formData });
+        }
+        for (const file of largeFiles) {
+            await uploadFileChunked(file, uploadPath);
+        }
         showNotification('Upload complete!', 'success');
         const parentFolderLi = document.querySelector(`.tree-item[data-path="${uploadPath}"]`)?.parentElement;
         if (uploadPath === '.' || !parentFolderLi) {
@@ -1026,7 +1090,9 @@ async function handleFileUpload(files) {
             const childUl = parentFolderLi.querySelector('ul');
             if (childUl) loadFolderContents(uploadPath, childUl);
         }
-    } catch (error) { }
+    } catch (error) {
+        showNotification(`Upload lỗi: ${error.message}`, 'error');
+    }
     DOM.fileUploadInput.value = '';
 }
 
@@ -1053,20 +1119,31 @@ async function openFile(fullPath, shortName, autoSwitch = true) {
     }
     const parentPath = fullPath.includes('/') ? fullPath.split('/').slice(0, -1).join('/') : '.';
     try {
-        const data = await apiCall(`/user/${username}/editor/load`, {
+        const response = await fetch(`/user/${username}/editor/load`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ filename: shortName, path: parentPath })
         });
+        const data = await response.json();
+        if (data.binary || response.status === 413) {
+            // File nhị phân hoặc quá lớn: tải về thay vì mở trong editor
+            showNotification(`${shortName} không mở được trong editor (${data.binary ? 'file nhị phân' : 'quá lớn'}), đang tải về...`, 'info');
+            window.open(data.download_url, '_blank');
+            return;
+        }
+        if (!response.ok || data.error) throw new Error(data.error || `HTTP error! status: ${response.status}`);
         openFiles.set(fullPath, {
             content: data.content,
+            version: data.version,
             saved: true,
             shortName,
             path: parentPath
         });
         if (autoSwitch) switchToFile(fullPath);
         else renderTabs();
-    } catch (error) { /* Error handled by apiCall */ }
+    } catch (error) {
+        showNotification(`API Error: ${error.message}`, 'error');
+    }
 }
 
 function switchToFile(fullPathKey) {
@@ -1160,25 +1237,52 @@ function performCloseTab(fullPathKey) {
     }
 }
 
-async function saveCurrentFile() {
+// Tạo patch một đoạn (phần đầu/cuối giống nhau được giữ nguyên), offset theo đơn vị UTF-16 của JS
+function buildTextPatch(base, content) {
+    let start = 0;
+    const maxStart = Math.min(base.length, content.length);
+    while (start < maxStart && base.charCodeAt(start) === content.charCodeAt(start)) start++;
+    let baseEnd = base.length, newEnd = content.length;
+    while (baseEnd > start && newEnd > start && base.charCodeAt(baseEnd - 1) === content.charCodeAt(newEnd - 1)) {
+        baseEnd--; newEnd--;
+    }
+    return [{ start, end: baseEnd, text: content.slice(start, newEnd) }];
+}
+
+async function saveCurrentFile(force = false) {
     if (!currentFile || currentFile === 'WELCOME.txt') return;
-    const fileData = openFiles.get(currentFile);
-    if (!fileData || fileData.saved) return;
+    const fileKey = currentFile;
+    const fileData = openFiles.get(fileKey);
+    if (!fileData || (fileData.saved && !force)) return;
     const content = editor.getValue();
+    const payload = { filename: fileData.shortName, path: fileData.path };
+    if (fileData.version && !force) {
+        payload.base_version = fileData.version;
+        payload.patch = buildTextPatch(fileData.content, content);
+    } else {
+        payload.content = content;
+    }
     try {
-        await apiCall(`/user/${username}/editor/save`, {
+        const response = await fetch(`/user/${username}/editor/save`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                filename: fileData.shortName,
-                content: content,
-                path: fileData.path
-            })
+            body: JSON.stringify(payload)
         });
+        const data = await response.json();
+        if (response.status === 409) {
+            // File đã bị sửa ở tab khác / terminal: không ghi đè âm thầm
+            if (confirm(`File "${fileData.shortName}" đã bị thay đổi ở nơi khác. Ghi đè bằng nội dung trong editor?`)) {
+                return saveCurrentFile(true);
+            }
+            showNotification(`Chưa lưu ${fileData.shortName}: file đã thay đổi ở nơi khác`, 'error');
+            return;
+        }
+        if (!response.ok || data.error) throw new Error(data.error || `HTTP error! status: ${response.status}`);
         fileData.content = content;
-        fileData.saved = true;
-        updateTabAppearance(currentFile);
-        DOM.saveButton.textContent = 'Save';
+        fileData.version = data.version;
+        fileData.saved = editor.getValue() === content || currentFile !== fileKey;
+        updateTabAppearance(fileKey);
+        if (currentFile === fileKey) DOM.saveButton.textContent = fileData.saved ? 'Save' : 'Save*';
         showNotification(`Saved ${fileData.shortName}`, 'success');
     } catch (error) {
         showNotification(`Lỗi lưu bài: ${error.message}`, 'error');
@@ -1241,10 +1345,14 @@ async function compileCode(event) {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ sketch_path: sketchPath, board_fqbn: boardFqbn })
         });
-        const data = await response.json();
+        let data = await response.json();
         if (!response.ok) {
             throw new Error(data.error || `Server responded with status ${response.status}`);
         }
+        if (response.status === 202) {
+            // Job đã vào hàng đợi biên dịch: chờ kết quả
+            data = await waitForCompileJob(data);
+        }
         if (data.success) {
             terminal.write(`\x1b[1;32m✓ Biên dịch thành công!\x1b[0m\r\n`);
             if (data.memory_analysis) {
@@ -1253,7 +1361,9 @@ async function compileCode(event) {
             showNotification('Biên dịch thành công!', 'success');
         } else {
             terminal.write(`\x1b[1;31m✗ Biên dịch thất bại!\x1b[0m\r\n`);
-            if (data.error_analysis) {
+            if (data.streamed_diagnostics) {
+                // Chi tiết lỗi đã hiện trong lúc biên dịch
+            } else if (data.error_analysis) {
                 writeErrorAnalysisToTerminal(data.error_analysis);
             } else {
                 // Lọc chỉ giữ lại dòng lỗi/cảnh báo có ý nghĩa
@@ -1284,8 +1394,9 @@ async function compileCode(event) {
                     terminal.write(`\x1b[90m${rawOutput.substring(0, 500)}\x1b[0m\r\n`);
                 }
             }
-            const errorCount = data.error_analysis ? data.error_analysis.error_count : 0;
-            const warningCount = data.error_analysis ? data.error_analysis.warning_count : 0;
+            const analysis = data.error_analysis || data.analysis;
+            const errorCount = analysis ? analysis.error_count : 0;
+            const warningCount = analysis ? analysis.warning_count || 0 : 0;
             showNotification(`Biên dịch thất bại! ${errorCount} lỗi, ${warningCount} cảnh báo`, 'error');
         }
     } catch (error) {
@@ -1303,6 +1414,68 @@ async function compileCode(event) {
     }
 }
 
+// Theo dõi job biên dịch: nhận 'compile_status' qua socket /upload_status, polling làm dự phòng
+function waitForCompileJob(job) {
+    return new Promise((resolve, reject) => {
+        let finished = false;
+        let lastState = null;
+        let poll = null;
+        let streamed = 0;
+        const stop = () => {
+            finished = true;
+            clearInterval(poll);
+            if (socketUpload) {
+                socketUpload.off('compile_status', onStatus);
+                socketUpload.off('compile_diagnostic', onDiagnostic);
+            }
+        };
+        // Lỗi/cảnh báo được đẩy ngay trong lúc biên dịch
+        const onDiagnostic = (event) => {
+            if (finished || event.job_id !== job.job_id) return;
+            streamed++;
+            writeDiagnosticToTerminal(event.diagnostic);
+        };
+        const onStatus = (status) => {
+            if (finished || status.job_id !== job.job_id) return;
+            if (status.state === 'done') {
+                stop();
+                resolve({ ...status.result, streamed_diagnostics: streamed });
+            } else if (status.state === 'unknown') {
+                stop();
+                reject(new Error('Không tìm thấy lượt biên dịch'));
+            } else if (status.state === 'queued' && lastState !== `queued-${status.position}`) {
+                lastState = `queued-${status.position}`;
+                terminal.write(`\x1b[90m[COMPILE] Đang chờ trong hàng đợi (vị trí ${status.position + 1})...\x1b[0m\r\n`);
+            } else if (status.state === 'running' && lastState !== 'running') {
+                lastState = 'running';
+                terminal.write(`\x1b[90m[COMPILE] Đang biên dịch...\x1b[0m\r\n`);
+            }
+        };
+        const socketReady = socketUpload && socketUpload.connected;
+        poll = setInterval(async () => {
+            try {
+                const response = await fetch(`/user/${username}/compile/${job.job_id}`);
+                const status = await response.json();
+                if (!response.ok) {
+                    throw new Error(status.error || `Server responded with status ${response.status}`);
+                }
+                onStatus(status);
+            } catch (error) {
+                if (!finished) {
+                    stop();
+                    reject(error);
+                }
+            }
+        }, socketReady ? 10000 : 2000);
+        if (socketReady) {
+            socketUpload.on('compile_status', onStatus);
+            socketUpload.on('compile_diagnostic', onDiagnostic);
+            socketUpload.emit('compile_subscribe', { job_id: job.job_id });
+        }
+        onStatus(job);
+    });
+}
+
 function writeMemoryUsageToTerminal(analysis) {
     const formatBytes = (bytes) => bytes.toLocaleString('en-US');
     const createProgressBar = (percent) => {
@@ -1340,6 +1513,22 @@ function writeErrorAnalysisToTerminal(analysis) {
     }
 }
 
+function writeDiagnosticToTerminal(diagnostic) {
+    const colors = { error: '\x1b[31m', warning: '\x1b[33m', note: '\x1b[36m' };
+    const indent = diagnostic.kind === 'note' ? '      ' : ' ';
+    (diagnostic.included_from || []).forEach((loc) => {
+        terminal.write(`${indent}\x1b[90mIn file included from ${loc}\x1b[0m\r\n`);
+    });
+    if (diagnostic.scope && diagnostic.kind !== 'note') {
+        terminal.write(`${indent}\x1b[90m${diagnostic.file}: ${diagnostic.scope}\x1b[0m\r\n`);
+    }
+    const position = diagnostic.column ? `${diagnostic.line}:${diagnostic.column}` : `${diagnostic.line}`;
+    terminal.write(`${indent}\x1b[33m${diagnostic.file}:${position}\x1b[0m ${colors[diagnostic.kind] || ''}${diagnostic.kind}:\x1b[0m ${diagnostic.message}\r\n`);
+    (diagnostic.context || []).forEach((line) => {
+        terminal.write(`${indent}\x1b[90m${line}\x1b[0m\r\n`);
+    });
+}
+
 // Logic Upload & Serial Monitor rác đã được dọn sạch để chuyển Server sang Full AI-Native
 
 function escapeHtml(text) {
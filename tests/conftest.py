@@ -0,0 +1,19 @@
+import pytest
+from config import SYSTEM_CONFIG
+from services.container_runtime import InMemoryRuntime, ExecResult, set_runtime
+
+
+@pytest.fixture
+def exec_handler():
+    """Trả lời exec của InMemoryRuntime; file test override để giả lập kết quả lệnh"""
+    return lambda name, cmd: ExecResult(0, '', '')
+
+
+@pytest.fixture
+def runtime(monkeypatch, exec_handler):
+    """InMemoryRuntime làm runtime hiện hành (không tạo build cache thật ở /srv)"""
+    monkeypatch.setitem(SYSTEM_CONFIG, 'ARDUINO_BUILD_CACHE_ROOT', '')
+    rt = InMemoryRuntime(exec_handler)
+    set_runtime(rt)
+    yield rt
+    set_runtime(None)
@@ -0,0 +1,43 @@
+from config import SYSTEM_CONFIG
+from services import arduino_shared
+
+
+def _library(path, version):
+    path.mkdir(parents=True)
+    (path / "library.properties").write_text(f"name={path.name}\nversion={version}\n")
+    (path / "src.cpp").write_bytes(b"x" * 1000)
+
+
+def test_container_options_use_shared_volume_once_exported(tmp_path, monkeypatch):
+    """Chỉ mount volume dùng chung (read-only) khi đã xuất xong (có manifest.json)."""
+    monkeypatch.setitem(SYSTEM_CONFIG, 'ARDUINO_SHARED_ROOT', str(tmp_path))
+    monkeypatch.setitem(SYSTEM_CONFIG, 'ARDUINO_SHARED_VERSION', 'v1')
+    volumes, env = arduino_shared.container_options()
+    assert "/root/.arduino15" in [v["bind"] for v in volumes.values()] and env == {}
+
+    (tmp_path / "v1").mkdir()
+    (tmp_path / "v1" / "manifest.json").write_text("{}")
+    volumes, env = arduino_shared.container_options()
+    assert volumes == {str(tmp_path / "v1"): {"bind": arduino_shared.SHARED_MOUNT, "mode": "ro"}}
+    assert env["ARDUINO_DIRECTORIES_BUILTIN_LIBRARIES"] == arduino_shared.SHARED_LIBRARIES_DIR
+
+
+def test_disk_usage_report_and_prune(tmp_path):
+    """Bản sao cũ trùng phiên bản bị tính là trùng lặp và xóa được; thư viện user tự cài được giữ."""
+    shared = tmp_path / "shared"
+    homes = tmp_path / "homes"
+    _library(shared / "libraries" / "PubSubClient", "2.8")
+    _library(homes / "alice" / "Arduino" / "libraries" / "PubSubClient", "2.8")
+    _library(homes / "bob" / "Arduino" / "libraries" / "PubSubClient", "2.7")
+    (homes / "carol").mkdir()
+
+    report = arduino_shared.disk_usage_report(str(homes), str(shared))
+    assert report['users'] == 3
+    assert report['duplicate_bytes'] > 0 and report['user_library_bytes'] > 0
+    assert report['saved_bytes'] == 2 * report['shared_library_bytes'] - report['duplicate_bytes']
+
+    pruned = arduino_shared.disk_usage_report(str(homes), str(shared), prune=True)
+    assert pruned['pruned_bytes'] == report['duplicate_bytes']
+    assert not (homes / "alice" / "Arduino" / "libraries" / "PubSubClient").exists()
+    assert (homes / "bob" / "Arduino" / "libraries" / "PubSubClient").exists()
+    assert pruned['saved_bytes'] == 2 * report['shared_library_bytes']
@@ -0,0 +1,80 @@
+import os
+import pytest
+from config import SYSTEM_CONFIG
+from services import build_cache, arduino_shared
+from services.build_cache import BuildCacheSession, BUILD_CACHE_MOUNT, BUILD_CACHE_SAVED_SECONDS
+
+
+@pytest.fixture
+def cache_root(tmp_path, monkeypatch):
+    monkeypatch.setitem(SYSTEM_CONFIG, 'ARDUINO_BUILD_CACHE_ROOT', str(tmp_path))
+    monkeypatch.setattr(arduino_shared, 'toolchain_fingerprint', lambda: '{"version": 1}')
+    return tmp_path
+
+
+def _warm_up(cache_root, session):
+    """Giả lập wrapper trong container: compile lạnh thành công thì đánh dấu .warm"""
+    os.makedirs(session.host_dir, exist_ok=True)
+    (cache_root / session.key / build_cache.WARM_MARKER).touch()
+
+
+def test_key_per_board_toolchain_and_flags(cache_root, monkeypatch):
+    """Cùng FQBN + toolchain + flags thì dùng chung cache; đổi một trong ba thì tách riêng."""
+    key = build_cache.cache_key("esp32:esp32:esp32")
+    assert build_cache.cache_key("esp32:esp32:esp32") == key
+    assert build_cache.cache_key("arduino:avr:uno") != key
+    assert build_cache.cache_key("esp32:esp32:esp32", ["-DDEBUG"]) != key
+    monkeypatch.setattr(arduino_shared, 'toolchain_fingerprint', lambda: '{"version": 2}')
+    assert build_cache.cache_key("esp32:esp32:esp32") != key
+
+
+def test_wrap_locks_shared_cache(cache_root):
+    """Lệnh compile chạy qua wrapper flock với thư mục cache của key trong container."""
+    session = BuildCacheSession("esp32:esp32:esp32")
+    cmd = session.wrap(["arduino-cli", "compile", "sketch"])
+    assert cmd[:2] == ["bash", "-c"] and "flock" in cmd[2]
+    assert cmd[4] == f"{BUILD_CACHE_MOUNT}/{session.key}"
+    assert cmd[5:] == ["arduino-cli", "compile", "sketch"]
+
+
+
+def test_only_workers_write_shared_cache(cache_root, tmp_path, monkeypatch):
+    """Container user chỉ mount cache chung read-only; compile trong container user dùng cache riêng trong home."""
+    assert build_cache.container_volumes() == {str(cache_root): {"bind": BUILD_CACHE_MOUNT, "mode": "ro"}}
+    assert build_cache.container_volumes(writable=True)[str(cache_root)]["mode"] == "rw"
+
+    monkeypatch.setitem(SYSTEM_CONFIG, 'WORKSPACE_HOST_ROOT', str(tmp_path / "workspaces"))
+    session = BuildCacheSession("esp32:esp32:esp32", owner="alice")
+    assert session.container_dir == f"/home/alice/{build_cache.USER_CACHE_DIR}/{session.key}"
+    assert session.host_dir == str(tmp_path / "workspaces" / "alice" / build_cache.USER_CACHE_DIR / session.key)
+    assert session.wrap(["arduino-cli"])[4] == session.container_dir
+
+
+def test_disabled_leaves_command_alone(monkeypatch):
+    """ARDUINO_BUILD_CACHE_ROOT rỗng: không mount, không bọc lệnh."""
+    monkeypatch.setitem(SYSTEM_CONFIG, 'ARDUINO_BUILD_CACHE_ROOT', '')
+    session = BuildCacheSession("esp32:esp32:esp32")
+    assert session.wrap(["arduino-cli", "compile", "x"]) == ["arduino-cli", "compile", "x"]
+    assert build_cache.container_volumes() == {}
+    assert session.done(True) == 0
+
+
+def test_warm_compile_reports_saved_time(cache_root, monkeypatch):
+    """Compile lạnh ghi thời gian gốc; compile ấm báo số giây tiết kiệm so với lần lạnh."""
+    clock = [100.0]
+    monkeypatch.setattr(build_cache.time, 'monotonic', lambda: clock[0])
+
+    cold = BuildCacheSession("esp32:esp32:esp32")
+    assert not cold.warm
+    _warm_up(cache_root, cold)
+    clock[0] += 90
+    assert cold.done(True) == 0
+
+    saved_before = BUILD_CACHE_SAVED_SECONDS._value.get()
+    warm = BuildCacheSession("esp32:esp32:esp32")
+    assert warm.warm
+    clock[0] += 15
+    assert warm.done(True) == pytest.approx(75)
+    assert BUILD_CACHE_SAVED_SECONDS._value.get() == pytest.approx(saved_before + 75)
+    # Compile lỗi không được tính
+    assert BuildCacheSession("esp32:esp32:esp32").done(False) == 0
@@ -0,0 +1,103 @@
+import os
+import pytest
+from config import SYSTEM_CONFIG
+from services.container_runtime import ExecResult
+from services.compile_cache import CompileCache, COMPILE_CACHE_REQUESTS
+from services import arduino, arduino_shared
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    root = tmp_path / "workspaces"
+    (root / "alice" / "blink").mkdir(parents=True)
+    (root / "alice" / "blink" / "blink.ino").write_text("void setup() {}\nvoid loop() {}\n")
+    monkeypatch.setitem(SYSTEM_CONFIG, 'WORKSPACE_HOST_ROOT', str(root))
+    return root
+
+
+@pytest.fixture
+def toolchain(monkeypatch):
+    manifest = {'value': '{"version": 1}'}
+    monkeypatch.setattr(arduino_shared, 'toolchain_fingerprint', lambda: manifest['value'])
+    return manifest
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = CompileCache(str(tmp_path / "cache"), max_bytes=10 * 1024 * 1024, max_entries=2)
+    monkeypatch.setattr(arduino, 'compile_cache', cache)
+    return cache
+
+
+@pytest.fixture
+def exec_handler():
+    return lambda name, cmd: ExecResult(0, "Sketch uses 1234 bytes\n", "")
+
+
+@pytest.fixture
+def runtime(runtime):
+    runtime.run("alice-dev", "my-dev-env:v2")
+    return runtime
+
+
+def _compiles(runtime):
+    return sum(1 for _, cmd in runtime.exec_calls if cmd[:2] == ["arduino-cli", "compile"])
+
+
+def test_unchanged_sketch_served_from_cache(workspace, toolchain, cache, runtime):
+    """Biên dịch lại mã không đổi trả kết quả cũ, không chạy arduino-cli."""
+    hits = COMPILE_CACHE_REQUESTS.labels(result='hit')._value.get()
+    first = arduino.compile_sketch("alice", "esp32:esp32:esp32", "blink.ino")
+    second = arduino.compile_sketch("alice", "esp32:esp32:esp32", "blink.ino")
+    assert _compiles(runtime) == 1
+    assert second['cached'] and second['output'] == first['output'] and second['analysis'] == first['analysis']
+    assert COMPILE_CACHE_REQUESTS.labels(result='hit')._value.get() == hits + 1
+
+
+def test_key_covers_sources_board_and_toolchain(workspace, toolchain, cache, runtime):
+    """Đổi mã nguồn, board hoặc phiên bản core/thư viện thì phải biên dịch lại."""
+    arduino.compile_sketch("alice", "esp32:esp32:esp32", "blink.ino")
+    (workspace / "alice" / "blink" / "blink.ino").write_text("void setup() { int x; }\nvoid loop() {}\n")
+    arduino.compile_sketch("alice", "esp32:esp32:esp32", "blink.ino")
+    arduino.compile_sketch("alice", "arduino:avr:uno", "blink.ino")
+    toolchain['value'] = '{"version": 2}'
+    arduino.compile_sketch("alice", "arduino:avr:uno", "blink.ino")
+    assert _compiles(runtime) == 4
+
+
+def test_infrastructure_errors_not_cached_and_lru_eviction(workspace, toolchain, cache, runtime):
+    """Lỗi không phải lỗi biên dịch không được cache; vượt số entry thì bỏ entry cũ nhất."""
+    runtime.exec_handler = lambda name, cmd: ExecResult(1, "", "Error: platform not installed\n")
+    arduino.compile_sketch("alice", "esp32:esp32:esp32", "blink.ino")
+    assert len(cache._index) == 0
+
+    runtime.exec_handler = lambda name, cmd: ExecResult(0, "ok\n", "")
+    keys = []
+    for fqbn in ("esp32:esp32:esp32", "arduino:avr:uno", "esp8266:esp8266:nodemcuv2"):
+        arduino.compile_sketch("alice", fqbn, "blink.ino")
+        keys.append(cache.key("alice", "blink.ino", fqbn))
+    assert list(cache._index) == keys[1:]
+    assert not (workspace.parent / "cache" / keys[0]).exists()
+
+
+def test_key_covers_user_and_library_sources(workspace, toolchain, cache):
+    """Cùng mã nhưng khác user thì khác key; sửa thư viện user mà không tăng version cũng đổi key."""
+    (workspace / "bob" / "blink").mkdir(parents=True)
+    (workspace / "bob" / "blink" / "blink.ino").write_text("void setup() {}\nvoid loop() {}\n")
+    assert cache.key("alice", "blink.ino", "esp32:esp32:esp32") != cache.key("bob", "blink.ino", "esp32:esp32:esp32")
+
+    lib = workspace / "alice" / "Arduino" / "libraries" / "MyLib"
+    (lib / "src").mkdir(parents=True)
+    (lib / "library.properties").write_text("name=MyLib\nversion=1.0.0\n")
+    (lib / "src" / "MyLib.h").write_text("#define VALUE 1\n")
+    before = cache.key("alice", "blink.ino", "esp32:esp32:esp32")
+    (lib / "src" / "MyLib.h").write_text("#define VALUE 22\n")
+    assert cache.key("alice", "blink.ino", "esp32:esp32:esp32") != before
+
+
+def test_key_with_non_utf8_file_name(workspace, toolchain, cache):
+    """Tên file không phải UTF-8 (tạo từ terminal) vẫn tính được key, không ném UnicodeEncodeError."""
+    folder = os.fsencode(workspace / "alice" / "blink")
+    with open(os.path.join(folder, b"\xff.h"), 'w') as f:
+        f.write("// x")
+    assert cache.key("alice", "blink.ino", "esp32:esp32:esp32")
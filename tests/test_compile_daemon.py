@@ -0,0 +1,116 @@
+import pytest
+from services import compile_daemon, arduino_shared
+from services.compile_daemon import ArduinoDaemon, CompileDaemons, DaemonError, compile_request, _fields, _bytes_field
+from services.compile_workers import CompileWorkerPool
+from services.container_runtime import ExecResult
+from services.build_cache import BuildCacheSession
+from services.diagnostics import DiagnosticsParser
+
+
+class FakeDaemon:
+    """Thay _call của ArduinoDaemon: trả lời Create/Init/Compile như arduino-cli daemon"""
+
+    def __init__(self):
+        self.calls = []
+        self.compile_error = None
+        self.compile_output = [_bytes_field(1, "Sketch uses 1234 bytes\n")]
+        self.delivered = 0
+
+    def __call__(self, method, request, timeout, stream=False, on_message=None):
+        self.calls.append(method)
+        if method == 'Create':
+            return [_bytes_field(1, b'\x08\x07')]        # Instance{id: 7}
+        if method == 'Init':
+            return []
+        # Như stream gRPC: từng message tới on_message trước khi call kết thúc
+        responses = self.compile_error.responses if self.compile_error else self.compile_output
+        for message in responses:
+            self.delivered += 1
+            if on_message:
+                on_message(message)
+        if self.compile_error:
+            raise self.compile_error
+        return responses
+
+
+@pytest.fixture
+def toolchain(monkeypatch):
+    manifest = {'value': '{"version": 1}'}
+    monkeypatch.setattr(arduino_shared, 'toolchain_fingerprint', lambda: manifest['value'])
+    return manifest
+
+
+@pytest.fixture
+def daemons(monkeypatch, toolchain, runtime):
+    pool = CompileWorkerPool(size=1, cpus=2.0, memory_limit='2g', artifacts_root='/tmp', daemon=True,
+                             network="epu-compile-net")
+    monkeypatch.setattr(compile_daemon, 'compile_workers', pool)
+    runtime.run("compile-worker-0", "my-dev-env:v2", network="epu-compile-net")
+    runtime.containers["compile-worker-0"]["NetworkSettings"]["Networks"]["epu-compile-net"]["IPAddress"] = "172.30.0.5"
+    fake = FakeDaemon()
+    monkeypatch.setattr(ArduinoDaemon, '_call', lambda self, *args, **kwargs: fake(*args, **kwargs))
+    daemons = CompileDaemons(platforms=['esp32:esp32'])
+    daemons.fake, daemons.runtime = fake, runtime
+    return daemons
+
+
+def test_compile_request_encoding():
+    """CompileRequest mã hóa đúng số field của arduino-cli (instance, fqbn, sketch, build, libraries, export)."""
+    msg = compile_request(7, "esp32:esp32:esp32", "/build/a/sketches/blink", "/build/a/build/blink",
+                          "/artifacts/a/blink", ["/workspaces/a/Arduino/libraries"])
+    fields = list(_fields(msg))
+    assert dict(_fields(fields[0][1])) == {1: 7}
+    assert fields[1:] == [(2, b"esp32:esp32:esp32"), (3, b"/build/a/sketches/blink"), (7, b"/build/a/build/blink"),
+                          (15, b"/workspaces/a/Arduino/libraries"), (18, b"/artifacts/a/blink")]
+
+
+def test_instance_reused_until_toolchain_changes(daemons, toolchain):
+    """Instance của platform được giữ ấm giữa các lần compile; đổi toolchain thì Init lại."""
+    build = BuildCacheSession("esp32:esp32:esp32")
+    for _ in range(2):
+        result = daemons.compile("compile-worker-0", "alice", "blink.ino", "esp32:esp32:esp32", build)
+        assert result == ExecResult(0, "Sketch uses 1234 bytes\n", "")
+    assert daemons.fake.calls == ['Create', 'Init', 'Compile', 'Compile']
+    # Sketch đã được compile_workers.job() chép vào worker: daemon không exec, không chạy arduino-cli
+    assert daemons.runtime.exec_calls == []
+
+    toolchain['value'] = '{"version": 2}'
+    daemons.compile("compile-worker-0", "alice", "blink.ino", "esp32:esp32:esp32", build)
+    assert daemons.fake.calls[4:] == ['Init', 'Compile']
+
+
+def test_compile_error_and_fallback(daemons):
+    """Lỗi biên dịch trả về như CLI; daemon không kết nối được thì trả None để chạy CLI."""
+    build = BuildCacheSession("esp32:esp32:esp32")
+    daemons.fake.compile_error = DaemonError('INTERNAL', 'exit status 1', [_bytes_field(2, "blink.ino:3:5: error: 'x'\n")])
+    result = daemons.compile("compile-worker-0", "alice", "blink.ino", "esp32:esp32:esp32", build)
+    assert result.exit_code == 1 and "blink.ino:3:5: error" in result.stderr
+
+    daemons.fake.compile_error = DaemonError('UNAVAILABLE', 'connection refused')
+    assert daemons.compile("compile-worker-0", "alice", "blink.ino", "esp32:esp32:esp32", build) is None
+    # User container (không phải worker) luôn đi đường CLI
+    assert daemons.compile("alice-dev", "alice", "blink.ino", "esp32:esp32:esp32", build) is None
+
+
+def test_daemon_only_reached_on_worker_network(daemons):
+    """Chỉ kết nối daemon qua mạng internal của worker, không bao giờ qua bridge chung với container user."""
+    assert daemons._address("compile-worker-0") == "172.30.0.5:50051"
+    daemons.runtime.containers["compile-worker-0"]["NetworkSettings"] = {
+        "IPAddress": "172.17.0.5", "Networks": {"bridge": {"IPAddress": "172.17.0.5"}}}
+    assert daemons._address("compile-worker-0") is None
+
+
+
+def test_diagnostics_streamed_during_daemon_compile(daemons):
+    """Lỗi được đẩy ra ngay khi message gRPC chứa nó tới (message cắt giữa dòng), không chờ compile xong."""
+    chunks = ["blink.ino:3:5: error: 'x' was not", " declared in this scope\n    3 |   x = 1;\n",
+              "      |   ^\n", "Compilation error: exit status 1\n", "Used platform esp32:esp32\n"]
+    daemons.fake.compile_error = DaemonError('INTERNAL', 'exit status 1', [_bytes_field(2, c) for c in chunks])
+    seen = []
+    parser = DiagnosticsParser(on_diagnostic=lambda d: seen.append((d['message'], d['context'], daemons.fake.delivered)))
+    result = daemons.compile("compile-worker-0", "alice", "blink.ino", "esp32:esp32:esp32",
+                             BuildCacheSession("esp32:esp32:esp32"), parser)
+    assert result.exit_code == 1
+    # Publish khi dòng "Compilation error" (message thứ 4) tới, trước message cuối
+    assert seen == [("'x' was not declared in this scope", ["    3 |   x = 1;", "      |   ^"], 4)]
+    assert parser.finish()['error_count'] == 1
@@ -0,0 +1,90 @@
+import threading
+import pytest
+from services import arduino
+from services.compile_queue import CompileQueue, QueueFull
+
+
+@pytest.fixture
+def compiles(monkeypatch):
+    """compile_sketch giả: ghi lại thứ tự chạy, chặn tới khi test cho phép"""
+    state = {'order': [], 'started': threading.Semaphore(0), 'release': threading.Event()}
+
+    def fake_compile(username, board_fqbn, sketch_path, on_diagnostic=None):
+        state['order'].append((username, sketch_path))
+        state['started'].release()
+        state['release'].wait(5)
+        return {'success': True, 'output': f"{username}:{sketch_path}", 'analysis': {'error_count': 0}}
+
+    monkeypatch.setattr(arduino, 'compile_sketch', fake_compile)
+    return state
+
+
+def _started(compiles, n=1):
+    for _ in range(n):
+        assert compiles['started'].acquire(timeout=5)
+
+
+def test_exam_lane_served_first(compiles):
+    """Hết chỗ chạy: job của sinh viên đang thi được chạy trước các job thường đã xếp hàng."""
+    queue = CompileQueue(concurrency=1, per_user=1, per_user_pending=3, result_ttl=60)
+    first = queue.submit("alice", "esp32:esp32:esp32", "a.ino")
+    _started(compiles)
+    bob = queue.submit("bob", "esp32:esp32:esp32", "b.ino")
+    carol = queue.submit("carol", "esp32:esp32:esp32", "c.ino", lane='exam')
+    assert queue.status(carol)['position'] == 0 and queue.status(bob)['position'] == 1
+
+    compiles['release'].set()
+    assert bob.wait(5) and first.wait(5)
+    assert [u for u, _ in compiles['order']] == ["alice", "carol", "bob"]
+    assert queue.status(bob)['result']['output'] == "bob:b.ino"
+
+
+def test_per_user_limit_and_pending_cap(compiles):
+    """Mỗi user chạy một job một lúc (user khác vẫn được chạy); quá số lượt chờ thì bị từ chối."""
+    queue = CompileQueue(concurrency=2, per_user=1, per_user_pending=2, result_ttl=60)
+    jobs = [queue.submit("alice", "esp32:esp32:esp32", "a.ino"),
+            queue.submit("alice", "esp32:esp32:esp32", "b.ino"),
+            queue.submit("bob", "esp32:esp32:esp32", "c.ino")]
+    _started(compiles, 2)
+    assert sorted(u for u, _ in compiles['order']) == ["alice", "bob"]
+    assert jobs[1].state == 'queued'
+
+    queue.submit("alice", "esp32:esp32:esp32", "d.ino")
+    with pytest.raises(QueueFull):
+        queue.submit("alice", "esp32:esp32:esp32", "e.ino")
+    compiles['release'].set()
+    assert all(job.wait(5) for job in jobs)
+
+
+def test_identical_queued_job_deduplicated(compiles):
+    """Bấm biên dịch lại khi lượt cũ còn chờ: trả về đúng job đó (nâng lane nếu cần)."""
+    queue = CompileQueue(concurrency=1, per_user=1, per_user_pending=3, result_ttl=60)
+    queue.submit("alice", "esp32:esp32:esp32", "a.ino")
+    _started(compiles)
+    waiting = queue.submit("bob", "esp32:esp32:esp32", "b.ino")
+    again = queue.submit("bob", "esp32:esp32:esp32", "b.ino", lane='exam')
+    other_board = queue.submit("bob", "arduino:avr:uno", "b.ino")
+    assert again is waiting and waiting.lane == 'exam'
+    assert other_board is not waiting
+    assert queue.get(waiting.id) is waiting
+
+    compiles['release'].set()
+    assert waiting.wait(5) and other_board.wait(5)
+    assert len(compiles['order']) == 3
+
+
+def test_crash_while_hashing_sources_frees_user_slot(compiles, monkeypatch):
+    """Lỗi lúc tính key mã nguồn không làm chết worker: job kết thúc với lỗi, user vẫn biên dịch tiếp được."""
+    from services import compile_queue
+
+    def broken_key(*args):
+        raise UnicodeEncodeError('utf-8', '\udcff', 0, 1, 'surrogates not allowed')
+
+    monkeypatch.setattr(compile_queue.compile_cache, 'key', broken_key)
+    queue = CompileQueue(concurrency=1, per_user=1, per_user_pending=3, result_ttl=60)
+    crashed = queue.submit("alice", "esp32:esp32:esp32", "a.ino")
+    assert crashed.wait(5) and not crashed.result['success']
+
+    monkeypatch.undo()
+    monkeypatch.setattr(arduino, 'compile_sketch', lambda *a, **kw: {'success': True, 'output': '', 'analysis': {}})
+    assert queue.submit("alice", "esp32:esp32:esp32", "b.ino").wait(5)
@@ -0,0 +1,117 @@
+import io
+import tarfile
+import threading
+import pytest
+from config import SYSTEM_CONFIG
+from services.container_runtime import ExecResult
+from services.compile_workers import CompileWorkerPool
+from services import arduino
+
+
+@pytest.fixture
+def exec_handler():
+    return lambda name, cmd: ExecResult(0, "Sketch uses 1234 bytes\n", "")
+
+
+@pytest.fixture
+def pool(runtime, tmp_path, monkeypatch):
+    pool = CompileWorkerPool(size=2, cpus=2.0, memory_limit='2g', artifacts_root=str(tmp_path))
+    monkeypatch.setattr(arduino, 'compile_workers', pool)
+    return pool
+
+
+@pytest.fixture
+def workspaces(tmp_path, monkeypatch):
+    root = tmp_path / "workspaces"
+    monkeypatch.setitem(SYSTEM_CONFIG, 'WORKSPACE_HOST_ROOT', str(root))
+    home = root / "alice"
+    (home / "blink").mkdir(parents=True)
+    (home / "blink" / "blink.ino").write_text("void setup() {}")
+    (home / "blink" / "util.h").write_text("#pragma once")
+    (home / "blink.ino").write_text("void setup() { x(); }")
+    (home / "Arduino" / "libraries" / "DHT").mkdir(parents=True)
+    (home / "Arduino" / "libraries" / "DHT" / "DHT.h").write_text("// dht")
+    (root / "bob" / "exam").mkdir(parents=True)
+    (root / "bob" / "exam" / "exam.ino").write_text("// bài thi của bob")
+    (home / "blink" / "bob.ino").symlink_to(root / "bob" / "exam" / "exam.ino")
+    (home / "Arduino" / "libraries" / "bob").symlink_to(root / "bob" / "exam")
+    return root
+
+
+def test_workers_created_without_workspaces(runtime, pool):
+    """Worker không mount thư mục workspace của user nào, có giới hạn tài nguyên riêng."""
+    pool.start()
+    assert sorted(runtime.containers) == ["compile-worker-0", "compile-worker-1"]
+    host = runtime.containers["compile-worker-0"]['HostConfig']
+    assert not any(v['bind'] == "/workspaces" for v in host['Binds'].values())
+    assert host['CpuQuota'] == 200000 and host['Memory'] == '2g'
+
+
+def test_workers_isolated_on_internal_network(runtime, tmp_path):
+    """Worker nằm trên mạng internal riêng (daemon không xác thực); worker cũ trên bridge chung bị tạo lại."""
+    runtime.run("compile-worker-0", "my-dev-env:v2")
+    pool = CompileWorkerPool(size=1, cpus=2.0, memory_limit='2g', artifacts_root=str(tmp_path),
+                             daemon=True, network="epu-compile-net")
+    pool.start()
+    assert runtime.networks == {"epu-compile-net": True}
+    assert list(runtime.containers["compile-worker-0"]['NetworkSettings']['Networks']) == ["epu-compile-net"]
+
+
+def test_compile_runs_in_worker_not_user_container(runtime, pool, tmp_path, workspaces):
+    """Compile chạy trong worker (không cần container user đang chạy) và trả về artifact."""
+    out = tmp_path / "alice" / "blink"
+    out.mkdir(parents=True)
+    (out / "blink.ino.bin").write_bytes(b"\0")
+    result = arduino.compile_sketch("alice", "esp32:esp32:esp32", "blink.ino")
+    assert result['success'] and result['artifacts'] == ["blink.ino.bin"]
+    worker = pool.preferred("alice")
+    (_, stage), (_, compile_cmd), (_, clear) = [c for c in runtime.exec_calls if c[0] == worker]
+    assert stage[-3:] == ["stage", "alice", "blink.ino"]
+    assert compile_cmd[:2] == ["bash", "-c"] and compile_cmd[-3:] == ["alice", "blink.ino", "esp32:esp32:esp32"]
+    assert clear[-3:] == ["clear", "alice", "blink.ino"]
+    assert runtime.archives[0][:2] == (worker, "/build/alice")
+    assert "alice-dev" not in runtime.containers
+
+
+def test_only_own_sources_copied_to_worker(pool, workspaces):
+    """Chỉ sketch + thư viện của user được chép vào worker; symlink (trỏ sang workspace khác) bị bỏ qua."""
+    data = pool.sources_archive("alice", "blink.ino")
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        files = [m.name for m in tar.getmembers() if m.isfile()]
+        assert not any(m.issym() or m.islnk() for m in tar.getmembers())
+    assert sorted(files) == ["libraries/DHT/DHT.h", "sketch/blink/blink.ino", "sketch/blink/blink.ino",
+                             "sketch/blink/util.h"]
+    # File cùng tên ở thư mục gốc đứng sau: ghi đè bản trong thư mục sketch khi giải nén
+    assert data.rfind(b"x();") > data.find(b"void setup() {}")
+    assert "bài thi".encode() not in data
+
+
+def test_sketch_name_cannot_escape_home(runtime, pool, workspaces):
+    """Tên sketch '..', '.ino' hay thư mục sketch là symlink ra ngoài home: từ chối, không chép gì vào worker."""
+    for bad in ("..", ".ino", "a.b.ino", "blink.h"):
+        with pytest.raises(ValueError):
+            pool.sources_archive("alice", bad)
+    (workspaces / "alice" / "exam").symlink_to(workspaces / "bob" / "exam")
+    with pytest.raises(ValueError):
+        pool.sources_archive("alice", "exam.ino")
+    result = arduino.compile_sketch("alice", "esp32:esp32:esp32", "..")
+    assert not result['success'] and runtime.archives == [] and runtime.exec_calls == []
+
+
+def test_busy_worker_spills_to_idle_one(runtime, pool):
+    """Worker ưu tiên đang bận thì job chuyển sang worker rảnh."""
+    with pool.acquire("alice") as first:
+        with pool.acquire("alice") as second:
+            assert {first, second} == set(pool.names)
+    done = threading.Event()
+
+    def queued():
+        with pool.acquire("alice"):
+            done.set()
+
+    with pool.acquire("alice"), pool.acquire("alice"):
+        t = threading.Thread(target=queued)
+        t.start()
+        assert not done.wait(0.05)    # cả hai worker bận: xếp hàng
+    assert done.wait(1)
+    t.join()
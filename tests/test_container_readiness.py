@@ -0,0 +1,51 @@
+import time
+import threading
+import pytest
+from services import container_readiness as readiness
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setitem(readiness.SYSTEM_CONFIG, 'READINESS_BACKOFF_BASE', 0.001)
+    monkeypatch.setitem(readiness.SYSTEM_CONFIG, 'READINESS_BACKOFF_MAX', 0.01)
+    monkeypatch.setattr(readiness, '_container_alive', lambda cname: True)
+    yield
+    readiness._states.clear()
+
+
+def test_concurrent_waiters_share_one_probe(monkeypatch):
+    """Nhiều request cùng chờ một container chỉ chạy một vòng probe."""
+    calls = []
+
+    def probe(port, timeout=2.0):
+        calls.append(port)
+        time.sleep(0.01)
+        return len(calls) >= 3
+
+    monkeypatch.setattr(readiness, 'probe_sshd', probe)
+    readiness.mark_starting('alice-dev')
+    threads = [threading.Thread(target=readiness.wait_until_ready, args=('alice-dev', 2201, 5)) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert readiness.get_state('alice-dev') == readiness.STATE_READY
+    assert len(calls) == 3
+
+    readiness.wait_until_ready('alice-dev', 2201)
+    assert len(calls) == 3
+
+
+def test_dead_container_fails_fast(monkeypatch):
+    """Container đã chết thì trả lỗi ngay, không chờ hết timeout."""
+    monkeypatch.setattr(readiness, 'probe_sshd', lambda port, timeout=2.0: pytest.fail("must not probe"))
+    readiness.mark_dead('bob-dev', 'docker run failed')
+    started = time.monotonic()
+    with pytest.raises(readiness.ContainerUnavailableError):
+        readiness.wait_until_ready('bob-dev', 2202, timeout=5)
+    assert time.monotonic() - started < 0.5
+
+    # docker run lại thì ngắt mạch được đóng
+    monkeypatch.setattr(readiness, 'probe_sshd', lambda port, timeout=2.0: True)
+    readiness.mark_starting('bob-dev')
+    readiness.wait_until_ready('bob-dev', 2202, timeout=5)
@@ -0,0 +1,68 @@
+import socket
+import subprocess
+from services.container_runtime import ExecResult, CONTAINER_CALL_SECONDS
+from services.container_setup import PHASE_FUNCTIONS, SSHD_READY_WATCH, STARTUP_PHASES_FILE
+from services import docker_manager
+from services.arduino import compile_sketch
+
+
+def test_docker_manager_uses_runtime(runtime):
+    """docker_manager đi qua runtime (không fork docker CLI), có đo độ trễ từng lời gọi."""
+    runtime.run("alice-dev", "my-dev-env:v2", command=["/startup.sh"])
+    runtime.run("bob-dev", "my-dev-env:v2")
+    runtime.containers["bob-dev"]["State"]["Status"] = "exited"
+
+    before = CONTAINER_CALL_SECONDS.labels(op='inspect')._sum.get()
+    assert docker_manager.docker_status("alice-dev") == "running"
+    assert docker_manager.docker_status("missing-dev") == ""
+    assert docker_manager.get_container_devices("alice-dev") == set()
+    assert docker_manager.get_all_running_users() == ["alice"]
+    assert CONTAINER_CALL_SECONDS.labels(op='inspect')._sum.get() > before
+
+
+def test_compile_through_exec(runtime):
+    """Biên dịch chạy bằng exec của runtime; lỗi được phân tích như trước."""
+    def handler(name, cmd):
+        if cmd[:2] == ["arduino-cli", "compile"]:
+            return ExecResult(1, "", "/home/alice/blink/blink.ino:3:5: error: 'x' was not declared\n")
+        return ExecResult(0, "", "")
+
+    runtime.exec_handler = handler
+    runtime.run("alice-dev", "my-dev-env:v2")
+    result = compile_sketch("alice", "esp32:esp32:esp32", "blink.ino")
+    assert not result['success']
+    assert result['analysis']['errors'][0]['line'] == 3
+    assert runtime.exec_calls[0][1][:2] == ["sh", "-c"]
+
+
+def test_startup_report(runtime):
+    """Báo cáo thời gian từng pha khởi động đọc từ file phases trong container."""
+    def handler(name, cmd):
+        if cmd[0] == "cat":
+            return ExecResult(0, "provision 120\nuser_setup 340\nsshd 15\n", "")
+        return ExecResult(0, "", "")
+
+    runtime.exec_handler = handler
+    runtime.run("alice-dev", "my-dev-env:v2", labels={"epu.pool": "warm"})
+    report = docker_manager.get_startup_report("alice-dev")
+    assert report['phases'] == {'provision': 0.12, 'user_setup': 0.34, 'sshd': 0.015}
+    assert report['warm'] and report['total'] == 0.355
+    assert docker_manager.get_startup_report("missing-dev") is None
+
+
+def test_sshd_phase_recorded_when_port_accepts(tmp_path):
+    """sshd chạy foreground (exec): phase sshd được ghi khi cổng bắt đầu nhận kết nối."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    phases = tmp_path / "phases"
+    script = (PHASE_FUNCTIONS.replace(STARTUP_PHASES_FILE, str(phases)) + "phase sshd\n"
+              + SSHD_READY_WATCH.replace("/22)", f"/{port})") + "wait\n")
+    proc = subprocess.Popen(["bash", "-c", script])
+    try:
+        listener.listen(1)
+        assert proc.wait(timeout=30) == 0
+    finally:
+        listener.close()
+    name, ms = phases.read_text().split()
+    assert name == "sshd" and int(ms) >= 0
@@ -0,0 +1,71 @@
+from services.container_state import ContainerStateRegistry
+from services import container_readiness, docker_manager, idle_reaper
+
+
+def _drain(registry, runtime):
+    for event in runtime.events():
+        registry.apply(event)
+
+
+def test_registry_follows_events(runtime):
+    """Trạng thái container được cập nhật từ Docker events; chưa đồng bộ thì trả None để inspect."""
+    registry = ContainerStateRegistry(window=300)
+    runtime.run("alice-dev", "my-dev-env:v2")
+    assert registry.status("alice-dev") is None
+
+    registry.reconcile()
+    runtime.pending_events.clear()
+    assert registry.status("alice-dev") == "running"
+    assert registry.status("bob-dev") == ""
+
+    runtime.run("warm-1", "my-dev-env:v2")
+    runtime.rename("warm-1", "bob-dev")
+    runtime.remove("alice-dev")
+    _drain(registry, runtime)
+    assert registry.status("bob-dev") == "running"
+    assert registry.status("alice-dev") == ""
+
+    runtime.emit("die", "bob-dev", exitCode="137")
+    _drain(registry, runtime)
+    assert registry.status("bob-dev") == "exited"
+
+
+def test_ensure_fast_path_skips_inspect_and_db(runtime, monkeypatch):
+    """Container đã kiểm tra và sshd sẵn sàng: ensure_user_container trả cổng ngay, không inspect/DB/exec."""
+    registry = ContainerStateRegistry(window=300)
+    monkeypatch.setattr(docker_manager, "container_state", registry)
+    runtime.run("carol-dev", "my-dev-env:v2")
+    registry.reconcile()
+    registry.mark_verified("carol-dev", 2201)
+    container_readiness.mark_ready("carol-dev")
+
+    def no_db():
+        raise AssertionError("DB must not be queried")
+
+    monkeypatch.setattr(docker_manager, "get_db_connection", no_db)
+    assert docker_manager.ensure_user_container("carol") == 2201
+    assert runtime.exec_calls == []
+
+    # Container chết: event hạ trạng thái, lần sau phải đi đường chậm
+    runtime.containers["carol-dev"]["State"]["Status"] = "exited"
+    runtime.emit("die", "carol-dev")
+    _drain(registry, runtime)
+    assert registry.ready_port("carol-dev") is None
+    container_readiness.forget("carol-dev")
+
+
+def test_reconcile_keeps_paused_status(runtime, monkeypatch):
+    """Container bị idle reaper pause: reconcile ghi 'paused' (không phải running) để lần sau được unpause."""
+    registry = ContainerStateRegistry(window=300)
+    monkeypatch.setattr(docker_manager, "container_state", registry)
+    monkeypatch.setattr(idle_reaper, "_hibernated", set())
+    runtime.run("dave-dev", "my-dev-env:v2")
+    runtime.pause("dave-dev")
+    assert "dave-dev" in runtime.list_names(running=True)     # như Docker
+
+    registry.reconcile()
+    assert registry.status("dave-dev") == "paused"
+    assert docker_manager.docker_status("dave-dev") == "paused"
+    assert idle_reaper.ensure_awake("dave-dev")
+    assert runtime.status("dave-dev") == "running"
+    container_readiness.forget("dave-dev")
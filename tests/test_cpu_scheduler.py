@@ -0,0 +1,55 @@
+from services.cpu_scheduler import CompileCpuScheduler, CPU_PERIOD
+
+
+def _scheduler(**kwargs):
+    options = dict(base_cpus=1.0, memory_limit='1g', pids_limit=512, burst_cpus=2.0,
+                   slots=1, credit=60, refill_seconds=600)
+    options.update(kwargs)
+    return CompileCpuScheduler(**options)
+
+
+def _quota(runtime, name):
+    return runtime.containers[name]['HostConfig']['CpuQuota']
+
+
+def test_container_created_with_limits(runtime):
+    """Container user được tạo với quota CPU, giới hạn RAM (không swap) và pids."""
+    runtime.run("alice-dev", "my-dev-env:v2", **_scheduler().container_limits())
+    host = runtime.containers["alice-dev"]['HostConfig']
+    assert host['CpuPeriod'] == CPU_PERIOD and _quota(runtime, "alice-dev") == CPU_PERIOD
+    assert host['Memory'] == host['MemorySwap'] == '1g'
+    assert host['PidsLimit'] == 512
+
+
+def test_compile_burst_raises_quota_and_respects_slots(runtime):
+    """Compile được nâng CPU rồi trả về quota cơ bản; hết slot thì compile chạy với quota thường."""
+    scheduler = _scheduler()
+    for name in ("alice-dev", "bob-dev"):
+        runtime.run(name, "my-dev-env:v2", **scheduler.container_limits())
+
+    with scheduler.compile_burst("alice-dev") as burst:
+        assert burst
+        assert _quota(runtime, "alice-dev") == 2 * CPU_PERIOD
+        with scheduler.compile_burst("alice-dev") as shared:   # compile thứ hai cùng container
+            assert shared
+        assert _quota(runtime, "alice-dev") == 2 * CPU_PERIOD
+        with scheduler.compile_burst("bob-dev") as other:
+            assert not other
+            assert _quota(runtime, "bob-dev") == CPU_PERIOD
+    assert _quota(runtime, "alice-dev") == CPU_PERIOD
+
+
+def test_burst_needs_credit(runtime, monkeypatch):
+    """Container đã dùng hết credit không được burst cho tới khi credit hồi lại."""
+    scheduler = _scheduler(slots=4)
+    runtime.run("alice-dev", "my-dev-env:v2")
+    clock = [1000.0]
+    monkeypatch.setattr("services.cpu_scheduler.time.monotonic", lambda: clock[0])
+
+    with scheduler.compile_burst("alice-dev"):
+        clock[0] += 60                     # dùng hết 60s credit
+    with scheduler.compile_burst("alice-dev") as burst:
+        assert not burst
+    clock[0] += 300                        # hồi 30s credit
+    with scheduler.compile_burst("alice-dev") as burst:
+        assert burst
@@ -0,0 +1,60 @@
+from services.arduino import analyze_compile_errors
+from services.diagnostics import DiagnosticsParser
+
+LOG = """\
+/opt/xtensa-esp32-elf-g++ -DESP32 -I/opt/esp32/include -c /build/core/main.cpp -o /build/core/main.cpp.o
+In file included from /home/alice/blink/blink.ino:2:
+                 from /build/sketch/blink.ino.cpp:1:
+/workspaces/alice/Arduino/libraries/DHT/DHT.h: In member function 'float DHT::readTemperature()':
+/workspaces/alice/Arduino/libraries/DHT/DHT.h:42:9: warning: unused variable 'f' [-Wunused-variable]
+   42 |   float f = NAN;
+      |         ^
+/home/alice/blink/blink.ino: In function 'void loop()':
+/home/alice/blink/blink.ino:12:3: error: 'x' was not declared in this scope
+   12 |   x = digitalRead(4);
+      |   ^
+/home/alice/blink/blink.ino:3:6: note: 'y' declared here
+    3 | int y;
+      |      ^
+Using library DHT_sensor_library at version 1.4.4
+"""
+
+
+def test_errors_warnings_notes_with_context():
+    """Lỗi/cảnh báo có vị trí, dòng context, hàm bao quanh; note gắn vào lỗi cha."""
+    result = DiagnosticsParser().feed_text(LOG).finish()
+    assert result['error_count'] == 1 and result['warning_count'] == 1
+
+    error = result['errors'][0]
+    assert (error['file'], error['line'], error['column']) == ("blink.ino", 12, 3)
+    assert error['message'] == "'x' was not declared in this scope"
+    assert error['context'] == ["   12 |   x = digitalRead(4);", "      |   ^"]
+    assert error['scope'] == "In function 'void loop()'"
+    assert 'included_from' not in error
+    assert [n['message'] for n in error['notes']] == ["'y' declared here"]
+    assert error['notes'][0]['context'][0] == "    3 | int y;"
+
+    warning = result['warnings'][0]
+    assert warning['scope'] == "In member function 'float DHT::readTemperature()'"
+    assert warning['included_from'] == ["/home/alice/blink/blink.ino:2", "/build/sketch/blink.ino.cpp:1"]
+
+
+def test_diagnostics_streamed_in_order():
+    """Mỗi chẩn đoán được đẩy ra ngay khi dòng kế tiếp không còn là context, trước khi log kết thúc."""
+    seen = []
+    parser = DiagnosticsParser(on_diagnostic=lambda d: seen.append((d['kind'], parser.lines)))
+    for line in LOG.splitlines():
+        parser.feed(line)
+    assert seen == [('warning', 8), ('error', 12), ('note', 15)]
+    parser.finish()
+    assert len(seen) == 3
+
+
+def test_fatal_error_and_legacy_shape():
+    """fatal error tính là lỗi; analyze_compile_errors giữ nguyên dạng kết quả cũ."""
+    output = ("blink.ino:1:10: fatal error: DHT.h: No such file or directory\n"
+              "compilation terminated.\n")
+    analysis = analyze_compile_errors(output)
+    assert analysis['error_count'] == 1 and analysis['warning_count'] == 0
+    assert analysis['errors'][0]['line'] == 1
+    assert analysis['errors'][0]['message'] == "DHT.h: No such file or directory"
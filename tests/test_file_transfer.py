@@ -0,0 +1,52 @@
+import os
+import pytest
+from app import app
+from config import SYSTEM_CONFIG
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Client đã đăng nhập, workspace đọc thẳng thư mục bind-mount tạm"""
+    monkeypatch.setitem(SYSTEM_CONFIG, 'WORKSPACE_BACKEND', 'local')
+    monkeypatch.setitem(SYSTEM_CONFIG, 'WORKSPACE_HOST_ROOT', str(tmp_path))
+    (tmp_path / "alice").mkdir()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['username'] = 'alice'
+            sess['role'] = 'user'
+        yield client
+
+
+def test_range_download_and_binary_load(client, tmp_path):
+    """File nhị phân không bị decode; tải về hỗ trợ Range."""
+    firmware = bytes(range(256)) * 40
+    (tmp_path / "alice" / "fw.bin").write_bytes(firmware)
+
+    loaded = client.post('/user/alice/editor/load', json={'filename': 'fw.bin', 'path': '.'}).get_json()
+    assert loaded['binary'] and 'content' not in loaded and loaded['size'] == len(firmware)
+
+    full = client.get(loaded['download_url'])
+    assert full.status_code == 200 and full.data == firmware
+    part = client.get('/user/alice/files/download?path=fw.bin', headers={'Range': 'bytes=100-299'})
+    assert part.status_code == 206 and part.data == firmware[100:300]
+    assert part.headers['Content-Range'] == f'bytes 100-299/{len(firmware)}'
+
+
+def test_size_limit_and_chunked_upload(client, tmp_path, monkeypatch):
+    """File quá lớn bị từ chối trước khi đọc; upload theo chunk ghép đúng và tiếp tục được."""
+    monkeypatch.setitem(SYSTEM_CONFIG, 'MAX_WORKSPACE_FILE_SIZE', 1000)
+    (tmp_path / "alice" / "big.log").write_bytes(b"x" * 2000)
+    assert client.post('/user/alice/editor/load', json={'filename': 'big.log', 'path': '.'}).status_code == 413
+
+    data = os.urandom(3000)
+    url = '/user/alice/upload-chunk?path=.&filename=up.bin&total_size=3000&offset={}'
+    assert client.post(url.format(0), data=data[:1000]).get_json() == {'success': True, 'received': 1000, 'complete': False}
+    # Gửi sai offset -> server trả về số byte đã nhận để client gửi tiếp
+    assert client.post(url.format(2000), data=data[2000:]).get_json()['received'] == 1000
+    assert client.post(url.format(1000), data=data[1000:]).get_json()['complete']
+    assert (tmp_path / "alice" / "up.bin").read_bytes() == data
+    assert not (tmp_path / "alice" / ".up.bin.part").exists()
+
+    monkeypatch.setitem(SYSTEM_CONFIG, 'MAX_UPLOAD_FILE_SIZE', 100)
+    assert client.post(url.format(0), data=data[:100]).status_code == 413
@@ -0,0 +1,40 @@
+import pytest
+from config import SYSTEM_CONFIG
+from services import idle_reaper, container_readiness
+
+
+@pytest.fixture
+def runtime(runtime, monkeypatch):
+    monkeypatch.setitem(SYSTEM_CONFIG, 'IDLE_TIMEOUT', 600)
+    monkeypatch.setattr(idle_reaper, '_activity', {})
+    monkeypatch.setattr(idle_reaper, '_hibernated', set())
+    return runtime
+
+
+@pytest.mark.parametrize("mode", ["stop", "pause"])
+def test_idle_container_hibernated_and_resumed(runtime, monkeypatch, mode):
+    """Container không hoạt động quá IDLE_TIMEOUT bị dừng/pause; lần truy cập sau được đánh thức."""
+    monkeypatch.setitem(SYSTEM_CONFIG, 'IDLE_HIBERNATE_MODE', mode)
+    runtime.run("alice-dev", "my-dev-env:v2")
+    runtime.run("bob-dev", "my-dev-env:v2")
+
+    assert idle_reaper.reap_once(now=1000.0) == []      # lần quét đầu: bắt đầu tính giờ
+    idle_reaper._activity["bob-dev"] = 1500.0            # bob vừa dùng terminal
+    assert idle_reaper.reap_once(now=1700.0) == ["alice-dev"]
+    assert runtime.status("alice-dev") == ("exited" if mode == "stop" else "paused")
+    assert runtime.status("bob-dev") == "running"
+    assert idle_reaper.USER_CONTAINERS.labels(state='hibernated')._value.get() == 1
+
+    assert idle_reaper.ensure_awake("alice-dev", runtime.status("alice-dev"))
+    assert runtime.status("alice-dev") == "running"
+    assert container_readiness.get_state("alice-dev") == container_readiness.STATE_STARTING
+    assert not idle_reaper.ensure_awake("alice-dev", "running")
+    container_readiness.forget("alice-dev")
+
+
+def test_crashed_container_is_not_resumed(runtime):
+    """Container thoát bất thường (không do reaper) không được start lại mà để tạo mới."""
+    runtime.run("carol-dev", "my-dev-env:v2")
+    runtime.containers["carol-dev"]["State"].update(Status="exited", ExitCode=1)
+    assert not idle_reaper.ensure_awake("carol-dev", "exited")
+    assert runtime.status("carol-dev") == "exited"
@@ -0,0 +1,70 @@
+import time
+import threading
+import pytest
+from services import mission_provisioner as mp
+from services.workspace_storage import LocalWorkspaceBackend
+
+MISSION = {'id': 7, 'name': 'Đề thi 18', 'template_code': 'void setup() {}\n'}
+
+
+@pytest.fixture
+def provisioner(monkeypatch):
+    users = [f"sv{i}" for i in range(10)]
+    monkeypatch.setattr(mp, 'load_mission', lambda mission_id: (MISSION, users) if mission_id == 7 else (None, []))
+    return mp.MissionProvisioner(concurrency=3, lead_minutes=30, check_interval=60)
+
+
+def _wait(provisioner, mission_id):
+    deadline = time.monotonic() + 5
+    while provisioner.progress(mission_id)['running'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return provisioner.progress(mission_id)
+
+
+def test_provision_bounded_parallelism_and_failures(provisioner, monkeypatch):
+    """Chuẩn bị toàn bộ sinh viên, không quá `concurrency` user cùng lúc, ghi lại user lỗi."""
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    def fake_provision(username, mission):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        if username == "sv3":
+            raise RuntimeError("sshd readiness timeout")
+
+    monkeypatch.setattr(mp, 'provision_user', fake_provision)
+    job = provisioner.submit(7)
+    assert provisioner.submit(7) is job          # đang chạy: không tạo job thứ hai
+    assert provisioner.submit(99) is None
+
+    progress = _wait(provisioner, 7)
+    assert progress['done'] == progress['total'] == 10
+    assert progress['ok'] == 9
+    assert progress['failed'] == [{'username': 'sv3', 'error': 'sshd readiness timeout'}]
+    assert 1 < peak[0] <= 3
+
+
+def test_schedule_submits_each_due_mission_once(provisioner, monkeypatch):
+    """Bộ lập lịch chỉ kích hoạt mỗi mission sắp bắt đầu một lần."""
+    monkeypatch.setattr(mp, 'provision_user', lambda username, mission: None)
+    monkeypatch.setattr(provisioner, 'due_missions', lambda: [7])
+    assert provisioner.check_schedule() == [7]
+    assert provisioner.progress(7)['trigger'] == 'schedule'
+    _wait(provisioner, 7)
+    assert provisioner.check_schedule() == []
+
+
+def test_create_mission_files_keeps_existing_work(tmp_path):
+    """Tạo thư mục + .ino từ template, không ghi đè bài đang làm."""
+    fs = LocalWorkspaceBackend(str(tmp_path), owner="sv1")
+    slug = mp.create_mission_files(fs, MISSION)
+    assert slug == "de_thi_18"
+    ino = tmp_path / slug / f"{slug}.ino"
+    assert ino.read_text() == MISSION['template_code']
+    ino.write_text("// bài làm")
+    mp.create_mission_files(fs, MISSION)
+    assert ino.read_text() == "// bài làm"
@@ -0,0 +1,207 @@
+import mysql.connector
+import pytest
+from config import SYSTEM_CONFIG
+from services import port_allocator as port_allocator_module, docker_manager
+from services.port_allocator import PortAllocator, SSH_PORT_CLAIMS
+
+
+class FakeLeaseDB:
+    """Bảng ssh_port_leases + users trong bộ nhớ; chỉ hiểu đúng các câu SQL PortAllocator dùng"""
+
+    def __init__(self, ports=(), users=None):
+        self.leases = {port: None for port in ports}    # port -> holder
+        self.users = dict(users or {})                  # username -> ssh_port
+        self.statements = []
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self, dictionary)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def holder_port(self, holder):
+        return next((p for p, h in self.leases.items() if h == holder), None)
+
+    def set_holder(self, port, holder):
+        if holder is not None and self.holder_port(holder) not in (None, port):
+            raise mysql.connector.IntegrityError("Duplicate entry for key 'holder'")
+        self.leases[port] = holder
+
+
+class FakeCursor:
+    def __init__(self, db, dictionary=False):
+        self.db = db
+        self.dictionary = dictionary
+        self.rowcount = 0
+        self._rows = []
+
+    def close(self):
+        pass
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def executemany(self, sql, rows):
+        for params in rows:
+            self.execute(sql, params)
+
+    def execute(self, sql, params=()):
+        db, sql = self.db, ' '.join(sql.split())
+        db.statements.append(sql)
+        self._rows, self.rowcount = [], 0
+        if sql == "SELECT ssh_port FROM users WHERE username=%s":
+            if params[0] in db.users:
+                port = db.users[params[0]]
+                self._rows = [{'ssh_port': port} if self.dictionary else (port,)]
+        elif sql == "SELECT port FROM ssh_port_leases WHERE holder=%s":
+            port = db.holder_port(params[0])
+            self._rows = [(port,)] if port else []
+        elif sql == "SELECT COUNT(holder), COUNT(*) FROM ssh_port_leases WHERE port BETWEEN %s AND %s":
+            ports = [p for p in db.leases if params[0] <= p <= params[1]]
+            self._rows = [(sum(1 for p in ports if db.leases[p]), len(ports))]
+        elif sql == "SELECT holder FROM ssh_port_leases WHERE holder LIKE %s":
+            self._rows = [(h,) for h in db.leases.values() if h and h.startswith(params[0].rstrip('%'))]
+        elif sql == "INSERT IGNORE INTO ssh_port_leases (port) VALUES (%s)":
+            db.leases.setdefault(params[0], None)
+        elif sql == "INSERT IGNORE INTO ssh_port_leases (port) SELECT DISTINCT ssh_port FROM users WHERE ssh_port IS NOT NULL":
+            for port in db.users.values():
+                if port is not None:
+                    db.leases.setdefault(port, None)
+        elif sql == ("UPDATE ssh_port_leases SET holder=%s, leased_at=CURRENT_TIMESTAMP "
+                     "WHERE port=%s AND holder IS NULL"):
+            holder, port = params
+            if port in db.leases and db.leases[port] is None:
+                db.set_holder(port, holder)
+                self.rowcount = 1
+        elif sql == ("UPDATE ssh_port_leases SET holder=%s, leased_at=CURRENT_TIMESTAMP "
+                     "WHERE holder IS NULL AND port BETWEEN %s AND %s ORDER BY port LIMIT 1"):
+            holder, start, end = params
+            free = sorted(p for p, h in db.leases.items() if h is None and start <= p <= end)
+            if free:
+                db.set_holder(free[0], holder)
+                self.rowcount = 1
+        elif sql == ("UPDATE ssh_port_leases SET holder=%s, leased_at=CURRENT_TIMESTAMP "
+                     "WHERE port=%s AND (holder IS NULL OR holder=%s OR holder=%s)"):
+            holder, port, *allowed = params
+            if port in db.leases and db.leases[port] in (None, *allowed):
+                db.set_holder(port, holder)
+                self.rowcount = 1
+        elif sql == "UPDATE ssh_port_leases SET holder=NULL, leased_at=NULL WHERE holder=%s AND port<>%s":
+            for port, holder in db.leases.items():
+                if holder == params[0] and port != params[1]:
+                    db.leases[port] = None
+                    self.rowcount += 1
+        elif sql == "UPDATE ssh_port_leases SET holder=NULL, leased_at=NULL WHERE holder=%s":
+            for port, holder in db.leases.items():
+                if holder == params[0]:
+                    db.leases[port] = None
+                    self.rowcount += 1
+        elif sql.startswith("UPDATE ssh_port_leases l JOIN (SELECT ssh_port, MIN(username)"):
+            first = {}
+            for username, port in sorted(db.users.items()):
+                if port is not None:
+                    first.setdefault(port, username)
+            for port, username in first.items():
+                if db.leases.get(port, 'missing') is None and db.holder_port(username) is None:
+                    db.set_holder(port, username)
+        elif sql.startswith("UPDATE users u LEFT JOIN ssh_port_leases l"):
+            for username, port in db.users.items():
+                if port is not None and db.holder_port(username) != port:
+                    db.users[username] = db.holder_port(username)
+        elif sql.startswith("UPDATE ssh_port_leases l LEFT JOIN users u"):
+            for port, holder in db.leases.items():
+                if holder and not holder.startswith(params[0].rstrip('%')) and holder not in db.users:
+                    db.leases[port] = None
+                    self.rowcount += 1
+        else:
+            raise AssertionError(f"unexpected SQL: {sql}")
+
+
+@pytest.fixture
+def lease_db(monkeypatch):
+    db = FakeLeaseDB(ports=range(3100, 3103))
+    monkeypatch.setattr(port_allocator_module, 'get_db_connection', lambda: db)
+    return db
+
+
+def test_claim_without_database_probes_configured_range():
+    """Không có DB (môi trường test): dò cổng trống trên host trong đúng dải cấu hình."""
+    allocator = PortAllocator(start=3100, end=3109)
+    fallbacks = SSH_PORT_CLAIMS.labels(result='fallback')._value.get()
+    port = allocator.claim("alice")
+    assert 3100 <= port <= 3109
+    assert SSH_PORT_CLAIMS.labels(result='fallback')._value.get() == fallbacks + 1
+    allocator.release("alice")   # không có DB: không lỗi
+
+
+def test_claim_and_release(lease_db):
+    """Mỗi holder giữ một cổng: giữ lease cũ, ưu tiên cổng mong muốn còn trống, hết cổng thì trả None."""
+    allocator = PortAllocator(start=3100, end=3102)
+    assert allocator.claim("alice") == 3100
+    assert allocator.claim("alice") == 3100
+    assert allocator.claim("bob", preferred=3102) == 3102
+    assert allocator.claim("carol", preferred=3102) == 3101
+    assert allocator.claim("dave") is None
+
+    allocator.release("bob")
+    assert lease_db.leases[3102] is None
+    assert allocator.claim("dave") == 3102
+
+
+def test_claim_race_on_same_holder(lease_db, monkeypatch):
+    """Request khác vừa cấp cổng cho cùng holder (UNIQUE holder): trả đúng cổng đó, không lỗi."""
+    allocator = PortAllocator(start=3100, end=3102)
+    execute = FakeCursor.execute
+
+    def racing(cursor, sql, params=()):
+        if sql.startswith("UPDATE ssh_port_leases SET holder=%s") and lease_db.holder_port("alice") is None:
+            lease_db.leases[3101] = "alice"
+        return execute(cursor, sql, params)
+
+    monkeypatch.setattr(FakeCursor, 'execute', racing)
+    assert allocator.claim("alice") == 3101
+    assert list(lease_db.leases.values()).count("alice") == 1
+
+
+def test_assign_moves_only_free_or_warm_lease(lease_db):
+    """Chỉ chuyển lease khi cổng trống hoặc thuộc container warm đang được claim; không cướp cổng của người khác."""
+    allocator = PortAllocator(start=3100, end=3102)
+    lease_db.leases.update({3100: "warm-abc", 3101: "alice", 3102: "bob"})
+    assert allocator.assign("alice", 3100, from_holder="warm-abc")
+    assert lease_db.leases == {3100: "alice", 3101: None, 3102: "bob"}
+
+    assert not allocator.assign("carol", 3102, from_holder="warm-xyz")
+    assert lease_db.leases[3102] == "bob" and lease_db.holder_port("carol") is None
+
+
+def test_sync_adopts_user_ports_and_reclaims_stale(lease_db, runtime):
+    """Khởi động: tạo dòng cho dải cổng, nhận cổng users.ssh_port cũ, thu hồi lease của user đã xóa / warm không còn."""
+    allocator = PortAllocator(start=3100, end=3103)
+    lease_db.users = {"alice": 3100, "bob": 3100, "carol": 3105, "erin": None}
+    lease_db.leases.update({3101: "ghost", 3102: "warm-gone"})
+    lease_db.leases[3103] = "warm-live"
+    runtime.run("warm-live", "my-dev-env:v2")
+
+    allocator.sync()
+    assert lease_db.leases == {3100: "alice", 3101: None, 3102: None, 3103: "warm-live", 3105: "carol"}
+    # bob trùng cổng với alice: mất cổng cũ, lần tạo container sau sẽ được cấp cổng mới
+    assert lease_db.users["bob"] is None and lease_db.users["alice"] == 3100
+
+
+def test_no_container_when_port_range_exhausted(lease_db, runtime, tmp_path, monkeypatch):
+    """Hết cổng trong dải: không docker run (tránh cổng ngẫu nhiên ngoài allocator), giữ nguyên users.ssh_port."""
+    monkeypatch.setitem(SYSTEM_CONFIG, 'WORKSPACE_HOST_ROOT', str(tmp_path))
+    monkeypatch.setattr(docker_manager, 'get_db_connection', lambda: lease_db)
+    monkeypatch.setattr(docker_manager, 'port_allocator', PortAllocator(start=3100, end=3102))
+    lease_db.leases.update({3100: "alice", 3101: "bob", 3102: "carol"})
+    lease_db.users = {"dave": 3105}
+
+    assert docker_manager.ensure_user_container("dave") is None
+    assert "dave-dev" not in runtime.containers
+    assert lease_db.users["dave"] == 3105
@@ -0,0 +1,32 @@
+import os
+import importlib.util
+
+_spec = importlib.util.spec_from_file_location(
+    "epu_provision", os.path.join(os.path.dirname(__file__), "..", "docker", "provision.py"))
+provision = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(provision)
+
+
+def test_check_compares_manifest_with_disk(tmp_path):
+    """check chỉ so phiên bản trên đĩa với manifest: thiếu core, sai phiên bản thư viện đều bị báo."""
+    data_dir, user_dir = tmp_path / "arduino15", tmp_path / "Arduino"
+    (data_dir / "packages" / "esp32" / "hardware" / "esp32" / "2.0.17").mkdir(parents=True)
+    lib = user_dir / "libraries" / "DHT_sensor_library"
+    lib.mkdir(parents=True)
+    (lib / "library.properties").write_text("name=DHT sensor library\nversion=1.4.4\n")
+    manifest = {
+        "cores": {"esp32:esp32": "2.0.17", "arduino:avr": "1.8.6"},
+        "libraries": {"DHT sensor library": "1.4.6"},
+        "python_packages": {"pytest": {"module": "pytest", "version": "0"}},
+    }
+
+    missing = provision.missing_items(manifest, str(data_dir), str(user_dir))
+    assert ('core', 'arduino:avr', '1.8.6', None) in missing
+    assert ('library', 'DHT sensor library', '1.4.6', '1.4.4') in missing
+    assert [m[:2] for m in missing if m[0] == 'python'] == [('python', 'pytest')]
+    assert not any(m[1] == 'esp32:esp32' for m in missing)
+
+    (lib / "library.properties").write_text("name=DHT sensor library\nversion=1.4.6\n")
+    (data_dir / "packages" / "arduino" / "hardware" / "avr" / "1.8.6").mkdir(parents=True)
+    manifest["python_packages"] = {}
+    assert provision.missing_items(manifest, str(data_dir), str(user_dir)) == []
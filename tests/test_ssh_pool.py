@@ -0,0 +1,87 @@
+import pytest
+from services import ssh_manager
+from services.ssh_manager import SSHSessionPool
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+    def send_ignore(self):
+        if not self.active:
+            raise EOFError()
+
+
+class FakeClient:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+        self.transport.active = False
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(ssh_manager, 'get_user_ssh_port', lambda username: 2200)
+    connects = []
+
+    def connect(port, safe_username):
+        client = FakeClient()
+        connects.append(client)
+        return client
+
+    p = SSHSessionPool(max_sessions=2, idle_ttl=600, healthcheck_interval=0, connect=connect)
+    p.connects = connects
+    return p
+
+
+def test_pool_reuses_session(pool):
+    """Hai request liên tiếp của cùng user chỉ bắt tay SSH một lần."""
+    c1 = pool.acquire('alice')
+    pool.release('alice', c1)
+    c2 = pool.acquire('alice')
+    pool.release('alice', c2)
+    assert c1 is c2
+    assert len(pool.connects) == 1
+
+
+def test_pool_reconnects_dead_transport(pool):
+    """Transport chết (container restart) phải được loại bỏ và kết nối lại."""
+    c1 = pool.acquire('alice')
+    pool.release('alice', c1)
+    c1.transport.active = False
+    c2 = pool.acquire('alice')
+    assert c2 is not c1
+    assert len(pool.connects) == 2
+
+
+def test_pool_lru_eviction_skips_borrowed(pool):
+    """Vượt quá max_sessions thì đóng phiên ít dùng nhất, trừ phiên đang được mượn."""
+    a = pool.acquire('a')
+    b = pool.acquire('b')
+    pool.release('b', b)
+    c = pool.acquire('c')
+    assert len(pool) == 2
+    assert b.closed and not a.closed and not c.closed
+
+
+def test_invalidate_borrowed_closes_after_last_release(pool):
+    """Phiên bị invalidate khi còn hai người mượn: chỉ đóng khi người cuối cùng trả lại."""
+    c1 = pool.acquire('alice')
+    c2 = pool.acquire('alice')
+    assert c1 is c2
+    pool.invalidate('alice')
+    assert len(pool) == 0 and not c1.closed
+    pool.release('alice', c1)
+    assert not c1.closed
+    pool.release('alice', c2)
+    assert c1.closed
+    assert pool.acquire('alice') is not c1
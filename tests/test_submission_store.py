@@ -0,0 +1,43 @@
+from services.submission_store import store_submission_files, load_submission_files
+
+
+class FakeBlobCursor:
+    """Giả lập bảng submission_blobs (INSERT IGNORE + SELECT ... IN)"""
+
+    def __init__(self):
+        self.blobs = {}
+        self.inserted = 0
+        self._result = []
+
+    def executemany(self, sql, rows):
+        for sha, size, compression, data in rows:
+            if sha not in self.blobs:
+                self.blobs[sha] = (compression, data)
+                self.inserted += 1
+
+    def execute(self, sql, params):
+        self._result = [{'sha256': k, 'compression': self.blobs[k][0], 'data': self.blobs[k][1]}
+                        for k in params if k in self.blobs]
+
+    def fetchall(self):
+        return self._result
+
+
+def test_blobs_deduplicated_across_students():
+    """Code mẫu giống nhau của nhiều sinh viên chỉ lưu một lần, nội dung tải lại đúng khi cần."""
+    cur = FakeBlobCursor()
+    template = "void setup() {}\n" * 200
+    a = store_submission_files(cur, [{'name': 'm.ino', 'path': '/m/m.ino', 'content': template, 'size': 3200}])
+    b = store_submission_files(cur, [
+        {'name': 'm.ino', 'path': '/m/m.ino', 'content': template, 'size': 3200},
+        {'name': 'x.h', 'path': '/m/x.h', 'content': '#define X 1', 'size': 11},
+    ])
+    assert cur.inserted == 2
+    assert 'content' not in a[0] and a[0]['blob'] == b[0]['blob']
+    assert len(cur.blobs[a[0]['blob']][1]) < len(template)
+
+    loaded = load_submission_files(cur, b, paths={'/m/x.h'})
+    assert [f['content'] for f in loaded] == ['#define X 1']
+
+    legacy = [{'name': 'old.ino', 'path': '/old.ino', 'content': 'inline', 'size': 6}]
+    assert load_submission_files(cur, legacy) == legacy
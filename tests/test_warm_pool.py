@@ -0,0 +1,105 @@
+import os
+import subprocess
+import pytest
+from services.container_runtime import ExecResult
+from services.container_setup import WARM_READY_MARKER, STARTUP_PHASES_FILE, warm_script
+from services.warm_pool import WarmContainerPool, WARM_POOL_CLAIMS
+from services import container_readiness
+
+
+@pytest.fixture
+def provisioned():
+    return set()
+
+
+@pytest.fixture
+def exec_handler(provisioned):
+    def handler(name, cmd):
+        if cmd == ["test", "-f", WARM_READY_MARKER]:
+            return ExecResult(0 if name in provisioned else 1, '', '')
+        return ExecResult(0, '', '')
+    return handler
+
+
+@pytest.fixture
+def runtime(runtime, provisioned):
+    runtime.provisioned = provisioned
+    return runtime
+
+
+def _pool(size=2):
+    return WarmContainerPool(target_size=size, refill_interval=60, start_timeout=900, claim_timeout=60)
+
+
+def test_refill_and_claim(runtime):
+    """Pool dựng đủ số container, chỉ cho claim khi đã cài xong; claim đổi tên thành <user>-dev."""
+    pool = _pool()
+    pool._thread = object()  # không chạy luồng nền trong test
+    pool.refill()
+    assert pool.stats() == {'target': 2, 'ready': 0, 'starting': 2}
+    assert all(c['Config']['Labels']['epu.pool'] == 'warm' for c in runtime.containers.values())
+
+    misses = WARM_POOL_CLAIMS.labels(result='miss')._value.get()
+    assert pool.claim("alice", "alice-dev") is None
+    assert WARM_POOL_CLAIMS.labels(result='miss')._value.get() == misses + 1
+
+    runtime.provisioned.update(runtime.containers)
+    pool.refill()
+    assert pool.stats()['ready'] == 2
+
+    slot = pool.claim("alice", "alice-dev")
+    assert slot.ssh_port and slot.name.startswith("warm-")
+    assert runtime.status("alice-dev") == "running"
+    assert runtime.containers["alice-dev"]['HostConfig']['PortBindings'] == {"22/tcp": slot.ssh_port}
+    name, cmd = runtime.exec_calls[-1]
+    assert name == slot.name
+    assert cmd[:2] == ["bash", "-c"] and cmd[-2:] == ["claim", "alice"]
+    assert container_readiness.get_state("alice-dev") == container_readiness.STATE_STARTING
+
+    # Pool được bổ sung lại để giữ đủ kích thước mục tiêu
+    pool.refill()
+    assert pool.stats() == {'target': 2, 'ready': 1, 'starting': 1}
+
+
+def test_failed_claim_discards_container(runtime):
+    """Container gắn user thất bại bị xóa, claim thử container kế tiếp."""
+    pool = _pool()
+    pool._thread = object()
+    pool.refill()
+    runtime.provisioned.update(runtime.containers)
+    pool.refill()
+    broken = pool._ready[0].name
+
+    def handler(name, cmd):
+        if cmd[-2:] == ["claim", "bob"] and name == broken:
+            return ExecResult(1, '', 'mount failed')
+        return ExecResult(0, '', '')
+
+    runtime.exec_handler = handler
+    assert pool.claim("bob", "bob-dev")
+    assert broken not in runtime.containers
+    assert "bob-dev" in runtime.containers
+
+
+def test_claim_fails_closed_when_root_stays_mounted(tmp_path):
+    """Không gỡ được thư mục gốc workspace: claim thất bại, không tạo user, không chạy sshd."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fakes = {"mountpoint": "exit 0", "mount": "exit 0", "umount": "exit 1"}
+    for name in ("useradd", "chpasswd", "usermod", "chown", "pgrep", "sshd"):
+        fakes[name] = f'echo {name} >> "{tmp_path}/called"'
+    for name, body in fakes.items():
+        (bin_dir / name).write_text(f"#!/bin/sh\n{body}\n")
+        (bin_dir / name).chmod(0o755)
+    script = warm_script().replace(STARTUP_PHASES_FILE, str(tmp_path / "phases")).replace("/usr/sbin/sshd", "sshd")
+    result = subprocess.run(["bash", "-c", script, "warm", "claim", "alice"], capture_output=True, text=True,
+                            env={**os.environ, "PATH": f"{bin_dir}:/usr/bin:/bin"}, timeout=30)
+    assert result.returncode == 1 and "cannot unmount" in result.stderr
+    assert not (tmp_path / "called").exists()
+
+
+def test_disabled_pool_is_a_miss(runtime):
+    pool = _pool(size=0)
+    pool.refill()
+    assert pool.claim("carol", "carol-dev") is None
+    assert runtime.containers == {}
@@ -0,0 +1,175 @@
+import os
+import pytest
+from services.workspace_storage import LocalWorkspaceBackend
+from services.workspace_manager import list_workspace_files, load_workspace_file, save_workspace_file, run_workspace_batch
+
+
+@pytest.fixture
+def fs(tmp_path):
+    root = tmp_path / "alice"
+    root.mkdir()
+    return LocalWorkspaceBackend(str(root))
+
+
+def test_local_backend_roundtrip(fs):
+    """Driver bind-mount: lưu, đọc và liệt kê file không cần SSH."""
+    fs.mkdir("blink")
+    assert save_workspace_file("alice", "alice", fs, "blink", "blink.ino", "void setup() {}")["success"]
+    assert load_workspace_file("alice", "alice", fs, "blink", "blink.ino")["content"] == "void setup() {}"
+
+    listing = list_workspace_files("alice", "alice", fs, "blink")
+    assert [f["name"] for f in listing["files"]] == ["blink.ino"]
+    assert list_workspace_files("alice", "alice", fs, "missing")["status_code"] == 404
+
+
+def test_local_backend_blocks_symlink_escape(fs, tmp_path):
+    """Symlink tạo trong container không được dùng để đọc/ghi file ngoài home trên host."""
+    secret = tmp_path / "secret.txt"
+    secret.write_text("host only")
+    os.symlink(str(secret), os.path.join(fs.root, "link.txt"))
+
+    with pytest.raises(PermissionError):
+        fs.read_bytes("link.txt")
+    with open(__file__, "rb") as f, pytest.raises(OSError):
+        fs.upload(f, "link.txt")
+    assert secret.read_text() == "host only"
+
+
+def test_batch_atomic_rollback(fs):
+    """Batch atomic: một thao tác lỗi thì các thao tác trước được hoàn tác, file bị xóa được trả lại."""
+    fs.write_bytes("old.ino", b"keep me")
+    result = run_workspace_batch("alice", "alice", fs, [
+        {"op": "create_folder", "path": ".", "folder_name": "mission_1"},
+        {"op": "new_file", "path": "mission_1", "filename": "mission_1", "content": "// template"},
+        {"op": "delete", "path": "old.ino"},
+        {"op": "rename", "old_path": "missing.ino", "new_name": "x.ino"},
+    ], atomic=True)
+
+    assert not result["success"] and result["rolled_back"]
+    assert [r["success"] for r in result["results"]] == [True, True, True, False]
+    assert sorted(os.listdir(fs.root)) == ["old.ino"]
+    assert fs.read_bytes("old.ino") == b"keep me"
+
+
+def test_listing_cache_invalidation(tmp_path):
+    """Cache danh sách thư mục: ghi qua API và ghi từ terminal (inotify/mtime) đều làm mới kết quả."""
+    import time
+    from services.workspace_manager import listing_cache, LISTING_CACHE_REQUESTS
+
+    root = tmp_path / "carol"
+    (root / "src").mkdir(parents=True)
+    fs = LocalWorkspaceBackend(str(root), owner="carol")
+    os.utime(root / "src", (time.time() - 5, time.time() - 5))
+
+    def names():
+        return [f["name"] for f in list_workspace_files("carol", "carol", fs, "src")["files"]]
+
+    hits = LISTING_CACHE_REQUESTS.labels(result='hit')
+    assert names() == []
+    before = hits._value.get()
+    assert names() == []
+    assert hits._value.get() == before + 1
+
+    save_workspace_file("carol", "carol", fs, "src", "a.ino", "x")
+    assert names() == ["a.ino"]
+
+    # File tạo ngoài API (terminal trong container)
+    (root / "src" / "b.ino").write_text("y")
+    deadline = time.time() + 3
+    while names() != ["a.ino", "b.ino"] and time.time() < deadline:
+        time.sleep(0.05)
+    assert names() == ["a.ino", "b.ino"]
+    listing_cache.clear()
+
+
+class _ShellClient:
+    """exec_command chạy thẳng trên máy test (thay cho SSH vào container)"""
+
+    def exec_command(self, cmd):
+        import io
+        import subprocess
+        state = {"input": b""}
+
+        class Stdout(io.RawIOBase):
+            proc = None
+
+            def _run(self):
+                if self.proc is None:
+                    self.proc = subprocess.run(cmd, shell=True, input=state["input"], capture_output=True)
+                    self.buf = io.BytesIO(self.proc.stdout)
+                return self.proc
+
+            def read(self, n=-1):
+                self._run()
+                return self.buf.read(n)
+
+            @property
+            def channel(self):
+                return type("Channel", (), {"recv_exit_status": lambda _: self._run().returncode})()
+
+        stdout = Stdout()
+        stdin = type("Stdin", (), {
+            "write": lambda _, data: state.__setitem__("input", state["input"] + data),
+            "channel": type("Channel", (), {"shutdown_write": lambda _: None})(),
+        })()
+        stderr = type("Stderr", (), {"read": lambda _: stdout._run().stderr})()
+        return stdin, stdout, stderr
+
+
+def test_manifest_same_for_find_and_local_scan(fs):
+    """Manifest cây thư mục: một lệnh find (SFTP) cho kết quả giống quét local, lọc đúng thư mục loại trừ."""
+    from services.workspace_storage import SFTPWorkspaceBackend
+    from services.workspace_manager import build_workspace_manifest, list_source_files
+
+    for d in ("blink", "blink/src", "libraries", "libraries/DHT", ".git", "Arduino"):
+        fs.mkdir(d)
+    for f in ("blink/blink.ino", "blink/src/util.h", "libraries/DHT/DHT.h", ".git/x.c", "Arduino/y.c", "notes tab\t.txt"):
+        fs.write_bytes(f, b"//")
+
+    remote = SFTPWorkspaceBackend(_ShellClient(), fs.root)
+    assert build_workspace_manifest(remote) == build_workspace_manifest(fs)
+
+    tree = {f["path"]: f for f in build_workspace_manifest(fs)}
+    assert sorted(tree) == ["/blink", "/blink/blink.ino", "/blink/src", "/blink/src/util.h", "/libraries", "/notes tab\t.txt"]
+    assert tree["/libraries"]["partial"] and not tree["/blink"]["partial"]
+    assert [f["path"] for f in list_source_files(remote)] == ["/blink/blink.ino", "/blink/src/util.h"]
+    assert [f["path"] for f in build_workspace_manifest(fs, "blink", max_depth=1)] == ["/blink/blink.ino", "/blink/src"]
+
+
+def test_snapshot_streams_and_hashes(fs):
+    """Snapshot nộp bài: một luồng tar từ container, hash cả file, nội dung bị cắt theo giới hạn."""
+    import hashlib
+    from services.workspace_storage import SFTPWorkspaceBackend
+    from services.workspace_manager import snapshot_source_files
+
+    fs.mkdir("blink")
+    big = b"x" * 70000
+    fs.write_bytes("blink/blink.ino", big)
+    fs.write_bytes("blink/util.h", "// ố".encode("utf-8"))
+
+    remote = SFTPWorkspaceBackend(_ShellClient(), fs.root)
+    files, elapsed_ms = snapshot_source_files(remote, content_limit=50000)
+    assert elapsed_ms >= 0
+    assert files == snapshot_source_files(fs, content_limit=50000)[0]
+
+    by_path = {f["path"]: f for f in files}
+    assert by_path["/blink/blink.ino"]["sha256"] == hashlib.sha256(big).hexdigest()
+    assert by_path["/blink/blink.ino"]["size"] == 70000 and by_path["/blink/blink.ino"]["truncated"]
+    assert len(by_path["/blink/blink.ino"]["content"]) == 50000
+    assert by_path["/blink/util.h"]["content"] == "// ố" and not by_path["/blink/util.h"]["truncated"]
+
+
+def test_save_with_version_and_patch(fs):
+    """Lưu theo phiên bản: patch áp dụng đúng (kể cả emoji), bản cũ bị từ chối 409."""
+    fs.write_bytes("a.ino", "int x = 1; // 😀 ok".encode("utf-8"))
+    loaded = load_workspace_file("alice", "alice", fs, ".", "a.ino")
+
+    # JS đếm emoji là 2 đơn vị UTF-16: "ok" bắt đầu ở offset 17
+    saved = save_workspace_file("alice", "alice", fs, ".", "a.ino", base_version=loaded["version"],
+                                patch=[{"start": 8, "end": 9, "text": "42"}, {"start": 17, "end": 19, "text": "done"}])
+    assert saved["success"]
+    assert fs.read_bytes("a.ino").decode("utf-8") == "int x = 42; // 😀 done"
+
+    stale = save_workspace_file("alice", "alice", fs, ".", "a.ino", "overwrite", base_version=loaded["version"])
+    assert stale["status_code"] == 409 and stale["current_version"] == saved["version"]
+    assert save_workspace_file("alice", "alice", fs, ".", "a.ino", "new", base_version=saved["version"])["success"]
@@ -1,12 +1,13 @@
 """
 Utils package initialization
 """
-from .helpers import make_safe_name, is_safe_path, find_free_port
+from .helpers import make_safe_name, is_safe_path, is_sketch_filename, find_free_port
 from .decorators import require_auth, require_rate_limit, require_internal_secret
 
 __all__ = [
     'make_safe_name',
     'is_safe_path', 
+    'is_sketch_filename',
     'find_free_port',
     'require_auth',
     'require_rate_limit',
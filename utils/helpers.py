@@ -20,6 +20,13 @@ def is_safe_path(basedir, path):
     target = os.path.abspath(os.path.join(basedir, path))
     return target.startswith(os.path.abspath(basedir))
 
+def is_sketch_filename(filename):
+    """Plain <stem>.ino / <stem>.cpp file name (no directory, no '.' or '..' in the stem)"""
+    if not filename or '/' in filename or '\\' in filename or '\0' in filename:
+        return False
+    stem, ext = os.path.splitext(filename)
+    return ext in ('.ino', '.cpp') and bool(stem) and '.' not in stem
+
 def find_free_port(start=2200, end=2299):
     """Find an available port in the given range"""
     for _ in range(100):